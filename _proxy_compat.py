@@ -1 +1,3 @@
 from proxy.proxy import *  # noqa: F401,F403
+# 旧版 proxy 模块中定义，现位于 proxy.rewrite
+from proxy.rewrite import get_default_system_prompt  # noqa: F401
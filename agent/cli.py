@@ -9,14 +9,15 @@ from pathlib import Path
 from typing import Optional
 
 import psutil
-import uvicorn
 
-from app.server import app
+from app import drain, workers
 
 APP_HOME = Path.home() / ".iflow2api"
 PID_FILE = APP_HOME / "agent.pid"
 TASK_NAME = "iFlow2API-Agent"
 DEFAULT_PORT = 8000
+# drain 超时之外再等待的秒数，之后强制结束
+STOP_GRACE_SECONDS = 10
 
 
 def _ensure_app_home() -> None:
@@ -37,15 +38,22 @@ def _write_pid(pid: int) -> None:
     PID_FILE.write_text(str(pid), encoding="utf-8")
 
 
-def _remove_pid() -> None:
-    if PID_FILE.exists():
-        PID_FILE.unlink()
+def _remove_pid(pid: Optional[int] = None) -> None:
+    """删除 pid 文件；指定 pid 时只在文件仍指向该进程时删除（重启后文件已属于新进程）"""
+    if not PID_FILE.exists():
+        return
+    if pid is not None and _read_pid() != pid:
+        return
+    PID_FILE.unlink()
 
 
 def _is_running(pid: Optional[int]) -> bool:
     if not pid:
         return False
-    return psutil.pid_exists(pid)
+    try:
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.Error:
+        return False
 
 
 def _get_python_executable() -> str:
@@ -61,28 +69,33 @@ def _agent_entry_path() -> str:
     return str(Path(__file__).resolve().parents[1] / "iflow_agent.py")
 
 
-def _run_argv(port: int) -> list[str]:
+def _run_argv(port: int, worker_count: int = 1) -> list[str]:
+    args = ["run", "--port", str(port), "--workers", str(worker_count)]
     if getattr(sys, "frozen", False):
-        return [sys.executable, "run", "--port", str(port)]
-    return [sys.executable, _agent_entry_path(), "run", "--port", str(port)]
+        return [sys.executable, *args]
+    return [sys.executable, _agent_entry_path(), *args]
 
 
-def _autostart_command(port: int) -> str:
+def _autostart_command(port: int, worker_count: int = 1) -> str:
     if getattr(sys, "frozen", False):
-        return f'"{sys.executable}" run --port {port}'
-    return f'"{_get_python_executable()}" "{_agent_entry_path()}" run --port {port}'
+        return f'"{sys.executable}" run --port {port} --workers {worker_count}'
+    return f'"{_get_python_executable()}" "{_agent_entry_path()}" run --port {port} --workers {worker_count}'
 
 
-def cmd_run(port: int) -> int:
+def cmd_run(port: int, worker_count: int = 1) -> int:
     existing_pid = _read_pid()
-    if _is_running(existing_pid) and existing_pid != os.getpid():
+    # 零停机重启时由旧进程启动，旧进程 drain 完成后自行退出
+    handoff_parent = os.getppid() if workers.is_handoff_child() else None
+    if _is_running(existing_pid) and existing_pid not in (os.getpid(), handoff_parent):
         print(f"iFlow2API agent is already running (pid={existing_pid})")
         return 1
 
-    _write_pid(os.getpid())
+    pid = os.getpid()
+    _write_pid(pid)
 
+    # uvicorn 运行期间自行处理 SIGINT / SIGTERM（drain 后退出），之后再调用这里
     def _cleanup(*_args):
-        _remove_pid()
+        _remove_pid(pid)
         sys.exit(0)
 
     signal.signal(signal.SIGINT, _cleanup)
@@ -90,13 +103,13 @@ def cmd_run(port: int) -> int:
         signal.signal(signal.SIGTERM, _cleanup)
 
     try:
-        uvicorn.run(app, host="0.0.0.0", port=port, log_config=None)
+        workers.run_uvicorn("0.0.0.0", port, workers=worker_count, log_config=None)
     finally:
-        _remove_pid()
+        _remove_pid(pid)
     return 0
 
 
-def cmd_start(port: int) -> int:
+def cmd_start(port: int, worker_count: int = 1) -> int:
     existing_pid = _read_pid()
     if _is_running(existing_pid):
         print(f"iFlow2API agent is already running (pid={existing_pid})")
@@ -107,7 +120,7 @@ def cmd_start(port: int) -> int:
         creationflags = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
 
     subprocess.Popen(
-        _run_argv(port),
+        _run_argv(port, worker_count),
         creationflags=creationflags,
         close_fds=True,
         stdout=subprocess.DEVNULL,
@@ -138,19 +151,57 @@ def cmd_stop() -> int:
 
     try:
         proc = psutil.Process(pid)
+        # SIGTERM 触发 drain：进行中的请求与流最多再运行 drain.DRAIN_TIMEOUT 秒
         proc.terminate()
-        proc.wait(timeout=10)
+        print(f"Draining iFlow2API agent (pid={pid}, up to {drain.DRAIN_TIMEOUT}s)...")
+        proc.wait(timeout=drain.DRAIN_TIMEOUT + STOP_GRACE_SECONDS)
     except psutil.TimeoutExpired:
         proc.kill()
     except psutil.NoSuchProcess:
         pass
     finally:
-        _remove_pid()
+        _remove_pid(pid)
 
     print("iFlow2API agent stopped")
     return 0
 
 
+def cmd_restart(port: int, worker_count: int = 1) -> int:
+    """零停机重启：新进程接管监听 socket 后旧进程 drain 退出（见 app.handoff）"""
+    pid = _read_pid()
+    if not _is_running(pid):
+        print("iFlow2API agent is not running, starting it")
+        return cmd_start(port, worker_count)
+
+    if not workers.supports_handoff():
+        cmd_stop()
+        return cmd_start(port, worker_count)
+
+    from app import handoff
+
+    os.kill(pid, signal.SIGUSR2)
+    deadline = time.monotonic() + handoff.HANDOFF_READY_TIMEOUT + drain.DRAIN_TIMEOUT + STOP_GRACE_SECONDS
+    new_pid = None
+    while time.monotonic() < deadline:
+        time.sleep(0.2)
+        current = _read_pid()
+        if current != pid and _is_running(current):
+            new_pid = current
+        if not _is_running(pid):
+            if new_pid:
+                print(f"iFlow2API agent restarted (pid={pid} -> {new_pid})")
+                return 0
+            break
+        if new_pid and not _is_running(new_pid):
+            # 新进程启动失败，旧进程继续服务
+            _write_pid(pid)
+            print(f"Restart failed, agent keeps running (pid={pid})")
+            return 1
+
+    print("Restart did not complete, check the agent log")
+    return 1
+
+
 def cmd_status() -> int:
     pid = _read_pid()
     if _is_running(pid):
@@ -168,11 +219,11 @@ def _run_schtasks(args: list[str]) -> tuple[int, str]:
     return result.returncode, output
 
 
-def cmd_install_autostart(port: int) -> int:
+def cmd_install_autostart(port: int, worker_count: int = 1) -> int:
     if platform.system() != "Windows":
         print("Autostart install is only supported on Windows")
         return 1
-    command = _autostart_command(port)
+    command = _autostart_command(port, worker_count)
     code, output = _run_schtasks(
         ["schtasks", "/Create", "/TN", TASK_NAME, "/SC", "ONLOGON", "/TR", command, "/F"]
     )
@@ -201,15 +252,22 @@ def build_parser() -> argparse.ArgumentParser:
 
     p_run = sub.add_parser("run", help="run in foreground")
     p_run.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p_run.add_argument("--workers", type=int, default=1, help="number of worker processes")
 
     p_start = sub.add_parser("start", help="start in background")
     p_start.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p_start.add_argument("--workers", type=int, default=1, help="number of worker processes")
 
     sub.add_parser("stop", help="stop background process")
+
+    p_restart = sub.add_parser("restart", help="restart without dropping connections (Linux/macOS)")
+    p_restart.add_argument("--port", type=int, default=DEFAULT_PORT, help="port used if the agent has to be started")
+    p_restart.add_argument("--workers", type=int, default=1, help="number of worker processes")
     sub.add_parser("status", help="show running status")
 
     p_install = sub.add_parser("install-autostart", help="install Windows autostart task")
     p_install.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p_install.add_argument("--workers", type=int, default=1, help="number of worker processes")
 
     sub.add_parser("uninstall-autostart", help="remove Windows autostart task")
     return parser
@@ -220,15 +278,17 @@ def main() -> int:
     args = parser.parse_args()
 
     if args.command == "run":
-        return cmd_run(args.port)
+        return cmd_run(args.port, args.workers)
     if args.command == "start":
-        return cmd_start(args.port)
+        return cmd_start(args.port, args.workers)
     if args.command == "stop":
         return cmd_stop()
+    if args.command == "restart":
+        return cmd_restart(args.port, args.workers)
     if args.command == "status":
         return cmd_status()
     if args.command == "install-autostart":
-        return cmd_install_autostart(args.port)
+        return cmd_install_autostart(args.port, args.workers)
     if args.command == "uninstall-autostart":
         return cmd_uninstall_autostart()
 
@@ -1,3 +1,19 @@
-from .server import app, run_server, request_logs, stats, CONFIG
+"""服务端包
+
+子模块按需导入：``from app import drain, workers`` 不会加载 Web 框架；访问 ``app.app`` 等
+名称时才导入 app.server。
+"""
 
 __all__ = ["app", "run_server", "request_logs", "stats", "CONFIG"]
+
+
+def __getattr__(name):
+    if name == "run_server":
+        from app.workers import run_server
+
+        return run_server
+    if name in __all__:
+        from app import server
+
+        return getattr(server, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
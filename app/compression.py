@@ -0,0 +1,267 @@
+"""客户端传输压缩
+
+- 请求体：支持 ``Content-Encoding: gzip / deflate / zstd``（zstd 需要可选依赖
+  ``zstandard``），由 app.ingest 按块流式解压，解压后的大小同样受请求体上限约束，
+  每次解压的输出有上限，压缩炸弹不会一次性展开。
+- 响应：按 ``Accept-Encoding`` 协商（zstd 优先，其次 gzip）。非流式的 JSON / 文本
+  响应整体压缩；SSE 默认不压缩，设置 IFLOW2API_SSE_COMPRESSION=1 后按每次 flush
+  压缩（同步刷新，事件不会因压缩而延迟）。
+- 压缩耗时与节省的字节数见 /admin/sysinfo 的 ``compression``。
+
+环境变量：IFLOW2API_COMPRESS_MIN_BYTES（小于此大小的响应不压缩，默认 1024）、
+IFLOW2API_SSE_COMPRESSION。
+"""
+
+import os
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+from core.codecs import (
+    Decoder,
+    Encoder,
+    available_encodings,
+    compress_bytes,
+    parse_content_encoding,
+)
+
+MIN_SIZE_ENV = "IFLOW2API_COMPRESS_MIN_BYTES"
+SSE_ENV = "IFLOW2API_SSE_COMPRESSION"
+DEFAULT_MIN_SIZE = 1024
+
+# 超过此大小的响应在线程池中压缩（zlib / zstd 压缩时释放 GIL）
+OFFLOAD_BYTES = 512 * 1024
+# 非流式响应最多缓冲这么多字节再整体压缩，超出后改为逐块压缩
+BUFFER_LIMIT = 8 * 1024 * 1024
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+MIN_SIZE = _env_int(MIN_SIZE_ENV, DEFAULT_MIN_SIZE)
+SSE_COMPRESSION = os.environ.get(SSE_ENV, "").lower() in ("1", "true", "yes", "on")
+
+
+@lru_cache(maxsize=64)
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """按 Accept-Encoding 选择响应编码；不接受任何可用编码时返回 None"""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name.strip()] = quality
+    best = None
+    best_quality = 0.0
+    for encoding in available_encodings():
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class CompressionTotals:
+    """进程内累计，供 /admin/sysinfo 展示"""
+
+    def __init__(self):
+        self.responses = 0
+        self.sse_streams = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        self.by_encoding: Dict[str, int] = {}
+
+    def count(self, encoding: str, stream: bool = False) -> None:
+        if stream:
+            self.sse_streams += 1
+        else:
+            self.responses += 1
+        self.by_encoding[encoding] = self.by_encoding.get(encoding, 0) + 1
+
+    def record(self, bytes_in: int, bytes_out: int, seconds: float) -> None:
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.seconds += seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "responses": self.responses,
+            "sse_streams": self.sse_streams,
+            "by_encoding": dict(self.by_encoding),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "compress_ms": round(self.seconds * 1000, 1),
+            "sse_enabled": SSE_COMPRESSION,
+            "min_size": MIN_SIZE,
+            "available": list(available_encodings()),
+        }
+
+
+totals = CompressionTotals()
+
+
+def request_decoder(content_encoding: Optional[str]) -> Optional[Decoder]:
+    """按请求的 Content-Encoding 创建解码器；未压缩时返回 None，不支持时抛出 UnsupportedEncoding"""
+    encoding = parse_content_encoding(content_encoding)
+    return Decoder(encoding) if encoding else None
+
+
+# ---- 响应压缩中间件 ----
+
+def _compressible(content_type: str) -> bool:
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """按 Accept-Encoding 压缩响应（纯 ASGI，SSE 不缓冲）"""
+
+    def __init__(self, app, minimum_size: Optional[int] = None, sse: Optional[bool] = None):
+        self.app = app
+        self.minimum_size = MIN_SIZE if minimum_size is None else minimum_size
+        self.sse = SSE_COMPRESSION if sse is None else sse
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _Responder(send, encoding, self.minimum_size, self.sse).send)
+
+
+class _Responder:
+
+    def __init__(self, send, encoding: str, minimum_size: int, sse: bool):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.sse = sse
+        self._start: Optional[Dict[str, Any]] = None
+        self._headers: Optional[MutableHeaders] = None
+        # None: 尚未决定；"pass": 原样转发；"buffer": 非流式响应，收齐后整体压缩；"stream": 逐块压缩
+        self._mode: Optional[str] = None
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self._encoder: Optional[Encoder] = None
+
+    async def send(self, message: Dict[str, Any]) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            self._start = message
+            return
+        if message_type != "http.response.body" or self._mode == "pass":
+            await self._flush_start()
+            await self._send(message)
+            return
+        if self._mode is None:
+            self._mode = self._choose_mode(message)
+            if self._mode == "pass":
+                await self._flush_start()
+                await self._send(message)
+                return
+        if self._mode == "stream":
+            await self._send_stream(message)
+            return
+
+        # buffer：JSON 等响应可能经由中间件分成多段发送，收齐后整体压缩
+        body = message.get("body", b"")
+        if body:
+            self._buffer.append(body)
+            self._buffered += len(body)
+        if message.get("more_body", False):
+            if self._buffered > BUFFER_LIMIT:
+                # 实际上是长响应：改为逐块压缩，不再继续缓冲
+                self._begin_stream(stream=False)
+                await self._flush_start()
+                await self._send_stream({"body": self._take_buffer(), "more_body": True})
+            return
+        await self._send_whole(self._take_buffer())
+
+    def _choose_mode(self, message: Dict[str, Any]) -> str:
+        headers = self._headers = MutableHeaders(scope=self._start)
+        content_type = headers.get("content-type", "")
+        if (
+            "content-encoding" in headers
+            or self._start["status"] in (204, 206, 304)
+            or not _compressible(content_type)
+        ):
+            return "pass"
+        if content_type.startswith("text/event-stream"):
+            if not self.sse:
+                return "pass"
+            headers.add_vary_header("Accept-Encoding")
+            self._begin_stream(stream=True)
+            return "stream"
+        headers.add_vary_header("Accept-Encoding")
+        return "buffer"
+
+    def _begin_stream(self, stream: bool) -> None:
+        self._mode = "stream"
+        self._encoder = Encoder(self.encoding)
+        self._headers["Content-Encoding"] = self.encoding
+        if "content-length" in self._headers:
+            del self._headers["content-length"]
+        totals.count(self.encoding, stream=stream)
+
+    def _take_buffer(self) -> bytes:
+        body = b"".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        return body
+
+    async def _send_whole(self, body: bytes) -> None:
+        if len(body) >= self.minimum_size:
+            started = time.perf_counter()
+            if len(body) >= OFFLOAD_BYTES:
+                compressed = await run_in_threadpool(compress_bytes, body, self.encoding)
+            else:
+                compressed = compress_bytes(body, self.encoding)
+            totals.count(self.encoding)
+            totals.record(len(body), len(compressed), time.perf_counter() - started)
+            self._headers["Content-Encoding"] = self.encoding
+            etag = self._headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                # 压缩后的表示与原表示字节不同，强 ETag 改为弱 ETag
+                self._headers["ETag"] = "W/" + etag
+            body = compressed
+        if "content-length" in self._headers:
+            self._headers["Content-Length"] = str(len(body))
+        await self._flush_start()
+        await self._send({"type": "http.response.body", "body": body, "more_body": False})
+
+    async def _flush_start(self) -> None:
+        if self._start is not None:
+            start, self._start = self._start, None
+            await self._send(start)
+
+    async def _send_stream(self, message: Dict[str, Any]) -> None:
+        if self._start is not None:
+            await self._flush_start()
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        started = time.perf_counter()
+        data = self._encoder.compress(body) if body else b""
+        if not more_body:
+            data += self._encoder.finish()
+        totals.record(len(body), len(data), time.perf_counter() - started)
+        if data or not more_body:
+            await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
@@ -0,0 +1,306 @@
+"""截断自动续写
+
+上游因 max_tokens 截断（finish_reason == "length"）时自动发起续写请求，OpenAI 与
+Anthropic 路由共用同一套逻辑。
+
+每轮续写请求都是调用方请求体的浅拷贝：原始消息 + 一条包含全部已生成内容的
+assistant 消息，既不修改调用方的请求体，也不会把各轮输出重复堆叠进消息列表。
+已生成内容以片段列表保存，只在真正发起续写时拼接一次。续写次数与总输出 token
+都有上限，各轮的 usage 合并为一份返回给客户端。
+"""
+
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from core import json_codec
+from core.tokens import text_weight, weight_to_tokens
+
+logger = logging.getLogger(__name__)
+
+MAX_CONTINUATIONS = 5
+# 单个请求（含全部续写轮次）的输出 token 上限；客户端指定的 max_tokens 更小时以其为准
+MAX_TOTAL_COMPLETION_TOKENS = 32768
+# 剩余预算不足以完成一轮有意义的续写时不再续写
+MIN_ROUND_TOKENS = 256
+DEFAULT_ROUND_MAX_TOKENS = 4096
+
+DONE_CHUNK = b"data: [DONE]\n\n"
+
+SendRequest = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+OpenStream = Callable[[Dict[str, Any]], Awaitable[AsyncIterator[bytes]]]
+# 估算的 prompt token；可传入函数，上游返回了 usage 时不必计数
+PromptEstimate = Union[int, Callable[[], int]]
+
+
+def first_choice(data: Any) -> Dict[str, Any]:
+    """取第一个 choice；usage chunk 等 choices 为空的情况返回空字典"""
+    if not isinstance(data, dict):
+        return {}
+    choices = data.get("choices")
+    if choices and isinstance(choices, list) and isinstance(choices[0], dict):
+        return choices[0]
+    return {}
+
+
+def _as_int(value: Any) -> int:
+    try:
+        return max(0, int(value or 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+class ContinuationState:
+    """一次请求的续写簿记：轮数、输出预算、已生成内容与合并后的 usage"""
+
+    def __init__(
+        self,
+        body: Dict[str, Any],
+        max_total_tokens: Optional[int] = None,
+        max_continuations: int = MAX_CONTINUATIONS,
+    ):
+        self.body = body
+        self.max_continuations = max_continuations
+        self.round_max_tokens = _as_int(body.get("max_tokens")) or DEFAULT_ROUND_MAX_TOKENS
+        requested = _as_int(max_total_tokens)
+        self.budget = min(requested, MAX_TOTAL_COMPLETION_TOKENS) if requested else MAX_TOTAL_COMPLETION_TOKENS
+        self.continuations = 0
+        self.content_pieces: List[str] = []
+        self.reasoning_pieces: List[str] = []
+        self.completion_tokens = 0
+        self.reasoning_tokens = 0
+        self.prompt_tokens: Optional[int] = None
+        self.prompt_details: Optional[Dict[str, Any]] = None
+        self.saw_usage = False
+        self._round_weight = 0.0
+        self._round_usage: Optional[Dict[str, Any]] = None
+        self._round_tool_calls = False
+
+    # ---- 单轮内的记录 ----
+
+    def add_content(self, text: Any) -> None:
+        if isinstance(text, str) and text:
+            self.content_pieces.append(text)
+            self._round_weight += text_weight(text)
+
+    def add_reasoning(self, text: Any) -> None:
+        if isinstance(text, str) and text:
+            self.reasoning_pieces.append(text)
+            self._round_weight += text_weight(text)
+
+    def add_tool_calls(self, tool_calls: Any) -> None:
+        if not tool_calls:
+            return
+        self._round_tool_calls = True
+        for tool_call in tool_calls:
+            function = tool_call.get("function") if isinstance(tool_call, dict) else None
+            if isinstance(function, dict) and isinstance(function.get("arguments"), str):
+                self._round_weight += text_weight(function["arguments"])
+
+    def add_usage(self, usage: Any) -> None:
+        if isinstance(usage, dict):
+            self._round_usage = usage
+
+    # ---- 轮次结束 ----
+
+    @property
+    def remaining_tokens(self) -> int:
+        return max(0, self.budget - self.completion_tokens)
+
+    def finish_round(self, finish_reason: Optional[str]) -> bool:
+        """结算本轮 usage，返回是否需要续写"""
+        usage = self._round_usage
+        if usage is not None:
+            self.saw_usage = True
+            self.completion_tokens += _as_int(usage.get("completion_tokens"))
+            details = usage.get("completion_tokens_details")
+            if isinstance(details, dict):
+                self.reasoning_tokens += _as_int(details.get("reasoning_tokens"))
+            if self.prompt_tokens is None:
+                # 客户端看到的是原始请求的 prompt；续写轮次重发的已生成内容不计入
+                self.prompt_tokens = _as_int(usage.get("prompt_tokens"))
+                if isinstance(usage.get("prompt_tokens_details"), dict):
+                    self.prompt_details = usage["prompt_tokens_details"]
+        else:
+            self.completion_tokens += weight_to_tokens(self._round_weight)
+
+        had_tool_calls = self._round_tool_calls
+        self._round_weight = 0.0
+        self._round_usage = None
+        self._round_tool_calls = False
+
+        if finish_reason != "length" or had_tool_calls:
+            return False
+        if self.continuations >= self.max_continuations:
+            logger.info(f"输出被截断，已达续写次数上限 ({self.max_continuations})")
+            return False
+        if self.remaining_tokens < MIN_ROUND_TOKENS:
+            logger.info(f"输出被截断，输出 token 预算已用尽 ({self.completion_tokens}/{self.budget})")
+            return False
+        self.continuations += 1
+        logger.info(f"输出被截断，自动续写 ({self.continuations}/{self.max_continuations})")
+        return True
+
+    def next_body(self) -> Dict[str, Any]:
+        """构造下一轮请求体（浅拷贝，不修改调用方的请求体）"""
+        assistant_msg: Dict[str, Any] = {"role": "assistant", "content": "".join(self.content_pieces)}
+        if self.reasoning_pieces:
+            assistant_msg["reasoning_content"] = "".join(self.reasoning_pieces)
+        next_body = dict(self.body)
+        next_body["messages"] = list(self.body.get("messages") or []) + [assistant_msg]
+        next_body["max_tokens"] = min(self.round_max_tokens, self.remaining_tokens)
+        return next_body
+
+    def merged_usage(self, estimated_prompt_tokens: PromptEstimate = 0) -> Dict[str, Any]:
+        prompt_tokens = self.prompt_tokens
+        if prompt_tokens is None:
+            if callable(estimated_prompt_tokens):
+                estimated_prompt_tokens = estimated_prompt_tokens()
+            prompt_tokens = max(0, int(estimated_prompt_tokens or 0))
+        usage: Dict[str, Any] = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": prompt_tokens + self.completion_tokens,
+        }
+        if self.prompt_details:
+            usage["prompt_tokens_details"] = self.prompt_details
+        if self.reasoning_tokens:
+            usage["completion_tokens_details"] = {"reasoning_tokens": self.reasoning_tokens}
+        return usage
+
+
+async def complete(
+    send: SendRequest,
+    body: Dict[str, Any],
+    max_total_tokens: Optional[int] = None,
+) -> Dict[str, Any]:
+    """非流式请求：截断时续写并合并为一个响应"""
+    state = ContinuationState(body, max_total_tokens=max_total_tokens)
+    round_body = body
+    while True:
+        data = await send(round_body)
+        choice = first_choice(data)
+        message = choice.get("message") or {}
+        state.add_content(message.get("content"))
+        state.add_reasoning(message.get("reasoning_content"))
+        state.add_tool_calls(message.get("tool_calls"))
+        state.add_usage(data.get("usage"))
+        if not state.finish_round(choice.get("finish_reason")):
+            break
+        round_body = state.next_body()
+
+    if not state.continuations:
+        return data
+
+    merged_message = dict(message)
+    merged_message["content"] = "".join(state.content_pieces)
+    if state.reasoning_pieces:
+        merged_message["reasoning_content"] = "".join(state.reasoning_pieces)
+    merged_choice = dict(choice)
+    merged_choice["message"] = merged_message
+    merged = dict(data)
+    merged["choices"] = [merged_choice] + list(data.get("choices") or [])[1:]
+    if state.saw_usage:
+        merged["usage"] = state.merged_usage()
+    return merged
+
+
+def _encode_chunk(data: Dict[str, Any]) -> bytes:
+    return b"data: " + json_codec.dumps(data) + b"\n\n"
+
+
+async def stream(
+    open_stream: OpenStream,
+    body: Dict[str, Any],
+    model: str,
+    fallback_id: str,
+    estimated_prompt_tokens: PromptEstimate = 0,
+    max_total_tokens: Optional[int] = None,
+) -> AsyncIterator[Tuple[bytes, Optional[Dict[str, Any]]]]:
+    """流式请求：把各轮上游流拼接为一个连续的 OpenAI 流
+
+    产出 ``(chunk, data)``：chunk 为可直接转发的 SSE 字节，data 为已解析的 JSON
+    （无法解析的行与结尾的 [DONE] 为 None）。中间轮次的 "length" 结束标记会被去掉，
+    各轮 usage 合并后在 [DONE] 之前以一个 usage chunk 发出；上游没有返回 usage 时
+    按输出文本估算。
+    """
+    state = ContinuationState(body, max_total_tokens=max_total_tokens)
+    round_body = body
+    chunk_id = fallback_id
+    created: Optional[int] = None
+
+    while True:
+        finish_reason = None
+        # finish_reason == "length" 的 chunk 暂存到本轮结束，确定是否续写后再发出
+        held: Optional[Dict[str, Any]] = None
+
+        async for chunk in await open_stream(round_body):
+            if not chunk:
+                continue
+            if not chunk.startswith(b"data:"):
+                yield (chunk if chunk.endswith(b"\n\n") else chunk + b"\n\n"), None
+                continue
+            payload = chunk[5:].strip()
+            if payload == b"[DONE]":
+                continue
+            try:
+                data = json_codec.loads(payload)
+            except Exception as e:
+                logger.warning(f"Parse chunk error: {e}")
+                yield (chunk if chunk.endswith(b"\n\n") else chunk + b"\n\n"), None
+                continue
+            if not isinstance(data, dict):
+                yield (chunk if chunk.endswith(b"\n\n") else chunk + b"\n\n"), None
+                continue
+
+            if data.get("id"):
+                chunk_id = data["id"]
+            if created is None and isinstance(data.get("created"), int):
+                created = data["created"]
+
+            choice = first_choice(data)
+            delta = choice.get("delta") or {}
+            if delta:
+                state.add_reasoning(delta.get("reasoning_content"))
+                state.add_content(delta.get("content"))
+                state.add_tool_calls(delta.get("tool_calls"))
+
+            rewrite = False
+            if "usage" in data:
+                state.add_usage(data.pop("usage"))
+                rewrite = True
+                if not choice:
+                    # 纯 usage chunk：合并后统一发出
+                    continue
+            if choice.get("finish_reason"):
+                finish_reason = choice["finish_reason"]
+                if finish_reason == "length":
+                    held = data
+                    continue
+
+            if rewrite:
+                yield _encode_chunk(data), data
+            else:
+                yield (chunk if chunk.endswith(b"\n\n") else chunk + b"\n\n"), data
+
+        should_continue = state.finish_round(finish_reason)
+        if held is not None:
+            if not should_continue:
+                yield _encode_chunk(held), held
+            elif first_choice(held).get("delta"):
+                first_choice(held)["finish_reason"] = None
+                yield _encode_chunk(held), held
+        if not should_continue:
+            break
+        round_body = state.next_body()
+
+    usage_data = {
+        "id": chunk_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()) if created is None else created,
+        "model": model,
+        "choices": [],
+        "usage": state.merged_usage(estimated_prompt_tokens),
+    }
+    yield _encode_chunk(usage_data), usage_data
+    yield DONE_CHUNK, None
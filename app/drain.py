@@ -0,0 +1,145 @@
+"""优雅退出（drain）
+
+收到 SIGTERM / SIGINT（重启时由旧进程在新进程就绪后发给自己）后进入 drain：
+
+- uvicorn 停止 accept：单独停止时新连接被拒绝，重启时由接管同一 socket 的新进程
+  accept（见 app.handoff）。空闲的 keep-alive 连接随后关闭。
+- 已在进行的请求与 SSE 流继续完成，最长 IFLOW2API_DRAIN_TIMEOUT 秒（默认 30），
+  超时后取消；/admin/events 等长连接推送立即结束，客户端重连到新进程。
+- drain 期间 /health 与 /ready 返回 503，便于负载均衡摘除本实例；停止 accept 前已建立
+  的连接上到达的请求照常处理。
+- 所有请求结束后在 lifespan 关闭阶段写完日志库、关闭上游连接（见 app.resources）。
+
+进行中的请求数与流数见 /admin/sysinfo 的 ``drain``。
+"""
+
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from core import json_codec
+
+logger = logging.getLogger(__name__)
+
+DRAIN_TIMEOUT_ENV = "IFLOW2API_DRAIN_TIMEOUT"
+DEFAULT_DRAIN_TIMEOUT = 30
+HEALTH_PATHS = ("/health", "/v1/health", "/ready", "/v1/ready")
+
+
+def _env_seconds(name: str, default: int) -> int:
+    try:
+        return max(0, int(float(os.environ.get(name, default))))
+    except ValueError:
+        return default
+
+
+DRAIN_TIMEOUT = _env_seconds(DRAIN_TIMEOUT_ENV, DEFAULT_DRAIN_TIMEOUT)
+
+
+class DrainState:
+
+    def __init__(self):
+        self.in_flight = 0
+        self.streams = 0
+        # drain 开始后仍到达并处理的请求数
+        self.late_requests = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """服务（重新）启动时清除 drain 标记（GUI 中可在同一进程内停止后再启动）"""
+        self.draining = False
+        self.reason = ""
+        self.started_at: Optional[float] = None
+
+    def begin(self, reason: str) -> None:
+        if self.draining:
+            return
+        self.draining = True
+        self.reason = reason
+        self.started_at = time.monotonic()
+        logger.info(f"开始 drain（{reason}）：进行中 {self.in_flight} 个请求 / {self.streams} 个流，最长等待 {DRAIN_TIMEOUT}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "draining": self.draining,
+            "reason": self.reason or None,
+            "elapsed_seconds": None if self.started_at is None else round(time.monotonic() - self.started_at, 1),
+            "timeout_seconds": DRAIN_TIMEOUT,
+            "in_flight": self.in_flight,
+            "streams": self.streams,
+            "late_requests": self.late_requests,
+        }
+
+
+state = DrainState()
+
+
+def install_signal_hooks() -> None:
+    """在 uvicorn 的 SIGTERM / SIGINT 处理之前标记 drain（需在 uvicorn 安装信号处理后调用）"""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        previous = signal.getsignal(sig)
+        if not callable(previous):
+            continue
+
+        def handler(signum, frame, previous=previous):
+            state.begin(signal.Signals(signum).name)
+            previous(signum, frame)
+
+        signal.signal(sig, handler)
+
+
+async def _send_draining(send) -> None:
+    body = json_codec.dumps({"status": "draining", "service": "iflow2api"})
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"connection", b"close"),
+            (b"retry-after", b"1"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class DrainMiddleware:
+    """统计进行中的请求；drain 期间 /health 与 /ready 返回 503（纯 ASGI）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if state.draining:
+            if scope["path"] in HEALTH_PATHS:
+                await _send_draining(send)
+                return
+            state.late_requests += 1
+
+        streaming = False
+
+        async def tracked_send(message):
+            nonlocal streaming
+            if message["type"] == "http.response.start" and not streaming:
+                for key, value in message.get("headers", ()):
+                    if key.lower() == b"content-type" and value.startswith(b"text/event-stream"):
+                        streaming = True
+                        state.streams += 1
+                        break
+            await send(message)
+
+        state.in_flight += 1
+        try:
+            await self.app(scope, receive, tracked_send)
+        finally:
+            state.in_flight -= 1
+            if streaming:
+                state.streams -= 1
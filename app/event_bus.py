@@ -0,0 +1,105 @@
+"""进程内事件总线
+
+请求日志与统计变化由服务端主动推送：SSE 订阅者（/admin/events）拿到已编码好的
+事件帧，进程内监听者（GUI）以回调形式收到 ``(event, data)``。没有订阅者时发布
+操作几乎没有开销，调用方可先检查 ``has_subscribers`` 再构造数据。
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, List, Optional
+
+from core import json_codec
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 256
+
+Listener = Callable[[str, Any], None]
+
+
+def encode_sse(event: str, data: Any) -> bytes:
+    return b"event: " + event.encode("ascii") + b"\ndata: " + json_codec.dumps(data) + b"\n\n"
+
+
+class Subscription:
+    """单个 SSE 订阅者；队列满时标记 overflowed，由消费方通知客户端重新同步"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue_size: int):
+        self.loop = loop
+        self.queue: "asyncio.Queue[bytes]" = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def _put(self, frame: bytes) -> None:
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self) -> bytes:
+        return await self.queue.get()
+
+
+class EventBus:
+
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscriptions: List[Subscription] = []
+        self._listeners: List[Listener] = []
+        self._lock = threading.Lock()
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscriptions or self._listeners)
+
+    def subscribe(self) -> Subscription:
+        """在当前事件循环中创建订阅"""
+        subscription = Subscription(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscriptions = [item for item in self._subscriptions if item is not subscription]
+
+    def add_listener(self, listener: Listener) -> None:
+        """注册同步回调（在发布者线程中调用，回调内不要阻塞）"""
+        with self._lock:
+            self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener: Listener) -> None:
+        with self._lock:
+            self._listeners = [item for item in self._listeners if item is not listener]
+
+    def publish(self, event: str, data: Any) -> None:
+        """发布事件；可在任意线程调用"""
+        # 订阅列表写时复制，这里读取快照即可，无需加锁
+        subscriptions = self._subscriptions
+        listeners = self._listeners
+        if subscriptions:
+            frame = encode_sse(event, data)
+            try:
+                current: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+            except RuntimeError:
+                current = None
+            for subscription in subscriptions:
+                if subscription.loop is current:
+                    subscription._put(frame)
+                elif not subscription.loop.is_closed():
+                    subscription.loop.call_soon_threadsafe(subscription._put, frame)
+        for listener in listeners:
+            try:
+                listener(event, data)
+            except Exception as e:
+                logger.warning(f"事件监听回调失败: {e}")
+
+
+_bus = EventBus()
+
+
+def get_event_bus() -> EventBus:
+    return _bus
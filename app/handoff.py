@@ -0,0 +1,215 @@
+"""零停机重启（Linux / macOS）
+
+监听 socket 由本进程创建，收到 SIGUSR2 时以相同命令行启动新进程并让其继承该 socket
+（IFLOW2API_LISTEN_FD），新进程开始服务且预热完成（见 app.resources）后通过管道
+（IFLOW2API_READY_FD）通知，旧进程随即 drain 退出（见 app.drain）。socket 始终处于监听
+状态，重启期间的新连接由新旧进程之一 accept；旧进程停止 accept 后还会等待
+ACCEPT_GRACE_SECONDS 再关闭空闲连接，刚 accept、请求尚未到达的连接也能得到响应。
+
+这里的 Server / Process / Supervisor 继承并替换了 uvicorn 的内部实现（Process.pong、
+child_conn、wait_until_ready、handle_usr2，supervisor 运行期间还替换 multiprocess 模块
+中的 Process），只在 app.workers.HANDOFF_UVICORN_MIN / MAX 范围内的版本上使用，其他
+版本回退到普通启动。
+
+由 app.workers.run_uvicorn 按需导入（导入 uvicorn）。
+"""
+
+import asyncio
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+from typing import Any, List, Optional
+
+import uvicorn
+from uvicorn.supervisors import multiprocess
+
+from app.workers import APP_IMPORT_PATH, LISTEN_FD_ENV, READY_FD_ENV
+
+logger = logging.getLogger(__name__)
+
+# 等待新进程开始服务的最长时间（秒）
+HANDOFF_READY_TIMEOUT = 60
+# 停止 accept 到关闭空闲连接之间的等待（秒）
+ACCEPT_GRACE_SECONDS = 1.0
+LISTEN_BACKLOG = 2048
+# 多 worker 时等待 worker 就绪（含预热，上限 app.resources.WARMUP_DEADLINE）与应答健康检查的时间
+WORKER_HEALTHCHECK_TIMEOUT = 20
+
+
+def _listen_socket(host: str, port: int) -> socket.socket:
+    """继承的监听 socket，或新建一个"""
+    fd = os.environ.pop(LISTEN_FD_ENV, "")
+    if fd:
+        sock = socket.socket(fileno=int(fd))
+        logger.info(f"接管监听 socket {sock.getsockname()}")
+        return sock
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.bind((host, port))
+        sock.listen(LISTEN_BACKLOG)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _notify_ready(fd: str) -> None:
+    """通知启动本进程的旧进程：已开始服务"""
+    if not fd:
+        return
+    try:
+        os.write(int(fd), b"1")
+        os.close(int(fd))
+    except OSError as e:
+        logger.warning(f"通知旧进程失败: {e}")
+
+
+def _restart_argv() -> List[str]:
+    if getattr(sys, "frozen", False):
+        return list(sys.argv)
+    return [sys.executable, *sys.argv]
+
+
+class Handoff:
+    """SIGUSR2：启动继承监听 socket 的新进程，就绪后本进程 drain 退出"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self._lock = threading.Lock()
+
+    def trigger(self, *_args: Any) -> None:
+        # 信号处理函数中只启动线程，等待新进程就绪不阻塞事件循环
+        threading.Thread(target=self._run, name="handoff", daemon=True).start()
+
+    def _run(self) -> None:
+        if not self._lock.acquire(blocking=False):
+            logger.info("重启已在进行中")
+            return
+        read_fd, write_fd = os.pipe()
+        env = dict(os.environ)
+        env[LISTEN_FD_ENV] = str(self.sock.fileno())
+        env[READY_FD_ENV] = str(write_fd)
+        try:
+            child = subprocess.Popen(_restart_argv(), env=env, pass_fds=(self.sock.fileno(), write_fd))
+        except OSError as e:
+            logger.error(f"重启失败，继续使用当前进程: {e}")
+            os.close(read_fd)
+            os.close(write_fd)
+            self._lock.release()
+            return
+        os.close(write_fd)
+        logger.info(f"已启动新进程 [{child.pid}]，等待其开始服务")
+        try:
+            readable, _, _ = select.select([read_fd], [], [], HANDOFF_READY_TIMEOUT)
+            # 新进程启动失败退出时管道关闭，读到空字节
+            ready = bool(readable) and os.read(read_fd, 1) == b"1" and child.poll() is None
+        finally:
+            os.close(read_fd)
+        if not ready:
+            logger.error(f"新进程 [{child.pid}] 未能在 {HANDOFF_READY_TIMEOUT}s 内开始服务，继续使用当前进程")
+            child.kill()
+            child.wait()
+            self._lock.release()
+            return
+        logger.info(f"新进程 [{child.pid}] 已接管监听 socket，当前进程开始 drain")
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+class Server(uvicorn.Server):
+    """停止 accept 后稍等再关闭空闲连接；预热完成后通知旧进程"""
+
+    ready_fd = ""
+    # 预热完成（见 app.resources）；多 worker 时 supervisor 据此判断 worker 就绪
+    warm = False
+
+    async def startup(self, sockets: Optional[list] = None) -> None:
+        await super().startup(sockets=sockets)
+        if self.started:
+            # 已开始 accept；预热在后台进行，不阻塞主循环
+            self._warm_task = asyncio.create_task(self._notify_when_warm())
+
+    async def _notify_when_warm(self) -> None:
+        from app.resources import resources
+
+        await resources.wait_ready()
+        self.warm = True
+        _notify_ready(self.ready_fd)
+
+    async def shutdown(self, sockets: Optional[list] = None) -> None:
+        for server in self.servers:
+            server.close()
+        if ACCEPT_GRACE_SECONDS:
+            await asyncio.sleep(ACCEPT_GRACE_SECONDS)
+        await super().shutdown(sockets=sockets)
+
+
+_UvicornProcess = multiprocess.Process
+
+
+class Process(multiprocess.Process):
+    """worker 进程同样使用上面的 Server，预热完成后才报告就绪"""
+
+    @property
+    def server(self) -> uvicorn.Server:
+        if self._server is None:
+            self._server = Server(config=self.config)
+        return self._server
+
+    def pong(self) -> None:
+        self.child_conn.recv()
+        self.child_conn.send(self.server.started and self.server.warm)
+
+
+class Supervisor(multiprocess.Multiprocess):
+
+    def __init__(self, config: uvicorn.Config, sockets: list, handoff: Handoff, ready_fd: str):
+        super().__init__(config, sockets=sockets)
+        self.handoff = handoff
+        self.ready_fd = ready_fd
+
+    def init_processes(self) -> None:
+        super().init_processes()
+        if self.ready_fd and all(
+            process.wait_until_ready(HANDOFF_READY_TIMEOUT, self.should_exit) for process in self.processes
+        ):
+            _notify_ready(self.ready_fd)
+
+    def handle_usr2(self) -> None:
+        self.handoff.trigger()
+
+
+def serve(host: str, port: int, workers: int, **kwargs: Any) -> None:
+    # 先取出，避免 worker 子进程与之后的重启继承
+    ready_fd = os.environ.pop(READY_FD_ENV, "")
+    if workers == 1:
+        from app.server import app
+
+        config = uvicorn.Config(app, host=host, port=port, **kwargs)
+    else:
+        kwargs.setdefault("timeout_worker_healthcheck", WORKER_HEALTHCHECK_TIMEOUT)
+        config = uvicorn.Config(APP_IMPORT_PATH, host=host, port=port, workers=workers, **kwargs)
+    sock = _listen_socket(host, port)
+    handoff = Handoff(sock)
+    try:
+        if workers == 1:
+            # uvicorn 只接管 SIGINT / SIGTERM，SIGUSR2 由这里处理
+            signal.signal(signal.SIGUSR2, handoff.trigger)
+            server = Server(config)
+            server.ready_fd = ready_fd
+            server.run(sockets=[sock])
+        else:
+            # Multiprocess 按模块中的 Process 创建 worker（启动、重启与替换挂掉的 worker）；
+            # 运行期间换成上面的子类，worker 也使用 Server，结束后恢复
+            multiprocess.Process = Process
+            # Multiprocess 自行接管信号，SIGUSR2 交给 handle_usr2
+            Supervisor(config, [sock], handoff, ready_fd).run()
+    finally:
+        multiprocess.Process = _UvicornProcess
+        sock.close()
@@ -0,0 +1,236 @@
+"""请求体读取
+
+按块读取请求体并直接以 bytes 解析 JSON，不再经过 ``request.body()`` 的整块拷贝与
+decode 成 str 的中间副本：
+
+- Content-Length 超过上限时不读取请求体，直接返回 413；分块传输的请求在读取过程中
+  超限同样中止。
+- 不超过 spool 阈值的请求体在内存中的 bytearray 里解析；更大的请求体（如大图片）写入
+  临时文件，再通过 mmap 解析，内存中只保留解析后的对象。
+- 每个请求记录请求体大小、是否落盘以及读取期间内存中缓冲的峰值字节数。
+
+- 带 ``Content-Encoding``（gzip / deflate / zstd，见 app.compression）的请求体按块流式
+  解压，上限与 spool 阈值都按解压后的大小计算，压缩炸弹在超限时即中止。
+
+上限可通过环境变量 IFLOW2API_MAX_BODY_MB / IFLOW2API_SPOOL_MB 调整。
+"""
+
+import mmap
+import os
+import tempfile
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Request
+
+from app import compression
+from core import codecs, json_codec
+
+MAX_BODY_ENV = "IFLOW2API_MAX_BODY_MB"
+SPOOL_ENV = "IFLOW2API_SPOOL_MB"
+DEFAULT_MAX_BODY_MB = 64
+DEFAULT_SPOOL_MB = 8
+
+
+def _env_megabytes(name: str, default: int) -> int:
+    try:
+        value = float(os.environ.get(name, default))
+    except ValueError:
+        value = default
+    return max(0, int(value * 1024 * 1024))
+
+
+MAX_BODY_BYTES = _env_megabytes(MAX_BODY_ENV, DEFAULT_MAX_BODY_MB)
+SPOOL_THRESHOLD_BYTES = _env_megabytes(SPOOL_ENV, DEFAULT_SPOOL_MB)
+
+
+class IngestError(Exception):
+    """请求体无法读取；status / error_type 用于生成错误响应"""
+    status = 400
+    error_type = "invalid_request_error"
+
+
+class BodyTooLarge(IngestError):
+    status = 413
+    error_type = "request_too_large"
+
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"Request body too large: {size} bytes exceeds limit of {limit} bytes")
+        self.size = size
+        self.limit = limit
+
+
+class UnsupportedEncoding(IngestError):
+    status = 415
+
+
+class InvalidEncoding(IngestError):
+    pass
+
+
+class IngestStats:
+    """单个请求的读取统计"""
+
+    __slots__ = ("body_bytes", "peak_buffer_bytes", "spooled", "encoding", "wire_bytes", "decode_seconds")
+
+    def __init__(self):
+        # 解压后的大小
+        self.body_bytes = 0
+        self.peak_buffer_bytes = 0
+        self.spooled = False
+        self.encoding = ""
+        # 实际收到的（压缩后的）字节数
+        self.wire_bytes = 0
+        self.decode_seconds = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {"body_bytes": self.body_bytes, "peak_buffer_bytes": self.peak_buffer_bytes, "spooled": self.spooled}
+        if self.encoding:
+            data["encoding"] = self.encoding
+            data["wire_bytes"] = self.wire_bytes
+            data["decode_ms"] = round(self.decode_seconds * 1000, 2)
+        return data
+
+
+class IngestTotals:
+    """进程内累计，供 /admin/sysinfo 展示"""
+
+    def __init__(self):
+        self.requests = 0
+        self.spooled = 0
+        self.rejected = 0
+        self.max_body_bytes = 0
+        self.max_peak_buffer_bytes = 0
+        self.compressed = 0
+        self.compressed_wire_bytes = 0
+        self.compressed_body_bytes = 0
+        self.decode_seconds = 0.0
+
+    def record(self, stats: IngestStats) -> None:
+        self.requests += 1
+        if stats.spooled:
+            self.spooled += 1
+        if stats.encoding:
+            self.compressed += 1
+            self.compressed_wire_bytes += stats.wire_bytes
+            self.compressed_body_bytes += stats.body_bytes
+            self.decode_seconds += stats.decode_seconds
+        self.max_body_bytes = max(self.max_body_bytes, stats.body_bytes)
+        self.max_peak_buffer_bytes = max(self.max_peak_buffer_bytes, stats.peak_buffer_bytes)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "spooled": self.spooled,
+            "rejected": self.rejected,
+            "max_body_bytes": self.max_body_bytes,
+            "max_peak_buffer_bytes": self.max_peak_buffer_bytes,
+            "compressed": self.compressed,
+            "compressed_bytes_saved": self.compressed_body_bytes - self.compressed_wire_bytes,
+            "decode_ms": round(self.decode_seconds * 1000, 1),
+            "limit_bytes": MAX_BODY_BYTES,
+            "spool_threshold_bytes": SPOOL_THRESHOLD_BYTES,
+        }
+
+
+totals = IngestTotals()
+
+
+def _declared_length(request: Request) -> Optional[int]:
+    value = request.headers.get("content-length")
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _parse_spooled(spool) -> Any:
+    spool.flush()
+    with mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view:
+            return json_codec.loads(view)
+
+
+async def read_json_body(
+    request: Request,
+    max_bytes: Optional[int] = None,
+    spool_threshold: Optional[int] = None,
+) -> Tuple[Any, IngestStats]:
+    """读取并解析 JSON 请求体
+
+    超过上限抛出 BodyTooLarge，压缩编码不支持或数据损坏抛出 UnsupportedEncoding /
+    InvalidEncoding，JSON 无效抛出 json.JSONDecodeError（与 json_codec.loads 一致）。
+    """
+    max_bytes = MAX_BODY_BYTES if max_bytes is None else max_bytes
+    spool_threshold = SPOOL_THRESHOLD_BYTES if spool_threshold is None else spool_threshold
+    stats = IngestStats()
+
+    try:
+        decoder = compression.request_decoder(request.headers.get("content-encoding"))
+    except codecs.UnsupportedEncoding as e:
+        totals.rejected += 1
+        raise UnsupportedEncoding(str(e)) from None
+    if decoder is not None:
+        stats.encoding = decoder.encoding
+
+    declared = _declared_length(request)
+    if max_bytes and declared is not None and declared > max_bytes:
+        totals.rejected += 1
+        raise BodyTooLarge(declared, max_bytes)
+
+    buffer = bytearray()
+    spool = None
+
+    def accept(piece: bytes) -> None:
+        nonlocal buffer, spool
+        stats.body_bytes += len(piece)
+        if max_bytes and stats.body_bytes > max_bytes:
+            totals.rejected += 1
+            raise BodyTooLarge(stats.body_bytes, max_bytes)
+        if spool is None and spool_threshold and len(buffer) + len(piece) > spool_threshold:
+            spool = tempfile.TemporaryFile(prefix="iflow2api-body-")
+            spool.write(buffer)
+            buffer = bytearray()
+            stats.spooled = True
+        if spool is not None:
+            spool.write(piece)
+            stats.peak_buffer_bytes = max(stats.peak_buffer_bytes, len(piece))
+            return
+        buffer += piece
+        stats.peak_buffer_bytes = max(stats.peak_buffer_bytes, len(buffer))
+
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            stats.wire_bytes += len(chunk)
+            if decoder is None:
+                accept(chunk)
+                continue
+            started = time.perf_counter()
+            try:
+                for piece in decoder.feed(chunk):
+                    accept(piece)
+            except IngestError:
+                raise
+            except Exception as e:
+                totals.rejected += 1
+                raise InvalidEncoding(f"Invalid {decoder.encoding} request body: {e}") from None
+            finally:
+                stats.decode_seconds += time.perf_counter() - started
+        if decoder is not None:
+            try:
+                decoder.finish()
+            except Exception as e:
+                totals.rejected += 1
+                raise InvalidEncoding(f"Invalid {decoder.encoding} request body: {e}") from None
+
+        body = _parse_spooled(spool) if spool is not None else json_codec.loads(buffer)
+    finally:
+        if spool is not None:
+            spool.close()
+
+    totals.record(stats)
+    return body, stats
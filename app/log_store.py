@@ -0,0 +1,417 @@
+"""持久化的请求日志存储
+
+日志写入 ``~/.iflow2api/request_logs.db``（SQLite WAL 模式）。请求路径上只把记录放入
+队列，由后台线程批量写入；查询按自增 id 倒序分页，``cursor`` 为上一页最后一条的 id。
+"""
+
+import atexit
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app import workers
+from core import json_codec
+
+logger = logging.getLogger(__name__)
+
+APP_HOME = Path.home() / ".iflow2api"
+DEFAULT_DB_PATH = APP_HOME / "request_logs.db"
+DEFAULT_MAX_ROWS = 50000
+FLUSH_INTERVAL = 0.2  # 批量写入的最长等待（秒）
+BATCH_SIZE = 256
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# 单独成列（可索引/过滤）的字段，其余详情字段合并存为 JSON
+COLUMNS = ("created", "method", "path", "status", "model", "effective_model", "request_id", "latency_ms", "upstream_status")
+DETAIL_FIELDS = ("headers", "body", "reasoning", "content", "error", "ingest")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS request_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    method TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    model TEXT NOT NULL DEFAULT '',
+    effective_model TEXT NOT NULL DEFAULT '',
+    request_id TEXT NOT NULL DEFAULT '',
+    latency_ms INTEGER,
+    upstream_status INTEGER,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_request_logs_created ON request_logs(created);
+CREATE INDEX IF NOT EXISTS idx_request_logs_model ON request_logs(model);
+CREATE INDEX IF NOT EXISTS idx_request_logs_status ON request_logs(status);
+CREATE INDEX IF NOT EXISTS idx_request_logs_request_id ON request_logs(request_id);
+CREATE TABLE IF NOT EXISTS run_stats (
+    run_id TEXT PRIMARY KEY,
+    total INTEGER NOT NULL DEFAULT 0,
+    success INTEGER NOT NULL DEFAULT 0,
+    error INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+"""
+RUN_STATS_TTL = 7 * 24 * 3600  # 超过该时长未更新的运行计数会被清理
+
+_SELECT = "SELECT id, " + ", ".join(COLUMNS) + ", detail FROM request_logs"
+
+
+_STATUS_PATTERN = re.compile(r"([1-5])xx|([1-5]\d\d)(?:-([1-5]\d\d))?")
+
+
+def _status_range(status: Any) -> Optional[Tuple[int, int]]:
+    """status 支持精确值（"404"）、类别（"4xx"）或范围（"400-499"）；格式无效时抛出 ValueError"""
+    if status is None or status == "":
+        return None
+    match = _STATUS_PATTERN.fullmatch(str(status).strip().lower())
+    if match is None:
+        raise ValueError(f"Invalid status filter {status!r}: status must be NNN, Nxx or NNN-NNN")
+    category, low, high = match.groups()
+    if category:
+        return int(category) * 100, int(category) * 100 + 99
+    low_code = int(low)
+    high_code = int(high) if high else low_code
+    if high_code < low_code:
+        raise ValueError(f"Invalid status filter {status!r}: range start must not exceed its end")
+    return low_code, high_code
+
+
+def _format_time(created: float) -> str:
+    return time.strftime("%H:%M:%S", time.localtime(created))
+
+
+class LogStore:
+    """SQLite 日志存储 + 后台批量写入线程"""
+
+    def __init__(self, path: Path = DEFAULT_DB_PATH, max_rows: int = DEFAULT_MAX_ROWS, run_id: str = ""):
+        self.path = Path(path)
+        self.max_rows = max_rows
+        # 非空时在写入日志的同一事务里累加该运行的统计（多 worker 模式）
+        self.run_id = run_id
+        self._queue: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._closed = False
+        self._written_since_prune = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+            if self.run_id:
+                with conn:
+                    conn.execute("DELETE FROM run_stats WHERE updated < ?", (time.time() - RUN_STATS_TTL,))
+                    conn.execute(
+                        "INSERT OR IGNORE INTO run_stats (run_id, updated) VALUES (?, ?)",
+                        (self.run_id, time.time()),
+                    )
+        finally:
+            conn.close()
+        self._reader = self._connect(check_same_thread=False)
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), timeout=10, check_same_thread=check_same_thread)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # ---- 写入 ----
+
+    def append(self, record) -> None:
+        """放入写入队列（不做任何序列化，立即返回）"""
+        if self._closed:
+            return
+        self._ensure_writer()
+        self._queue.put(record)
+
+    def flush(self, timeout: float = 2.0) -> bool:
+        """等待此前入队的记录全部写入"""
+        if self._writer is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        if self._writer is not None:
+            self._writer.join(timeout=2)
+        with self._read_lock:
+            self._reader.close()
+
+    def _ensure_writer(self) -> None:
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="log-store-writer", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        try:
+            while True:
+                item = self._queue.get()
+                batch: List[Any] = []
+                waiters: List[threading.Event] = []
+                stop = False
+                deadline = time.monotonic() + FLUSH_INTERVAL
+                while True:
+                    if item is None:
+                        stop = True
+                    elif isinstance(item, threading.Event):
+                        waiters.append(item)
+                    else:
+                        batch.append(item)
+                    if stop or waiters or len(batch) >= BATCH_SIZE:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+
+                if batch:
+                    try:
+                        self._write_batch(conn, batch)
+                    except Exception as e:
+                        logger.warning(f"写入请求日志失败: {e}")
+                for waiter in waiters:
+                    waiter.set()
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: List[Any]) -> None:
+        rows = [self._to_row(record) for record in batch]
+        with conn:
+            conn.executemany(
+                "INSERT INTO request_logs (" + ", ".join(COLUMNS) + ", detail) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            if self.run_id:
+                success = sum(1 for row in rows if row[3] < 400)
+                conn.execute(
+                    "UPDATE run_stats SET total = total + ?, success = success + ?, error = error + ?, updated = ? "
+                    "WHERE run_id = ?",
+                    (len(rows), success, len(rows) - success, time.time(), self.run_id),
+                )
+        self._written_since_prune += len(rows)
+        if self.max_rows and self._written_since_prune >= BATCH_SIZE * 4:
+            self._written_since_prune = 0
+            with conn:
+                conn.execute(
+                    "DELETE FROM request_logs WHERE id <= (SELECT MAX(id) FROM request_logs) - ?",
+                    (self.max_rows,),
+                )
+
+    @staticmethod
+    def _to_row(record) -> tuple:
+        entry = record.to_dict()
+        detail = {key: entry[key] for key in DETAIL_FIELDS if key in entry}
+        return (
+            record.created,
+            entry["method"],
+            entry["path"],
+            entry["status"],
+            entry.get("model") or "",
+            entry.get("effective_model") or "",
+            entry.get("request_id") or "",
+            entry.get("latency_ms"),
+            entry.get("upstream_status"),
+            json_codec.dumps_str(detail) if detail else None,
+        )
+
+    # ---- 查询 ----
+
+    def query(
+        self,
+        *,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: Optional[int] = None,
+        model: Optional[str] = None,
+        status: Any = None,
+        request_id: Optional[str] = None,
+        q: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """按 id 倒序分页查询，返回 {"items": [...], "next_cursor": id | None}"""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        where: List[str] = []
+        params: List[Any] = []
+        if cursor is not None:
+            where.append("id < ?")
+            params.append(int(cursor))
+        if model:
+            where.append("(model = ? OR effective_model = ?)")
+            params.extend([model, model])
+        status_range = _status_range(status)
+        if status_range:
+            where.append("status BETWEEN ? AND ?")
+            params.extend(status_range)
+        if request_id:
+            where.append("request_id = ?")
+            params.append(request_id)
+        if since is not None:
+            where.append("created >= ?")
+            params.append(float(since))
+        if until is not None:
+            where.append("created < ?")
+            params.append(float(until))
+        if q:
+            pattern = "%" + q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            where.append(
+                "(lower(model) LIKE ? ESCAPE '\\' OR lower(effective_model) LIKE ? ESCAPE '\\' "
+                "OR lower(path) LIKE ? ESCAPE '\\' OR lower(method) LIKE ? ESCAPE '\\' "
+                "OR lower(request_id) LIKE ? ESCAPE '\\')"
+            )
+            params.extend([pattern] * 5)
+
+        sql = _SELECT
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        with self._read_lock:
+            rows = self._reader.execute(sql, params).fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        items = [self._from_row(row) for row in rows]
+        return {"items": items, "next_cursor": rows[-1][0] if has_more else None}
+
+    @staticmethod
+    def _from_row(row: tuple) -> Dict[str, Any]:
+        log_id, created, method, path, status, model, effective_model, request_id, latency_ms, upstream_status, detail = row
+        entry: Dict[str, Any] = {
+            "id": log_id,
+            "time": _format_time(created),
+            "created": created,
+            "method": method,
+            "path": path,
+            "status": status,
+            "model": model,
+            "request_id": request_id,
+            "latency_ms": latency_ms,
+        }
+        if detail:
+            entry.update(json_codec.loads(detail))
+        if effective_model:
+            entry["effective_model"] = effective_model
+        if upstream_status is not None:
+            entry["upstream_status"] = upstream_status
+        return entry
+
+    def tail(self, after_id: int, limit: int = MAX_PAGE_SIZE) -> List[Dict[str, Any]]:
+        """返回 id 大于 after_id 的日志（按 id 升序），用于跨进程推送"""
+        with self._read_lock:
+            rows = self._reader.execute(
+                _SELECT + " WHERE id > ? ORDER BY id ASC LIMIT ?", (int(after_id), limit)
+            ).fetchall()
+        return [self._from_row(row) for row in rows]
+
+    def last_id(self) -> int:
+        with self._read_lock:
+            row = self._reader.execute("SELECT MAX(id) FROM request_logs").fetchone()
+        return row[0] or 0
+
+    def run_stats(self) -> Dict[str, int]:
+        """当前运行（所有 worker 合计）的请求统计"""
+        with self._read_lock:
+            row = self._reader.execute(
+                "SELECT total, success, error FROM run_stats WHERE run_id = ?", (self.run_id,)
+            ).fetchone()
+        total, success, error = row or (0, 0, 0)
+        return {"total": total, "success": success, "error": error}
+
+    def clear(self) -> None:
+        self.flush()
+        with self._read_lock:
+            with self._reader:
+                self._reader.execute("DELETE FROM request_logs")
+                if self.run_id:
+                    self._reader.execute(
+                        "UPDATE run_stats SET total = 0, success = 0, error = 0, updated = ? WHERE run_id = ?",
+                        (time.time(), self.run_id),
+                    )
+
+
+def query_records(
+    records: Iterable[Any],
+    *,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[int] = None,
+    model: Optional[str] = None,
+    status: Any = None,
+    request_id: Optional[str] = None,
+    q: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+) -> Dict[str, Any]:
+    """在内存记录上执行与 LogStore.query 相同语义的查询（存储不可用时使用）
+
+    内存记录没有 id，cursor 表示跳过的条数。
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    status_range = _status_range(status)
+    needle = q.lower() if q else ""
+    offset = int(cursor or 0)
+    matched: List[Dict[str, Any]] = []
+    skipped = 0
+    for record in records:
+        if model and model not in (record.model, record.effective_model):
+            continue
+        if status_range and not status_range[0] <= record.status <= status_range[1]:
+            continue
+        if request_id and record.request_id != request_id:
+            continue
+        if since is not None and record.created < since:
+            continue
+        if until is not None and record.created >= until:
+            continue
+        if needle and not any(
+            needle in (value or "").lower()
+            for value in (record.model, record.effective_model, record.path, record.method, record.request_id)
+        ):
+            continue
+        if skipped < offset:
+            skipped += 1
+            continue
+        matched.append(record.to_dict())
+        if len(matched) > limit:
+            break
+    has_more = len(matched) > limit
+    return {"items": matched[:limit], "next_cursor": offset + limit if has_more else None}
+
+
+_store: Optional[LogStore] = None
+_store_failed = False
+
+
+def get_log_store() -> Optional[LogStore]:
+    """获取全局日志存储；数据库无法打开时返回 None（退回内存日志）"""
+    global _store, _store_failed
+    if _store is None and not _store_failed:
+        try:
+            _store = LogStore(run_id=workers.run_id() if workers.is_multi_worker() else "")
+            atexit.register(_store.close)
+        except Exception as e:
+            _store_failed = True
+            logger.warning(f"请求日志数据库不可用，仅保留内存日志: {e}")
+    return _store
@@ -0,0 +1,303 @@
+"""请求日志记录
+
+每个请求只保存一条紧凑的 ``RequestLogRecord``：请求头保存原始引用，请求体只提取
+有长度上限的预览，完整的字典在 /admin/logs 或 GUI 读取时才渲染。
+"""
+
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple, Union
+
+from core import json_codec
+
+BODY_PREVIEW_LIMIT = 4000
+REASONING_LIMIT = 3000
+CONTENT_LIMIT = 1000
+ERROR_LIMIT = 2000
+HEADER_VALUE_LIMIT = 500
+TRUNCATED_SUFFIX = "...(truncated)"
+
+SENSITIVE_HEADERS = frozenset({
+    "authorization",
+    "x-api-key",
+    "api-key",
+    "cookie",
+    "set-cookie",
+    "proxy-authorization",
+})
+
+# 可直接从记录属性读取、无需渲染的概要字段
+SUMMARY_FIELDS = ("method", "path", "status", "model", "request_id", "latency_ms", "effective_model", "upstream_status")
+
+# 本进程的请求日志与计数（app.server 写入，GUI 读取；放在这里 GUI 无需导入 Web 框架）
+# 提高容量，减少高频请求下的日志丢失
+request_logs: Deque["RequestLogRecord"] = deque(maxlen=300)
+stats: Dict[str, int] = {"total": 0, "success": 0, "error": 0}
+
+
+class CaptureBuffer:
+    """流式输出的有界捕获
+
+    只保留开头与结尾的预览，中间部分丢弃，同时精确统计总字符数与增量个数，
+    单个流占用的内存与输出长度无关。
+    """
+
+    __slots__ = ("head_limit", "tail_limit", "_head", "_head_chars", "_tail", "_tail_chars", "chars", "deltas")
+
+    def __init__(self, limit: int):
+        self.tail_limit = limit // 4
+        self.head_limit = limit - self.tail_limit
+        self._head: List[str] = []
+        self._head_chars = 0
+        self._tail: Deque[str] = deque()
+        self._tail_chars = 0
+        self.chars = 0
+        self.deltas = 0
+
+    def append(self, text: str) -> None:
+        if not text:
+            return
+        self.chars += len(text)
+        self.deltas += 1
+        if self._head_chars < self.head_limit:
+            room = self.head_limit - self._head_chars
+            head_part = text[:room]
+            self._head.append(head_part)
+            self._head_chars += len(head_part)
+            text = text[room:]
+            if not text:
+                return
+        if not self.tail_limit:
+            return
+        self._tail.append(text)
+        self._tail_chars += len(text)
+        while self._tail and self._tail_chars - len(self._tail[0]) >= self.tail_limit:
+            self._tail_chars -= len(self._tail.popleft())
+
+    def __bool__(self) -> bool:
+        return self.chars > 0
+
+    def preview(self) -> str:
+        """完整内容未超出上限时返回原文，否则返回 开头 + 省略标记 + 结尾"""
+        head = "".join(self._head)
+        tail = "".join(self._tail)
+        omitted = self.chars - len(head) - len(tail)
+        if omitted <= 0:
+            return head + tail
+        if len(tail) > self.tail_limit:
+            omitted += len(tail) - self.tail_limit
+            tail = tail[len(tail) - self.tail_limit:]
+        return f"{head}...({omitted} chars omitted)...{tail}"
+
+
+Text = Union[str, List[str], CaptureBuffer, None]
+
+
+def truncate_text(value: Any, limit: int) -> str:
+    if value is None:
+        return ""
+    text = value if isinstance(value, str) else str(value)
+    if len(text) <= limit:
+        return text
+    return text[:limit] + TRUNCATED_SUFFIX
+
+
+def _join_bounded(value: Text, limit: int) -> str:
+    """拼接文本片段，超过 limit 后不再继续拼接"""
+    if not value:
+        return ""
+    if isinstance(value, str):
+        return truncate_text(value, limit)
+    if isinstance(value, CaptureBuffer):
+        return value.preview()
+    parts = []
+    size = 0
+    for part in value:
+        parts.append(part)
+        size += len(part)
+        if size > limit:
+            break
+    return truncate_text("".join(parts), limit)
+
+
+class _Budget(Exception):
+    """预览已写满"""
+
+
+def json_preview(value: Any, limit: int = BODY_PREVIEW_LIMIT) -> str:
+    """生成紧凑 JSON 的前 limit 个字符
+
+    与 ``dumps(value)[:limit]`` 结果一致，但写满后立即停止，代价与 limit 成正比
+    而非与整个请求体（如 base64 图片）成正比。
+    """
+    pieces: List[str] = []
+    remaining = limit + 1  # 多写一个字符用于判断是否需要截断
+
+    def write(text: str) -> None:
+        nonlocal remaining
+        pieces.append(text)
+        remaining -= len(text)
+        if remaining <= 0:
+            raise _Budget
+
+    def walk(node: Any) -> None:
+        if isinstance(node, str):
+            # 转义只会变长，截取 remaining 个字符足以写满预算
+            write(json_codec.dumps_str(node[:remaining]) if len(node) > remaining else json_codec.dumps_str(node))
+        elif isinstance(node, dict):
+            write("{")
+            first = True
+            for key, item in node.items():
+                write(json_codec.dumps_str(str(key)) + ":" if first else "," + json_codec.dumps_str(str(key)) + ":")
+                first = False
+                walk(item)
+            write("}")
+        elif isinstance(node, (list, tuple)):
+            write("[")
+            for index, item in enumerate(node):
+                if index:
+                    write(",")
+                walk(item)
+            write("]")
+        else:
+            write(json_codec.dumps_str(node))
+
+    try:
+        walk(value)
+    except _Budget:
+        pass
+    except Exception:
+        return truncate_text(value, limit)
+    return truncate_text("".join(pieces), limit)
+
+
+def sanitize_headers(headers: Iterable[Tuple[Any, Any]]) -> Dict[str, str]:
+    redacted = {}
+    for key, value in headers:
+        if isinstance(key, bytes):
+            key = key.decode("latin-1")
+        if isinstance(value, bytes):
+            value = value.decode("latin-1")
+        if key.lower() in SENSITIVE_HEADERS:
+            redacted[key] = "***"
+        else:
+            redacted[key] = truncate_text(value, HEADER_VALUE_LIMIT)
+    return redacted
+
+
+class RequestLogRecord:
+    """一条请求日志；详情字段在 ``to_dict()`` 时才渲染"""
+
+    __slots__ = (
+        "created",
+        "method",
+        "path",
+        "status",
+        "model",
+        "request_id",
+        "latency_ms",
+        "headers",
+        "body",
+        "reasoning",
+        "content",
+        "error",
+        "effective_model",
+        "upstream_status",
+        "ingest",
+        "_rendered",
+    )
+
+    def __init__(
+        self,
+        *,
+        method: str,
+        path: str,
+        status: int,
+        model: str,
+        request_id: str,
+        latency_ms: int,
+        headers: Optional[Iterable[Tuple[Any, Any]]] = None,
+        body: str = "",
+        reasoning: Text = "",
+        content: Text = "",
+        error: str = "",
+        effective_model: str = "",
+        upstream_status: Optional[int] = None,
+        ingest: Any = None,
+        created: Optional[float] = None,
+    ):
+        self.created = time.time() if created is None else created
+        self.method = method
+        self.path = path
+        self.status = status
+        self.model = model
+        self.request_id = request_id
+        self.latency_ms = latency_ms
+        self.headers = headers
+        self.body = body
+        self.reasoning = reasoning
+        self.content = content
+        self.error = error
+        self.effective_model = effective_model
+        self.upstream_status = upstream_status
+        self.ingest = ingest
+        self._rendered: Optional[Dict[str, Any]] = None
+
+    @property
+    def time(self) -> str:
+        return time.strftime("%H:%M:%S", time.localtime(self.created))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """渲染为 /admin/logs 返回的字典（结果缓存，记录生成后不再变化）"""
+        if self._rendered is not None:
+            return self._rendered
+
+        entry: Dict[str, Any] = {
+            "time": self.time,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "model": self.model,
+            "request_id": self.request_id,
+            "latency_ms": self.latency_ms,
+        }
+        # 先取局部引用：GUI 线程与日志写入线程可能同时渲染同一条记录
+        headers, reasoning, content = self.headers, self.reasoning, self.content
+        if headers:
+            entry["headers"] = sanitize_headers(headers.raw if hasattr(headers, "raw") else headers)
+        if self.body:
+            entry["body"] = truncate_text(self.body, BODY_PREVIEW_LIMIT)
+        reasoning = _join_bounded(reasoning, REASONING_LIMIT)
+        if reasoning:
+            entry["reasoning"] = reasoning
+        content = _join_bounded(content, CONTENT_LIMIT)
+        if content:
+            entry["content"] = content
+        if self.error:
+            entry["error"] = truncate_text(self.error, ERROR_LIMIT)
+        if self.effective_model:
+            entry["effective_model"] = self.effective_model
+        if self.upstream_status is not None:
+            entry["upstream_status"] = self.upstream_status
+        if self.ingest is not None:
+            # 请求体读取统计（app.ingest.IngestStats）
+            entry["ingest"] = self.ingest.to_dict() if hasattr(self.ingest, "to_dict") else self.ingest
+
+        # 渲染后释放原始引用
+        self._rendered = entry
+        self.headers = None
+        self.reasoning = None
+        self.content = None
+        return entry
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """兼容旧的 dict 日志接口；概要字段不触发渲染"""
+        if key in SUMMARY_FIELDS:
+            value = getattr(self, key)
+            return default if value in (None, "") else value
+        if key == "time":
+            return self.time
+        return self.to_dict().get(key, default)
+
+    def __getitem__(self, key: str) -> Any:
+        return self.to_dict()[key]
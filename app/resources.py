@@ -0,0 +1,148 @@
+"""服务端资源的启动与关闭（FastAPI lifespan）
+
+启动时按顺序构建，全部是本地操作：
+
+1. 配置快照、模型注册表、请求日志库、token 计数器
+2. 代理与上游 HTTP 客户端
+3. 后台任务：配置文件监视（core.config）、上游连接保活（proxy.pool）
+
+随后在后台预热：加载 OAuth token（过期时刷新）、建立上游连接、加载分词器，再拉取
+模型列表。预热完成（或超过 WARMUP_DEADLINE 秒）后 /ready 返回 200；单项失败只记录，
+首个请求时会照常重试。重启时新进程在预热完成后才接管（见 app.handoff）。
+
+关闭时按相反顺序：停止后台任务、写完日志库、关闭上游客户端。
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Dict, Optional
+
+from app.log_store import get_log_store
+from core.config import config_store
+from core.models import get_model_registry
+from core.tokens import get_token_counter
+from proxy import pool
+from proxy.proxy import get_proxy
+
+logger = logging.getLogger(__name__)
+
+# 预热的时间上限（秒），超过后视为就绪，未完成的项目取消
+WARMUP_DEADLINE = 15.0
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+class Resources:
+
+    def __init__(self):
+        # stopped -> starting -> warming -> ready -> stopping -> stopped
+        self.phase = "stopped"
+        self.startup_ms: Optional[float] = None
+        self.warmup_ms: Optional[float] = None
+        # 预热项目 -> "ok" 或错误信息
+        self.warmup: Dict[str, str] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._ready: Optional[asyncio.Event] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.phase == "ready"
+
+    def _spawn(self, name: str, coro: Awaitable[Any]) -> None:
+        self._tasks[name] = asyncio.create_task(coro, name=f"iflow2api-{name}")
+
+    async def start(self) -> None:
+        started = time.perf_counter()
+        self.phase = "starting"
+        self.warmup = {}
+        self.warmup_ms = None
+        self._ready = asyncio.Event()
+
+        # 读取即加载配置文件
+        config_store.current
+        get_model_registry()
+        get_log_store()
+        get_token_counter()
+        proxy = get_proxy()
+        await proxy.open()
+
+        self._spawn("config_watcher", config_store.watch())
+        self._spawn("keepalive", pool.keep_alive(get_proxy))
+        self.startup_ms = _elapsed_ms(started)
+
+        self.phase = "warming"
+        self._spawn("warmup", self._warm_up())
+
+    async def _step(self, name: str, coro: Awaitable[Any]) -> None:
+        started = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            self.warmup[name] = f"{type(e).__name__}: {e}"
+            logger.warning(f"预热 {name} 失败: {e}")
+        else:
+            self.warmup[name] = "ok"
+        logger.debug(f"预热 {name}: {_elapsed_ms(started)}ms")
+
+    async def _warm_up_steps(self) -> None:
+        proxy = get_proxy()
+        await asyncio.gather(
+            self._step("token", proxy.initialize()),
+            self._step("connections", pool.prewarm(proxy)),
+            self._step("tokenizers", asyncio.to_thread(get_token_counter().preload)),
+        )
+        # 模型列表需要 token
+        await self._step("models", proxy.get_models(background=False))
+        if proxy.models_cache.last_error:
+            self.warmup["models"] = proxy.models_cache.last_error
+
+    async def _warm_up(self) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._warm_up_steps(), WARMUP_DEADLINE)
+        except asyncio.TimeoutError:
+            logger.warning(f"预热超过 {WARMUP_DEADLINE:g}s，未完成的项目留到首个请求时处理")
+            for name in ("token", "connections", "tokenizers", "models"):
+                self.warmup.setdefault(name, "timeout")
+        self.warmup_ms = _elapsed_ms(started)
+        if self.phase == "warming":
+            self.phase = "ready"
+            logger.info(f"预热完成 ({self.warmup_ms:.0f}ms)，服务就绪")
+        self._ready.set()
+
+    async def wait_ready(self) -> None:
+        """等待预热结束（未启动时立即返回）"""
+        if self._ready is not None:
+            await self._ready.wait()
+
+    async def stop(self) -> None:
+        self.phase = "stopping"
+        tasks = list(self._tasks.values())
+        for task in reversed(tasks):
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        if self._ready is not None:
+            self._ready.set()
+        # 所有请求已结束（或 drain 超时被取消）：写完日志、关闭上游连接
+        store = get_log_store()
+        if store is not None:
+            await asyncio.to_thread(store.flush)
+        await get_proxy().close()
+        self.phase = "stopped"
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "phase": self.phase,
+            "ready": self.ready,
+            "startup_ms": self.startup_ms,
+            "warmup_ms": self.warmup_ms,
+            "warmup": dict(self.warmup),
+            "tasks": {name: not task.done() for name, task in self._tasks.items()},
+        }
+
+
+resources = Resources()
@@ -4,17 +4,23 @@ import asyncio
 import os
 import time
 import json
-import platform
-import psutil
 import sys
 import httpx
-from typing import Any, Dict
-from datetime import datetime
+from typing import Any, Dict, Optional
 from contextlib import asynccontextmanager
-from collections import deque
 from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse, JSONResponse, HTMLResponse
-from core.config import CONFIG
+from fastapi.responses import StreamingResponse, JSONResponse, HTMLResponse, Response
+from core import json_codec
+from app.request_log import CONTENT_LIMIT, REASONING_LIMIT, CaptureBuffer, RequestLogRecord, json_preview, request_logs, stats
+from app.log_store import get_log_store, query_records
+from app.event_bus import encode_sse, get_event_bus
+from app import compression, continuation, drain, ingest, workers
+from app.resources import resources
+from app.workers import run_server
+from core.config import CONFIG, config_store
+from core.models import get_model_registry
+from core.tokens import get_token_counter
+from proxy import pool, transfer
 from proxy.proxy import get_proxy
 
 start_time = time.time()
@@ -22,165 +28,50 @@ start_time = time.time()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# 请求日志存储（提高容量，减少高频请求下的日志丢失）
-request_logs = deque(maxlen=300)
-stats = {"total": 0, "success": 0, "error": 0}
 from converters import (
     anthropic_to_openai,
     openai_to_anthropic_nonstream,
     StreamConverter,
 )
 
-app = FastAPI()
 
 
-def _truncate_text(value: Any, limit: int = 4000) -> str:
-    if value is None:
-        return ""
-    text = str(value)
-    if len(text) <= limit:
-        return text
-    return text[:limit] + "...(truncated)"
+class CodecJSONResponse(JSONResponse):
+    """使用 core.json_codec 序列化的 JSON 响应（跳过 jsonable_encoder）"""
 
+    def render(self, content: Any) -> bytes:
+        return json_codec.dumps(content)
 
-def _safe_json_dump(value: Any, limit: int = 4000) -> str:
-    try:
-        dumped = json.dumps(value, ensure_ascii=False)
-    except Exception:
-        dumped = str(value)
-    return _truncate_text(dumped, limit)
-
-
-def _sanitize_headers(headers: Dict[str, str]) -> Dict[str, str]:
-    redacted = {}
-    sensitive_keys = {
-        "authorization",
-        "x-api-key",
-        "api-key",
-        "cookie",
-        "set-cookie",
-        "proxy-authorization",
-    }
-    for key, value in headers.items():
-        if key.lower() in sensitive_keys:
-            redacted[key] = "***"
-        else:
-            redacted[key] = _truncate_text(value, 500)
-    return redacted
 
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    drain.state.reset()
+    drain.install_signal_hooks()
+    # 启动时构建代理、客户端与后台任务，关闭时按相反顺序释放（见 app.resources）
+    await resources.start()
+    yield
+    await resources.stop()
 
-def _elapsed_ms(start_ts: float) -> int:
-    return max(0, int((time.perf_counter() - start_ts) * 1000))
 
+app = FastAPI(lifespan=lifespan)
 
-def _estimate_text_tokens(text: str) -> int:
-    if not text:
-        return 0
-    return max(1, (len(text) + 3) // 4)
-
-
-def _estimate_content_tokens(content: Any) -> int:
-    if isinstance(content, str):
-        return _estimate_text_tokens(content)
-    if isinstance(content, list):
-        total = 0
-        for item in content:
-            if isinstance(item, str):
-                total += _estimate_text_tokens(item)
-                continue
-            if not isinstance(item, dict):
-                continue
-            item_type = item.get("type")
-            if item_type == "text":
-                total += _estimate_text_tokens(str(item.get("text", "")))
-            elif item_type == "thinking":
-                total += _estimate_text_tokens(str(item.get("thinking", "")))
-            elif item_type in ("input_text", "output_text"):
-                total += _estimate_text_tokens(str(item.get("text", "")))
-            elif item_type == "tool_use":
-                try:
-                    total += _estimate_text_tokens(json.dumps(item.get("input", {}), ensure_ascii=False))
-                except Exception:
-                    pass
-            elif item_type == "tool_result":
-                total += _estimate_content_tokens(item.get("content", ""))
-        return total
-    return 0
 
+def _elapsed_ms(start_ts: float) -> int:
+    return max(0, int((time.perf_counter() - start_ts) * 1000))
 
-def _estimate_openai_prompt_tokens(body: Dict[str, Any]) -> int:
-    total = 0
-    messages = body.get("messages", [])
-    if not isinstance(messages, list):
-        return 0
-
-    for msg in messages:
-        if not isinstance(msg, dict):
-            continue
-        total += _estimate_content_tokens(msg.get("content", ""))
-        if "reasoning_content" in msg:
-            total += _estimate_content_tokens(msg.get("reasoning_content"))
-    return total
-
-
-def _estimate_anthropic_input_tokens(body: Dict[str, Any]) -> int:
-    total = 0
-    if "system" in body:
-        total += _estimate_content_tokens(body.get("system"))
-
-    messages = body.get("messages", [])
-    if not isinstance(messages, list):
-        return total
-
-    for msg in messages:
-        if not isinstance(msg, dict):
-            continue
-        total += _estimate_content_tokens(msg.get("content", ""))
-    return total
-
-
-def _append_request_log(
-    *,
-    method: str,
-    path: str,
-    status: int,
-    model: str,
-    request_id: str,
-    latency_ms: int,
-    headers: Dict[str, str] | None = None,
-    body: str = "",
-    reasoning: str = "",
-    content: str = "",
-    error: str = "",
-    effective_model: str = "",
-    upstream_status: int | None = None,
-) -> None:
-    entry: Dict[str, Any] = {
-        "time": datetime.now().strftime("%H:%M:%S"),
-        "method": method,
-        "path": path,
-        "status": status,
-        "model": model,
-        "request_id": request_id,
-        "latency_ms": latency_ms,
-    }
 
-    if headers:
-        entry["headers"] = headers
-    if body:
-        entry["body"] = _truncate_text(body, 4000)
-    if reasoning:
-        entry["reasoning"] = _truncate_text(reasoning, 3000)
-    if content:
-        entry["content"] = _truncate_text(content, 1000)
-    if error:
-        entry["error"] = _truncate_text(error, 2000)
-    if effective_model:
-        entry["effective_model"] = effective_model
-    if upstream_status is not None:
-        entry["upstream_status"] = upstream_status
-
-    request_logs.appendleft(entry)
+def _append_request_log(**fields: Any) -> None:
+    """记录一次请求；字段含义见 RequestLogRecord，详情在读取时才渲染"""
+    record = RequestLogRecord(**fields)
+    request_logs.appendleft(record)
+    store = get_log_store()
+    if store is not None:
+        store.append(record)
+    bus = get_event_bus()
+    # 多 worker 模式下 /admin/events 直接读取共享日志库，这里不再本地推送
+    if bus.has_subscribers and not workers.is_multi_worker():
+        bus.publish("log", record.to_dict())
+        bus.publish("stats", dict(stats))
 
 def make_openai_error(status: int, message: str, err_type: str = "api_error"):
     return JSONResponse({"error": {"message": message, "type": err_type, "code": status}}, status_code=status)
@@ -193,6 +84,11 @@ async def log_requests(request: Request, call_next):
     response = await call_next(request)
     return response
 
+# 按 Accept-Encoding 压缩响应
+app.add_middleware(compression.CompressionMiddleware)
+# 最外层：统计进行中的请求，drain 期间拒绝新请求
+app.add_middleware(drain.DrainMiddleware)
+
 @app.get("/admin", response_class=HTMLResponse)
 async def admin_page():
     return """<!DOCTYPE html>
@@ -328,6 +224,14 @@ async def admin_page():
             outline: none;
             transition: border-color 0.2s, box-shadow 0.2s;
         }
+        .toolbar select {
+            background: #0f1630;
+            border: 1px solid #2f3d69;
+            color: var(--text-main);
+            padding: 9px 12px;
+            border-radius: 8px;
+            outline: none;
+        }
         input[type="text"]:focus {
             border-color: var(--accent-2);
             box-shadow: 0 0 0 3px rgba(91, 140, 255, 0.17);
@@ -531,6 +435,12 @@ async def admin_page():
             📋 请求日志
             <div style="flex: 1"></div>
             <div class="toolbar" style="margin-bottom: 0;">
+                <select id="status-filter" onchange="filterLogs()">
+                    <option value="">全部状态</option>
+                    <option value="2xx">2xx</option>
+                    <option value="4xx">4xx</option>
+                    <option value="5xx">5xx</option>
+                </select>
                 <input type="text" id="filter" placeholder="🔍 搜索模型、路径..." oninput="filterLogs()">
                 <button class="btn btn-danger" onclick="clearLogs()">清空日志</button>
                 <button class="btn btn-primary" onclick="refresh()">刷新</button>
@@ -539,11 +449,17 @@ async def admin_page():
 
         <div class="logs-wrapper">
             <div id="logs"></div>
+            <div id="logs-more" style="display:none; text-align:center; padding: 12px;">
+                <button class="btn btn-primary" onclick="loadMoreLogs()">加载更多</button>
+            </div>
         </div>
     </div>
 
     <script>
         let allLogs = [];
+        let nextCursor = null;
+        let filterTimer = null;
+        let logSeq = 0;
 
         function toggle(index) {
             const detail = document.getElementById(`detail-${index}`);
@@ -578,83 +494,104 @@ async def admin_page():
                 return;
             }
 
-            container.innerHTML = logs.map((l, i) => {
-                const statusClass = getStatusClass(l.status);
-                
-                // Details construction
-                let detailsHtml = '';
-                
-                if (l.headers) {
-                    const content = JSON.stringify(l.headers, null, 2);
-                    detailsHtml += `
-                        <div class="detail-section">
-                            <div class="detail-title">Headers <button class="copy-btn" onclick="event.stopPropagation();copyToClipboard('${escapeJs(content)}')">Copy</button></div>
-                            <div class="code-block">${escapeHtml(content)}</div>
-                        </div>`;
-                }
-                
-                if (l.body) {
-                    const content = l.body; 
-                    detailsHtml += `
-                        <div class="detail-section">
-                            <div class="detail-title">Request Body <button class="copy-btn" onclick="event.stopPropagation();copyToClipboard('${escapeJs(content)}')">Copy</button></div>
-                            <div class="code-block">${escapeHtml(content)}</div>
-                        </div>`;
-                }
+            container.innerHTML = logs.map(renderLogItem).join('');
+        }
 
-                if (l.request_id || l.latency_ms !== undefined || l.effective_model || l.upstream_status !== undefined) {
-                    const meta = {
-                        request_id: l.request_id || '',
-                        latency_ms: l.latency_ms ?? '',
-                        effective_model: l.effective_model || l.model || '',
-                        upstream_status: l.upstream_status ?? ''
-                    };
-                    const content = JSON.stringify(meta, null, 2);
-                    detailsHtml += `
-                        <div class="detail-section">
-                            <div class="detail-title">Meta <button class="copy-btn" onclick="event.stopPropagation();copyToClipboard('${escapeJs(content)}')">Copy</button></div>
-                            <div class="code-block">${escapeHtml(content)}</div>
-                        </div>`;
-                }
+        function renderLogItem(l) {
+            const i = logSeq++;
+            const statusClass = getStatusClass(l.status);
+            
+            // Details construction
+            let detailsHtml = '';
+            
+            if (l.headers) {
+                const content = JSON.stringify(l.headers, null, 2);
+                detailsHtml += `
+                    <div class="detail-section">
+                        <div class="detail-title">Headers <button class="copy-btn" onclick="event.stopPropagation();copyToClipboard('${escapeJs(content)}')">Copy</button></div>
+                        <div class="code-block">${escapeHtml(content)}</div>
+                    </div>`;
+            }
+            
+            if (l.body) {
+                const content = l.body; 
+                detailsHtml += `
+                    <div class="detail-section">
+                        <div class="detail-title">Request Body <button class="copy-btn" onclick="event.stopPropagation();copyToClipboard('${escapeJs(content)}')">Copy</button></div>
+                        <div class="code-block">${escapeHtml(content)}</div>
+                    </div>`;
+            }
 
-                if (l.reasoning) {
-                     detailsHtml += `
-                        <div class="detail-section">
-                            <div class="detail-title" style="color:#a78bfa">🧠 Thinking Process</div>
-                            <div class="code-block" style="border-color: #a78bfa33;">${escapeHtml(l.reasoning)}</div>
-                        </div>`;
-                }
+            if (l.request_id || l.latency_ms !== undefined || l.effective_model || l.upstream_status !== undefined) {
+                const meta = {
+                    request_id: l.request_id || '',
+                    latency_ms: l.latency_ms ?? '',
+                    effective_model: l.effective_model || l.model || '',
+                    upstream_status: l.upstream_status ?? ''
+                };
+                const content = JSON.stringify(meta, null, 2);
+                detailsHtml += `
+                    <div class="detail-section">
+                        <div class="detail-title">Meta <button class="copy-btn" onclick="event.stopPropagation();copyToClipboard('${escapeJs(content)}')">Copy</button></div>
+                        <div class="code-block">${escapeHtml(content)}</div>
+                    </div>`;
+            }
 
-                if (l.content) {
-                     detailsHtml += `
-                        <div class="detail-section">
-                            <div class="detail-title" style="color:#34d399">💬 Response Content</div>
-                            <div class="code-block" style="border-color: #34d39933;">${escapeHtml(l.content)}</div>
-                        </div>`;
-                }
+            if (l.reasoning) {
+                 detailsHtml += `
+                    <div class="detail-section">
+                        <div class="detail-title" style="color:#a78bfa">🧠 Thinking Process</div>
+                        <div class="code-block" style="border-color: #a78bfa33;">${escapeHtml(l.reasoning)}</div>
+                    </div>`;
+            }
 
-                if (l.error) {
-                    detailsHtml += `
-                        <div class="detail-section">
-                            <div class="detail-title" style="color:#ef4444">❌ Error</div>
-                            <div class="code-block" style="border-color: #ef444433;">${escapeHtml(l.error)}</div>
-                        </div>`;
-                }
+            if (l.content) {
+                 detailsHtml += `
+                    <div class="detail-section">
+                        <div class="detail-title" style="color:#34d399">💬 Response Content</div>
+                        <div class="code-block" style="border-color: #34d39933;">${escapeHtml(l.content)}</div>
+                    </div>`;
+            }
 
-                return `
-                <div class="log-item">
-                    <div class="log-header" onclick="toggle(${i})">
-                        <span class="time">${l.time}</span>
-                        <span class="method">${l.method}</span>
-                        <span class="path" title="${l.path}">${l.path}</span>
-                        <span class="badge ${statusClass}">${l.status}</span>
-                        ${(l.effective_model || l.model) ? `<span class="model-tag">${l.effective_model || l.model}${(l.latency_ms !== undefined && l.latency_ms !== null) ? ` · ${l.latency_ms}ms` : ''}</span>` : '<span></span>'}
-                    </div>
-                    <div class="log-detail" id="detail-${i}">
-                        ${detailsHtml || '<div style="color:var(--text-muted)">无详细信息</div>'}
-                    </div>
-                </div>`;
-            }).join('');
+            if (l.error) {
+                detailsHtml += `
+                    <div class="detail-section">
+                        <div class="detail-title" style="color:#ef4444">❌ Error</div>
+                        <div class="code-block" style="border-color: #ef444433;">${escapeHtml(l.error)}</div>
+                    </div>`;
+            }
+
+            return `
+            <div class="log-item">
+                <div class="log-header" onclick="toggle(${i})">
+                    <span class="time">${l.time}</span>
+                    <span class="method">${l.method}</span>
+                    <span class="path" title="${l.path}">${l.path}</span>
+                    <span class="badge ${statusClass}">${l.status}</span>
+                    ${(l.effective_model || l.model) ? `<span class="model-tag">${l.effective_model || l.model}${(l.latency_ms !== undefined && l.latency_ms !== null) ? ` · ${l.latency_ms}ms` : ''}</span>` : '<span></span>'}
+                </div>
+                <div class="log-detail" id="detail-${i}">
+                    ${detailsHtml || '<div style="color:var(--text-muted)">无详细信息</div>'}
+                </div>
+            </div>`;
+        }
+
+        function matchesFilters(l) {
+            // 与服务端 /admin/logs 的 q / status 语义一致，仅用于判断推送来的单条日志
+            const q = document.getElementById('filter').value.trim().toLowerCase();
+            const status = document.getElementById('status-filter').value;
+            if (status && String(Math.floor(l.status / 100)) !== status[0]) return false;
+            if (!q) return true;
+            return [l.model, l.effective_model, l.path, l.method, l.request_id]
+                .some(v => (v || '').toLowerCase().includes(q));
+        }
+
+        function prependLog(l) {
+            if (!matchesFilters(l)) return;
+            const container = document.getElementById('logs');
+            if (allLogs.length === 0) container.innerHTML = '';
+            allLogs.unshift(l);
+            container.insertAdjacentHTML('afterbegin', renderLogItem(l));
         }
 
         function escapeHtml(text) {
@@ -672,23 +609,48 @@ async def admin_page():
         }
 
         function filterLogs() {
-            const q = document.getElementById('filter').value.toLowerCase();
-            const filtered = allLogs.filter(l => 
-                (l.model || '').toLowerCase().includes(q) || 
-                (l.path || '').toLowerCase().includes(q) ||
-                (l.method || '').toLowerCase().includes(q) ||
-                (l.request_id || '').toLowerCase().includes(q)
-            );
-            renderLogs(filtered);
+            // 过滤在服务端完成，输入时稍作防抖
+            clearTimeout(filterTimer);
+            filterTimer = setTimeout(refreshLogs, 250);
+        }
+
+        function logsQuery(cursor) {
+            const params = new URLSearchParams({ limit: '50' });
+            const q = document.getElementById('filter').value.trim();
+            const status = document.getElementById('status-filter').value;
+            if (q) params.set('q', q);
+            if (status) params.set('status', status);
+            if (cursor !== null && cursor !== undefined) params.set('cursor', cursor);
+            return '/admin/logs?' + params.toString();
+        }
+
+        async function fetchLogs(cursor) {
+            const page = await (await fetch(logsQuery(cursor))).json();
+            nextCursor = page.next_cursor;
+            document.getElementById('logs-more').style.display = nextCursor === null ? 'none' : 'block';
+            return page.items || [];
+        }
+
+        async function loadMoreLogs() {
+            if (nextCursor === null) return;
+            try {
+                allLogs = allLogs.concat(await fetchLogs(nextCursor));
+                renderLogs(allLogs);
+            } catch (e) {
+                console.error("Failed to load more logs", e);
+            }
+        }
+
+        function applyStats(s) {
+            document.getElementById('total').textContent = s.total;
+            document.getElementById('success').textContent = s.success;
+            document.getElementById('error').textContent = s.error;
+            document.getElementById('rate').textContent = s.total > 0 ? Math.round(s.success / s.total * 100) + '%' : '-';
         }
 
         async function refreshStats() {
             try {
-                const s = await (await fetch('/admin/stats')).json();
-                document.getElementById('total').textContent = s.total;
-                document.getElementById('success').textContent = s.success;
-                document.getElementById('error').textContent = s.error;
-                document.getElementById('rate').textContent = s.total > 0 ? Math.round(s.success / s.total * 100) + '%' : '-';
+                applyStats(await (await fetch('/admin/stats')).json());
             } catch (e) {
                 console.error("Failed to refresh stats", e);
             }
@@ -696,8 +658,8 @@ async def admin_page():
 
         async function refreshLogs() {
             try {
-                allLogs = await (await fetch('/admin/logs')).json();
-                filterLogs();
+                allLogs = await fetchLogs(null);
+                renderLogs(allLogs);
             } catch (e) {
                 console.error("Failed to refresh logs", e);
             }
@@ -732,35 +694,166 @@ async def admin_page():
             }
         }
 
+        function subscribeEvents() {
+            // 服务端推送新日志与统计，断线后 EventSource 会自动重连
+            const source = new EventSource('/admin/events');
+            source.addEventListener('stats', e => applyStats(JSON.parse(e.data)));
+            source.addEventListener('log', e => prependLog(JSON.parse(e.data)));
+            source.addEventListener('clear', () => { allLogs = []; renderLogs(allLogs); });
+            source.addEventListener('reset', () => refresh());
+        }
+
         // Init
         refresh();
         loadModels();
-        // 仅自动刷新统计，不自动刷新日志，避免展开详情被打断
-        setInterval(refreshStats, 3000);
+        subscribeEvents();
     </script>
 </body>
 </html>"""
 
 @app.get("/admin/stats")
 async def get_stats():
+    return await _current_stats()
+
+async def _current_stats() -> Dict[str, int]:
+    """单进程返回本进程计数；多 worker 时返回日志库中所有 worker 的合计"""
+    store = get_log_store()
+    if workers.is_multi_worker() and store is not None:
+        def read():
+            store.flush()
+            return store.run_stats()
+        return await asyncio.to_thread(read)
     return stats
 
 @app.get("/admin/logs")
-async def get_logs():
-    return list(request_logs)
+async def get_logs(
+    limit: int = 50,
+    cursor: Optional[int] = None,
+    model: Optional[str] = None,
+    status: Optional[str] = None,
+    request_id: Optional[str] = None,
+    q: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+):
+    """分页查询请求日志；next_cursor 传回 cursor 参数获取下一页"""
+    filters = dict(limit=limit, cursor=cursor, model=model, status=status, request_id=request_id, q=q, since=since, until=until)
+    try:
+        store = get_log_store()
+        if store is None:
+            return CodecJSONResponse(query_records(list(request_logs), **filters))
+
+        def run_query():
+            store.flush()
+            return store.query(**filters)
+
+        return CodecJSONResponse(await asyncio.to_thread(run_query))
+    except ValueError as e:
+        return JSONResponse({"error": {"message": str(e), "type": "invalid_request_error"}}, status_code=400)
 
 @app.delete("/admin/logs")
 async def clear_logs():
     request_logs.clear()
+    store = get_log_store()
+    if store is not None:
+        await asyncio.to_thread(store.clear)
     stats["total"] = stats["success"] = stats["error"] = 0
+    bus = get_event_bus()
+    bus.publish("clear", {})
+    bus.publish("stats", dict(stats))
     return {"status": "ok"}
 
+EVENTS_KEEPALIVE_SECONDS = 15
+EVENTS_MAX_BATCH = 64
+EVENTS_POLL_SECONDS = 0.5  # 多 worker 模式下读取共享日志库的间隔
+EVENTS_DRAIN_CHECK_SECONDS = 1.0  # 检查是否进入 drain 的间隔；drain 时结束推送，客户端重连到新进程
+
+async def _shared_store_events(store):
+    """多 worker 模式：轮询共享日志库，把新日志与合计统计推送给客户端"""
+    last_id = await asyncio.to_thread(store.last_id)
+    last_stats = None
+    idle = 0.0
+    while not drain.state.draining:
+        items = await asyncio.to_thread(store.tail, last_id)
+        current = await asyncio.to_thread(store.run_stats)
+        frames = []
+        if current != last_stats:
+            if last_stats is not None and current["total"] < last_stats["total"]:
+                frames.append(encode_sse("clear", {}))
+            frames.append(encode_sse("stats", current))
+            last_stats = current
+        for item in items:
+            last_id = item["id"]
+            frames.append(encode_sse("log", item))
+        if frames:
+            idle = 0.0
+            yield b"".join(frames)
+        else:
+            idle += EVENTS_POLL_SECONDS
+            if idle >= EVENTS_KEEPALIVE_SECONDS:
+                idle = 0.0
+                yield b": keepalive\n\n"
+        await asyncio.sleep(EVENTS_POLL_SECONDS)
+
+@app.get("/admin/events")
+async def admin_events():
+    """推送新日志（log）、统计（stats）、清空（clear）事件；reset 表示客户端需重新拉取"""
+    store = get_log_store()
+    if workers.is_multi_worker() and store is not None:
+        return StreamingResponse(
+            _shared_store_events(store),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    bus = get_event_bus()
+    subscription = bus.subscribe()
+
+    async def stream():
+        try:
+            yield encode_sse("stats", stats)
+            idle = 0.0
+            while not drain.state.draining:
+                try:
+                    frame = await asyncio.wait_for(subscription.get(), timeout=EVENTS_DRAIN_CHECK_SECONDS)
+                except asyncio.TimeoutError:
+                    idle += EVENTS_DRAIN_CHECK_SECONDS
+                    if idle >= EVENTS_KEEPALIVE_SECONDS:
+                        idle = 0.0
+                        yield b": keepalive\n\n"
+                    continue
+                idle = 0.0
+                frames = [frame]
+                while len(frames) < EVENTS_MAX_BATCH and not subscription.queue.empty():
+                    frames.append(subscription.queue.get_nowait())
+                if subscription.overflowed:
+                    # 客户端消费过慢，丢弃积压事件并让其重新拉取
+                    while not subscription.queue.empty():
+                        subscription.queue.get_nowait()
+                    subscription.overflowed = False
+                    yield encode_sse("reset", {})
+                    continue
+                yield b"".join(frames)
+        finally:
+            bus.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/admin/sysinfo")
 async def get_sysinfo():
+    # 只有管理页用到，按需导入以缩短启动时间
+    import platform
+    import psutil
+
     uptime_seconds = int(time.time() - start_time)
     hours = uptime_seconds // 3600
     minutes = (uptime_seconds % 3600) // 60
     uptime_str = f"{hours}h {minutes}m" if hours > 0 else f"{minutes}m"
+    proxy = get_proxy()
 
     return {
         "python_version": f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}",
@@ -768,7 +861,22 @@ async def get_sysinfo():
         "cpu_percent": round(psutil.cpu_percent(interval=0.1), 1),
         "memory_percent": round(psutil.virtual_memory().percent, 1),
         "uptime": uptime_str,
-        "pid": os.getpid()
+        "pid": os.getpid(),
+        "workers": workers.worker_count(),
+        "config": config_store.info(),
+        "session_affinity": proxy.session_affinity,
+        # 本 worker 的上游前缀缓存命中情况
+        "prompt_cache": proxy.cache_stats.snapshot(),
+        "ingest": ingest.totals.snapshot(),
+        "compression": compression.totals.snapshot(),
+        "upstream_transfer": transfer.totals.snapshot(),
+        "upstream_pool": pool.totals.snapshot(),
+        "drain": drain.state.snapshot(),
+        "lifespan": resources.snapshot(),
+        "models_cache": proxy.models_cache.info(),
+        "model_registry": get_model_registry().info(),
+        # 本 worker 的 token 计数方式与计数缓存命中情况
+        "token_counter": get_token_counter().info(),
     }
 
 @app.get("/health")
@@ -776,21 +884,50 @@ async def get_sysinfo():
 async def health_check():
     return {"status": "ok", "service": "iflow2api"}
 
+@app.get("/ready")
+@app.get("/v1/ready")
+async def readiness_check():
+    """预热完成后返回 200（drain 期间由 DrainMiddleware 返回 503）"""
+    status = "ready" if resources.ready else resources.phase
+    return CodecJSONResponse(
+        {"status": status, "service": "iflow2api", "warmup_ms": resources.warmup_ms},
+        status_code=200 if resources.ready else 503,
+    )
+
 @app.get("/v1/models")
 async def models(request: Request):
     proxy = get_proxy()
-    return await proxy.get_models()
+    payload = await proxy.get_models()
+    etag = proxy.models_cache.etag if payload is proxy.models_cache.payload else None
+    # 响应经压缩时 ETag 会变为弱 ETag（见 app.compression），比较时忽略 W/ 前缀
+    if etag and etag in [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    return CodecJSONResponse(payload, headers={"ETag": etag} if etag else None)
 
 @app.post("/v1/chat/completions")
 async def chat_completions(request: Request):
     request_id = f"req_{uuid.uuid4().hex[:12]}"
     request_started = time.perf_counter()
-    headers_for_log = _sanitize_headers(dict(request.headers))
+    headers_for_log = request.headers
     body_for_log = ""
+    ingest_stats = None
 
     try:
-        body_bytes = await request.body()
-        body = json.loads(body_bytes.decode("utf-8"))
+        body, ingest_stats = await ingest.read_json_body(request)
+    except ingest.IngestError as e:
+        stats["total"] += 1
+        stats["error"] += 1
+        _append_request_log(
+            method="POST",
+            path="/v1/chat/completions",
+            status=e.status,
+            model="unknown",
+            request_id=request_id,
+            latency_ms=_elapsed_ms(request_started),
+            headers=headers_for_log,
+            error=str(e),
+        )
+        return make_openai_error(e.status, str(e), e.error_type)
     except json.JSONDecodeError as e:
         stats["total"] += 1
         stats["error"] += 1
@@ -821,7 +958,8 @@ async def chat_completions(request: Request):
         return make_openai_error(400, "Invalid JSON", "invalid_request_error")
 
     model = body.get("model", "unknown")
-    body_for_log = _safe_json_dump(body)
+    body_for_log = json_preview(body)
+    requested_max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
     body["max_tokens"] = max(body.get("max_tokens", 4096), 1024)
 
     # 验证消息数组
@@ -838,6 +976,7 @@ async def chat_completions(request: Request):
             latency_ms=_elapsed_ms(request_started),
             headers=headers_for_log,
             body=body_for_log,
+            ingest=ingest_stats,
             error="messages array is required and must be non-empty",
             effective_model=model,
         )
@@ -850,81 +989,27 @@ async def chat_completions(request: Request):
 
         if body.get("stream"):
             body["stream_options"] = {"include_usage": True}
-            estimated_prompt_tokens = _estimate_openai_prompt_tokens(body)
-            reasoning_parts = []
-            content_parts = []
+            reasoning_capture = CaptureBuffer(REASONING_LIMIT)
+            content_capture = CaptureBuffer(CONTENT_LIMIT)
 
             async def stream():
                 try:
-                    MAX_CONTINUATIONS = 5
-                    continuation_count = 0
-                    current_body = body.copy()
-                    accumulated_content = ""
-                    accumulated_reasoning = ""
-                    saw_usage = False
-
-                    while continuation_count <= MAX_CONTINUATIONS:
-                        last_finish_reason = None
-
-                        async for chunk in await proxy.proxy_request("/chat/completions", current_body, model, stream=True):
-                            line = chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk
-                            if line and line.startswith("data: ") and not line.endswith("[DONE]"):
-                                try:
-                                    data = json.loads(line[6:])
-                                    choice = data.get("choices", [{}])[0]
-                                    delta = choice.get("delta", {})
-                                    last_finish_reason = choice.get("finish_reason")
-                                    if isinstance(data.get("usage"), dict):
-                                        saw_usage = True
-
-                                    if delta.get("reasoning_content"):
-                                        reasoning_parts.append(delta["reasoning_content"])
-                                        accumulated_reasoning += delta["reasoning_content"]
-                                        logger.info(f"[Thinking] {delta['reasoning_content'][:100]}")
-                                    if delta.get("content"):
-                                        content_parts.append(delta["content"])
-                                        accumulated_content += delta["content"]
-                                except Exception as e:
-                                    logger.warning(f"Parse chunk error: {e}")
-
-                            # 不发送 [DONE]，由续写逻辑控制
-                            if line and "[DONE]" not in line:
-                                yield line if line.endswith("\n\n") else line + "\n\n"
-
-                        # 检查是否需要续写
-                        if last_finish_reason != "length":
-                            break
-
-                        continuation_count += 1
-                        if continuation_count > MAX_CONTINUATIONS:
-                            break
-
-                        logger.info(f"流式输出被截断，自动续写 ({continuation_count}/{MAX_CONTINUATIONS})")
-
-                        # 追加已生成的内容，继续请求
-                        assistant_msg = {"role": "assistant", "content": accumulated_content}
-                        if accumulated_reasoning:
-                            assistant_msg["reasoning_content"] = accumulated_reasoning
-                        current_body["messages"] = current_body.get("messages", []) + [assistant_msg]
-
-                    if not saw_usage:
-                        estimated_completion_tokens = _estimate_text_tokens(accumulated_content + accumulated_reasoning)
-                        usage_chunk = {
-                            "id": f"chatcmpl_usage_{request_id}",
-                            "object": "chat.completion.chunk",
-                            "created": int(time.time()),
-                            "model": model,
-                            "choices": [],
-                            "usage": {
-                                "prompt_tokens": estimated_prompt_tokens,
-                                "completion_tokens": estimated_completion_tokens,
-                                "total_tokens": estimated_prompt_tokens + estimated_completion_tokens,
-                            },
-                        }
-                        yield f"data: {json.dumps(usage_chunk, ensure_ascii=False)}\n\n"
-
-                    # 发送最终的 [DONE]
-                    yield "data: [DONE]\n\n"
+                    async for chunk, data in continuation.stream(
+                        lambda round_body: proxy.proxy_request("/chat/completions", round_body, model, stream=True),
+                        body,
+                        model,
+                        fallback_id=f"chatcmpl_usage_{request_id}",
+                        estimated_prompt_tokens=lambda: get_token_counter().count_openai_prompt(body),
+                        max_total_tokens=requested_max_tokens,
+                    ):
+                        if data is not None:
+                            delta = continuation.first_choice(data).get("delta") or {}
+                            if delta.get("reasoning_content"):
+                                reasoning_capture.append(delta["reasoning_content"])
+                                logger.info(f"[Thinking] {delta['reasoning_content'][:100]}")
+                            if delta.get("content"):
+                                content_capture.append(delta["content"])
+                        yield chunk
 
                     stats["total"] += 1
                     stats["success"] += 1
@@ -937,8 +1022,9 @@ async def chat_completions(request: Request):
                         latency_ms=_elapsed_ms(request_started),
                         headers=headers_for_log,
                         body=body_for_log,
-                        reasoning="".join(reasoning_parts),
-                        content="".join(content_parts),
+                        ingest=ingest_stats,
+                        reasoning=reasoning_capture,
+                        content=content_capture,
                         effective_model=model,
                     )
                 except httpx.HTTPStatusError as e:
@@ -954,6 +1040,7 @@ async def chat_completions(request: Request):
                         latency_ms=_elapsed_ms(request_started),
                         headers=headers_for_log,
                         body=body_for_log,
+                        ingest=ingest_stats,
                         error=f"Upstream API error: HTTP {upstream_status}",
                         effective_model=model,
                         upstream_status=upstream_status,
@@ -972,6 +1059,7 @@ async def chat_completions(request: Request):
                         latency_ms=_elapsed_ms(request_started),
                         headers=headers_for_log,
                         body=body_for_log,
+                        ingest=ingest_stats,
                         error=f"{type(e).__name__}: {e}",
                         effective_model=model,
                     )
@@ -980,56 +1068,16 @@ async def chat_completions(request: Request):
 
             return StreamingResponse(stream(), media_type="text/event-stream")
 
-        data = await proxy.proxy_request("/chat/completions", body, model, stream=False)
+        data = await continuation.complete(
+            lambda round_body: proxy.proxy_request("/chat/completions", round_body, model, stream=False),
+            body,
+            max_total_tokens=requested_max_tokens,
+        )
         logger.info(f"Non-stream response usage: {data.get('usage')}")
 
-        # 自动续写：当因 max_tokens 截断时，继续请求
-        MAX_CONTINUATIONS = 5
-        continuation_count = 0
-        while continuation_count < MAX_CONTINUATIONS:
-            choice = data.get("choices", [{}])[0]
-            finish_reason = choice.get("finish_reason")
-            if finish_reason != "length":
-                break
-
-            continuation_count += 1
-            logger.info(f"输出被截断，自动续写 ({continuation_count}/{MAX_CONTINUATIONS})")
-
-            # 将当前回复追加到消息中，继续请求
-            assistant_msg = choice.get("message", {})
-            body["messages"] = body.get("messages", []) + [assistant_msg]
-
-            next_data = await proxy.proxy_request("/chat/completions", body, model, stream=False)
-
-            # 合并内容
-            next_choice = next_data.get("choices", [{}])[0]
-            next_msg = next_choice.get("message", {})
-
-            # 合并 content
-            if next_msg.get("content"):
-                current_content = assistant_msg.get("content", "") or ""
-                assistant_msg["content"] = current_content + next_msg["content"]
-
-            # 合并 reasoning_content
-            if next_msg.get("reasoning_content"):
-                current_reasoning = assistant_msg.get("reasoning_content", "") or ""
-                assistant_msg["reasoning_content"] = current_reasoning + next_msg["reasoning_content"]
-
-            # 更新 finish_reason 和 usage
-            choice["finish_reason"] = next_choice.get("finish_reason")
-            choice["message"] = assistant_msg
-            if next_data.get("usage"):
-                prev_usage = data.get("usage", {})
-                next_usage = next_data.get("usage", {})
-                data["usage"] = {
-                    "prompt_tokens": next_usage.get("prompt_tokens", 0),
-                    "completion_tokens": prev_usage.get("completion_tokens", 0) + next_usage.get("completion_tokens", 0),
-                    "total_tokens": next_usage.get("prompt_tokens", 0) + prev_usage.get("completion_tokens", 0) + next_usage.get("completion_tokens", 0)
-                }
-            data["choices"][0] = choice
-
-        reasoning = data.get("choices", [{}])[0].get("message", {}).get("reasoning_content", "")
-        content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        message = continuation.first_choice(data).get("message") or {}
+        reasoning = message.get("reasoning_content", "")
+        content = message.get("content", "")
         stats["total"] += 1
         stats["success"] += 1
         _append_request_log(
@@ -1041,11 +1089,12 @@ async def chat_completions(request: Request):
             latency_ms=_elapsed_ms(request_started),
             headers=headers_for_log,
             body=body_for_log,
+            ingest=ingest_stats,
             reasoning=reasoning,
             content=content,
             effective_model=model,
         )
-        return data
+        return CodecJSONResponse(data)
     except httpx.HTTPStatusError as e:
         stats["total"] += 1
         stats["error"] += 1
@@ -1059,6 +1108,7 @@ async def chat_completions(request: Request):
             latency_ms=_elapsed_ms(request_started),
             headers=headers_for_log,
             body=body_for_log,
+            ingest=ingest_stats,
             error=f"Upstream API error: HTTP {status_code}",
             effective_model=model,
             upstream_status=status_code,
@@ -1077,6 +1127,7 @@ async def chat_completions(request: Request):
             latency_ms=_elapsed_ms(request_started),
             headers=headers_for_log,
             body=body_for_log,
+            ingest=ingest_stats,
             error=f"{type(e).__name__}: {e}",
             effective_model=model,
         )
@@ -1086,22 +1137,38 @@ async def chat_completions(request: Request):
 @app.post("/v1/messages/count_tokens")
 async def count_tokens(request: Request):
     try:
-        body = await request.json()
-    except:
+        body, _ = await ingest.read_json_body(request)
+    except ingest.IngestError as e:
+        return make_anthropic_error(e.status, str(e), e.error_type)
+    except Exception:
         return make_anthropic_error(400, "Invalid JSON", "invalid_request_error")
 
-    return {"input_tokens": _estimate_anthropic_input_tokens(body)}
+    return {"input_tokens": get_token_counter().count_anthropic_input(body)}
 
 @app.post("/v1/messages")
 async def anthropic_messages(request: Request):
     request_id = f"req_{uuid.uuid4().hex[:12]}"
     request_started = time.perf_counter()
-    headers_for_log = _sanitize_headers(dict(request.headers))
+    headers_for_log = request.headers
     body_for_log = ""
+    ingest_stats = None
 
     try:
-        body_bytes = await request.body()
-        body = json.loads(body_bytes.decode("utf-8"))
+        body, ingest_stats = await ingest.read_json_body(request)
+    except ingest.IngestError as e:
+        stats["total"] += 1
+        stats["error"] += 1
+        _append_request_log(
+            method="POST",
+            path="/v1/messages",
+            status=e.status,
+            model="unknown",
+            request_id=request_id,
+            latency_ms=_elapsed_ms(request_started),
+            headers=headers_for_log,
+            error=str(e),
+        )
+        return make_anthropic_error(e.status, str(e), e.error_type)
     except json.JSONDecodeError as e:
         stats["total"] += 1
         stats["error"] += 1
@@ -1134,7 +1201,7 @@ async def anthropic_messages(request: Request):
     openai_req = anthropic_to_openai(body)
     msg_id = f"msg_{uuid.uuid4().hex[:24]}"
     model = body.get("model", "")
-    body_for_log = _safe_json_dump(body)
+    body_for_log = json_preview(body)
     openai_req["max_tokens"] = max(openai_req.get("max_tokens", 4096), 1024)
 
     logger.info(f"Request model={model}, thinking={openai_req.get('thinking')}, has_tools={bool(openai_req.get('tools'))}")
@@ -1144,29 +1211,35 @@ async def anthropic_messages(request: Request):
 
         if body.get("stream"):
             openai_req["stream_options"] = {"include_usage": True}
-            reasoning_parts = []
-            content_parts = []
-            estimated_input_tokens = _estimate_anthropic_input_tokens(body)
+            reasoning_capture = CaptureBuffer(REASONING_LIMIT)
+            content_capture = CaptureBuffer(CONTENT_LIMIT)
+            estimated_input_tokens = get_token_counter().count_anthropic_input(body)
 
             async def stream():
                 try:
                     converter = StreamConverter(model, msg_id, estimated_input_tokens=estimated_input_tokens)
-                    async for chunk in await proxy.proxy_request("/chat/completions", openai_req, model, stream=True):
-                        line = chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk
-                        if line and line.startswith("data: ") and not line.endswith("[DONE]"):
-                            try:
-                                data = json.loads(line[6:])
-                                delta = data.get("choices", [{}])[0].get("delta", {})
-                                if delta.get("reasoning_content"):
-                                    reasoning_parts.append(delta["reasoning_content"])
-                                    logger.info(f"[Thinking] {delta['reasoning_content'][:100]}")
-                                if delta.get("content"):
-                                    content_parts.append(delta["content"])
-                            except Exception as e:
-                                logger.warning(f"Parse chunk error: {e}")
-                        if line:
-                            for event in converter.convert_chunk(line):
-                                yield event
+                    async for chunk, data in continuation.stream(
+                        lambda round_body: proxy.proxy_request("/chat/completions", round_body, model, stream=True),
+                        openai_req,
+                        model,
+                        fallback_id=msg_id,
+                        estimated_prompt_tokens=estimated_input_tokens,
+                        max_total_tokens=body.get("max_tokens"),
+                    ):
+                        if data is not None:
+                            delta = continuation.first_choice(data).get("delta") or {}
+                            if delta.get("reasoning_content"):
+                                reasoning_capture.append(delta["reasoning_content"])
+                                logger.info(f"[Thinking] {delta['reasoning_content'][:100]}")
+                            if delta.get("content"):
+                                content_capture.append(delta["content"])
+                            events = converter.convert_data(data)
+                        elif chunk == continuation.DONE_CHUNK:
+                            events = converter.convert_done()
+                        else:
+                            events = []
+                        if events:
+                            yield b"".join(events)
                     stats["total"] += 1
                     stats["success"] += 1
                     _append_request_log(
@@ -1178,8 +1251,9 @@ async def anthropic_messages(request: Request):
                         latency_ms=_elapsed_ms(request_started),
                         headers=headers_for_log,
                         body=body_for_log,
-                        reasoning="".join(reasoning_parts),
-                        content="".join(content_parts),
+                        ingest=ingest_stats,
+                        reasoning=reasoning_capture,
+                        content=content_capture,
                         effective_model=model,
                     )
                 except httpx.HTTPStatusError as e:
@@ -1195,6 +1269,7 @@ async def anthropic_messages(request: Request):
                         latency_ms=_elapsed_ms(request_started),
                         headers=headers_for_log,
                         body=body_for_log,
+                        ingest=ingest_stats,
                         error=f"Upstream API error: HTTP {upstream_status}",
                         effective_model=model,
                         upstream_status=upstream_status,
@@ -1213,6 +1288,7 @@ async def anthropic_messages(request: Request):
                         latency_ms=_elapsed_ms(request_started),
                         headers=headers_for_log,
                         body=body_for_log,
+                        ingest=ingest_stats,
                         error=f"{type(e).__name__}: {e}",
                         effective_model=model,
                     )
@@ -1220,10 +1296,15 @@ async def anthropic_messages(request: Request):
 
             return StreamingResponse(stream(), media_type="text/event-stream")
 
-        data = await proxy.proxy_request("/chat/completions", openai_req, model, stream=False)
+        data = await continuation.complete(
+            lambda round_body: proxy.proxy_request("/chat/completions", round_body, model, stream=False),
+            openai_req,
+            max_total_tokens=body.get("max_tokens"),
+        )
         logger.info(f"Non-stream response usage: {data.get('usage')}")
-        reasoning = data.get("choices", [{}])[0].get("message", {}).get("reasoning_content", "")
-        content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        message = continuation.first_choice(data).get("message") or {}
+        reasoning = message.get("reasoning_content", "")
+        content = message.get("content", "")
         stats["total"] += 1
         stats["success"] += 1
         _append_request_log(
@@ -1235,11 +1316,12 @@ async def anthropic_messages(request: Request):
             latency_ms=_elapsed_ms(request_started),
             headers=headers_for_log,
             body=body_for_log,
+            ingest=ingest_stats,
             reasoning=reasoning,
             content=content,
             effective_model=model,
         )
-        return JSONResponse(openai_to_anthropic_nonstream(data))
+        return CodecJSONResponse(openai_to_anthropic_nonstream(data))
     except httpx.HTTPStatusError as e:
         stats["total"] += 1
         stats["error"] += 1
@@ -1253,6 +1335,7 @@ async def anthropic_messages(request: Request):
             latency_ms=_elapsed_ms(request_started),
             headers=headers_for_log,
             body=body_for_log,
+            ingest=ingest_stats,
             error=f"Upstream API error: HTTP {status_code}",
             effective_model=model,
             upstream_status=status_code,
@@ -1271,22 +1354,11 @@ async def anthropic_messages(request: Request):
             latency_ms=_elapsed_ms(request_started),
             headers=headers_for_log,
             body=body_for_log,
+            ingest=ingest_stats,
             error=f"{type(e).__name__}: {e}",
             effective_model=model,
         )
         return make_anthropic_error(500, str(e), "internal_error")
 
-def run_server():
-    """API 服务入口"""
-    import uvicorn
-    import argparse
-
-    parser = argparse.ArgumentParser(description="iFlow2API Service")
-    parser.add_argument("--port", type=int, default=8000, help="Port to run the service on")
-    args = parser.parse_args()
-
-    uvicorn.run(app, host="0.0.0.0", port=args.port)
-
-
 if __name__ == "__main__":
     run_server()
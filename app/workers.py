@@ -0,0 +1,105 @@
+"""多 worker 运行模式
+
+``--workers N`` 时由 uvicorn 的多进程管理器共享同一个监听 socket 启动 N 个 worker。
+各 worker 的请求日志与统计都汇总到 SQLite 日志库（见 app.log_store），
+/admin/* 从日志库读取，因此无论请求落在哪个 worker 上看到的都是同一份数据。
+
+Linux / macOS 上监听 socket 由本进程创建，支持 SIGUSR2 零停机重启（见 app.handoff）。
+"""
+
+import logging
+import os
+import signal
+import uuid
+from typing import Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+WORKERS_ENV = "IFLOW2API_WORKERS"
+RUN_ID_ENV = "IFLOW2API_RUN_ID"
+LISTEN_FD_ENV = "IFLOW2API_LISTEN_FD"
+READY_FD_ENV = "IFLOW2API_READY_FD"
+APP_IMPORT_PATH = "app.server:app"
+# app.handoff 继承 uvicorn 的 Server 与多进程 supervisor，依赖其内部实现，只在验证过的
+# 版本范围 [MIN, MAX) 内启用，其他版本回退到普通启动
+HANDOFF_UVICORN_MIN = (0, 54)
+HANDOFF_UVICORN_MAX = (0, 55)
+
+
+def worker_count() -> int:
+    try:
+        return max(1, int(os.environ.get(WORKERS_ENV, "1")))
+    except ValueError:
+        return 1
+
+
+def is_multi_worker() -> bool:
+    return worker_count() > 1
+
+
+def run_id() -> str:
+    """本次运行的标识（所有 worker 相同），用于隔离统计计数"""
+    return os.environ.get(RUN_ID_ENV, "")
+
+
+def _uvicorn_version() -> Tuple[int, ...]:
+    import uvicorn
+
+    try:
+        return tuple(int(part) for part in uvicorn.__version__.split(".")[:2])
+    except ValueError:
+        return ()
+
+
+def _platform_supports_handoff() -> bool:
+    return hasattr(signal, "SIGUSR2") and os.name != "nt"
+
+
+def supports_handoff() -> bool:
+    """平台支持且 uvicorn 版本经过验证时才使用 SIGUSR2 零停机重启"""
+    return _platform_supports_handoff() and HANDOFF_UVICORN_MIN <= _uvicorn_version() < HANDOFF_UVICORN_MAX
+
+
+def is_handoff_child() -> bool:
+    """本进程是否由重启启动、接管了旧进程的监听 socket"""
+    return bool(os.environ.get(LISTEN_FD_ENV))
+
+
+def run_uvicorn(host: str, port: int, workers: int = 1, **kwargs: Any) -> None:
+    """启动 uvicorn；workers > 1 时以导入路径启动多进程"""
+    import uvicorn
+
+    from app import drain
+
+    workers = max(1, int(workers or 1))
+    kwargs.setdefault("timeout_graceful_shutdown", drain.DRAIN_TIMEOUT)
+    if workers > 1:
+        # 子进程通过环境变量得知运行模式（spawn 方式启动时会继承）
+        os.environ[WORKERS_ENV] = str(workers)
+        os.environ.setdefault(RUN_ID_ENV, uuid.uuid4().hex)
+
+    if supports_handoff():
+        from app import handoff
+
+        handoff.serve(host, port, workers, **kwargs)
+        return
+    if _platform_supports_handoff():
+        logger.warning(f"uvicorn {uvicorn.__version__} 未经验证，零停机重启不可用（restart 将先停止再启动）")
+    if workers == 1:
+        from app.server import app
+
+        uvicorn.run(app, host=host, port=port, **kwargs)
+    else:
+        uvicorn.run(APP_IMPORT_PATH, host=host, port=port, workers=workers, **kwargs)
+
+
+def run_server() -> None:
+    """API 服务入口（解析参数时不导入 Web 框架）"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="iFlow2API Service")
+    parser.add_argument("--port", type=int, default=8000, help="Port to run the service on")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    args = parser.parse_args()
+
+    run_uvicorn("0.0.0.0", args.port, workers=args.workers)
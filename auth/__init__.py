@@ -1,7 +1,3 @@
-from .cli import main
-from .oauth import start_oauth_flow
-from .token import IFlowTokenStorage, load_token_from_file, save_token_to_file, refresh_oauth_tokens, fetch_user_info
-
 __all__ = [
     "main",
     "start_oauth_flow",
@@ -11,3 +7,20 @@ __all__ = [
     "refresh_oauth_tokens",
     "fetch_user_info",
 ]
+
+
+def __getattr__(name):
+    # 访问时才导入：代理只用到 auth.token，不必加载 OAuth 回调服务器（http.server）
+    if name == "main":
+        from auth.cli import main
+
+        return main
+    if name == "start_oauth_flow":
+        from auth.oauth import start_oauth_flow
+
+        return start_oauth_flow
+    if name in __all__:
+        from auth import token
+
+        return getattr(token, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,7 +1,10 @@
 """iFlow Token 管理和刷新模块"""
 
+import asyncio
 import json
+import os
 import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Optional, Dict, Any
 import httpx
@@ -132,6 +135,56 @@ async def save_token_to_file(file_path: str, token: IFlowTokenStorage):
         raise Exception(f"[iFlow] Failed to save token: {e}")
 
 
+def _try_lock_file(handle) -> bool:
+    """非阻塞地获取文件锁"""
+    try:
+        if os.name == "nt":
+            import msvcrt
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock_file(handle) -> None:
+    try:
+        if os.name == "nt":
+            import msvcrt
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+    except OSError:
+        pass
+
+
+@asynccontextmanager
+async def token_refresh_lock(file_path: str, timeout: float = 60.0):
+    """跨进程的 Token 刷新锁（多 worker 共用同一个 token 文件）
+
+    拿到锁后调用方应重新读取 token 文件：其他进程可能已经完成了刷新。
+    """
+    lock_path = Path(str(file_path) + ".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    handle = open(lock_path, "a+")
+    deadline = time.monotonic() + timeout
+    try:
+        while not _try_lock_file(handle):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"[iFlow] Timed out waiting for token lock: {lock_path}")
+            await asyncio.sleep(0.1)
+        try:
+            yield
+        finally:
+            _unlock_file(handle)
+    finally:
+        handle.close()
+
+
 async def refresh_oauth_tokens(refresh_token: str) -> Dict[str, Any]:
     """使用 refresh_token 刷新 OAuth Token"""
     if not refresh_token or not refresh_token.strip():
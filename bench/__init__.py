@@ -0,0 +1 @@
+"""iFlow2API 性能基准"""
@@ -0,0 +1,99 @@
+import argparse
+import sys
+
+from bench import micro
+
+
+def cmd_micro(args: argparse.Namespace) -> int:
+    results = micro.run(args.cases or None, min_time=args.min_time)
+    baseline = micro.load_baseline()
+    print(micro.format_results(results, baseline))
+
+    if args.save_baseline:
+        micro.save_baseline(results)
+        print(f"\nBaseline saved: {micro.BASELINE_PATH}")
+        return 0
+
+    if args.check:
+        regressions = micro.find_regressions(results, baseline, tolerance=args.tolerance)
+        if regressions:
+            print(f"\nRegressions (> {args.tolerance:.0%} slower than baseline): {', '.join(regressions)}")
+            return 1
+        print("\nNo regressions against baseline")
+    return 0
+
+
+def cmd_latency(args: argparse.Namespace) -> int:
+    import logging
+    from bench import latency
+
+    # 逐 chunk 的 INFO/WARNING 日志会淹没结果，也会计入延迟
+    logging.disable(logging.WARNING)
+    results = latency.run(args.paths or None, recording_files=args.recording, iterations=args.iterations)
+    print(latency.format_results(results))
+    return 0
+
+
+def cmd_imports(args: argparse.Namespace) -> int:
+    from bench import imports
+
+    results = imports.run(args.cases or None, runs=args.runs)
+    print(imports.format_results(results))
+    if args.check:
+        violations = imports.find_violations(results, scale=args.scale)
+        if violations:
+            print("\nImport budget exceeded:\n  " + "\n  ".join(violations))
+            return 1
+        print("\nAll entry points within budget")
+    return 0
+
+
+def cmd_record(args: argparse.Namespace) -> int:
+    import asyncio
+    from bench import latency
+
+    recording = asyncio.run(latency.record_to_file(args.out, model=args.model, prompt=args.prompt))
+    print(f"Recorded {len(recording.chunks)} chunks (ttft={recording.ttft * 1000:.1f}ms) -> {args.out}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="iFlow2API benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_micro = sub.add_parser("micro", help="converter / thinking microbenchmarks")
+    p_micro.add_argument("cases", nargs="*", help="case names (default: all)")
+    p_micro.add_argument("--min-time", type=float, default=micro.DEFAULT_MIN_TIME)
+    p_micro.add_argument("--save-baseline", action="store_true", help="store results as the new baseline")
+    p_micro.add_argument("--check", action="store_true", help="exit 1 when slower than the baseline")
+    p_micro.add_argument("--tolerance", type=float, default=micro.DEFAULT_TOLERANCE)
+    p_micro.set_defaults(func=cmd_micro)
+
+    p_latency = sub.add_parser("latency", help="proxy-added TTFT / inter-token latency on replayed SSE")
+    p_latency.add_argument("paths", nargs="*", help="openai / anthropic / continuation (default: all)")
+    p_latency.add_argument("--recording", action="append", help="recorded SSE file(s) to replay, in order")
+    p_latency.add_argument("--iterations", type=int, default=5)
+    p_latency.set_defaults(func=cmd_latency)
+
+    p_imports = sub.add_parser("imports", help="import time of the entry points (python -X importtime)")
+    p_imports.add_argument("cases", nargs="*", help="agent / main / gui / config / server (default: all)")
+    p_imports.add_argument("--runs", type=int, default=5, help="imports per case; the fastest run is reported")
+    p_imports.add_argument("--check", action="store_true", help="exit 1 when over budget or a forbidden module is loaded")
+    p_imports.add_argument("--scale", type=float, default=1.0, help="multiply the budgets (slow machines)")
+    p_imports.set_defaults(func=cmd_imports)
+
+    p_record = sub.add_parser("record", help="record an upstream SSE stream with timing")
+    p_record.add_argument("--out", required=True)
+    p_record.add_argument("--model", default="glm-4.7")
+    p_record.add_argument("--prompt", default="用三句话介绍一下你自己。")
+    p_record.set_defaults(func=cmd_record)
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
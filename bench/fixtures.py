@@ -0,0 +1,173 @@
+"""基准测试用的固定数据（模拟真实 Agent 流量）"""
+
+import json
+from typing import Any, Dict, List
+
+
+def _tool_schema(index: int) -> Dict[str, Any]:
+    properties = {}
+    for field in range(12):
+        properties[f"field_{field}"] = {
+            "type": "string",
+            "description": f"Parameter {field} of tool {index}. " * 4,
+            "enum": [f"value_{index}_{field}_{n}" for n in range(6)],
+        }
+    properties["options"] = {
+        "type": "object",
+        "properties": {
+            "recursive": {"type": "boolean", "description": "Recurse into sub directories"},
+            "limit": {"type": "integer", "minimum": 1, "maximum": 1000},
+            "filters": {"type": "array", "items": {"type": "string"}},
+        },
+    }
+    return {
+        "name": f"tool_{index}",
+        "description": f"Tool number {index}. Reads, writes and searches files in the workspace. " * 3,
+        "input_schema": {
+            "type": "object",
+            "properties": properties,
+            "required": ["field_0", "field_1"],
+        },
+    }
+
+
+def anthropic_agent_transcript(turns: int = 300, tools: int = 40) -> Dict[str, Any]:
+    """构造包含大量 tool_use / tool_result 的 Anthropic 长会话请求"""
+    messages: List[Dict[str, Any]] = [
+        {"role": "user", "content": "请帮我重构 proxy 模块，并补充必要的说明。"},
+    ]
+    for turn in range(turns):
+        tool_id = f"toolu_{turn:06d}"
+        messages.append({
+            "role": "assistant",
+            "content": [
+                {"type": "thinking", "thinking": f"第 {turn} 步：需要先读取文件确认符号定义，再决定修改范围。" * 2},
+                {"type": "text", "text": f"Reading file number {turn} before editing it."},
+                {
+                    "type": "tool_use",
+                    "id": tool_id,
+                    "name": f"tool_{turn % tools}",
+                    "input": {"path": f"src/module_{turn}.py", "offset": turn * 40, "limit": 200},
+                },
+            ],
+        })
+        messages.append({
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": tool_id,
+                    "content": [{"type": "text", "text": f"def handler_{turn}(request):\n    return request\n" * 20}],
+                },
+            ],
+        })
+    messages.append({"role": "user", "content": [{"type": "text", "text": "继续。"}]})
+
+    return {
+        "model": "glm-4.7",
+        "max_tokens": 8192,
+        "stream": True,
+        "system": [{"type": "text", "text": "You are a careful coding agent. " * 200}],
+        "thinking": {"type": "enabled", "budget_tokens": 16000},
+        "tools": [_tool_schema(index) for index in range(tools)],
+        "tool_choice": {"type": "auto"},
+        "messages": messages,
+    }
+
+
+def openai_nonstream_response(tool_calls: int = 20) -> Dict[str, Any]:
+    """构造包含 reasoning、正文与工具调用的 OpenAI 非流式响应"""
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "glm-4.7",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "tool_calls",
+                "message": {
+                    "role": "assistant",
+                    "reasoning_content": "先分析调用关系，再逐个修改。" * 400,
+                    "content": "I will now update the files. " * 200,
+                    "tool_calls": [
+                        {
+                            "id": f"call_{n}",
+                            "type": "function",
+                            "function": {
+                                "name": f"tool_{n}",
+                                "arguments": json.dumps({
+                                    "path": f"src/module_{n}.py",
+                                    "content": "print('hello world')\n" * 200,
+                                }),
+                            },
+                        }
+                        for n in range(tool_calls)
+                    ],
+                },
+            }
+        ],
+        "usage": {
+            "prompt_tokens": 120000,
+            "completion_tokens": 9000,
+            "total_tokens": 129000,
+            "prompt_tokens_details": {"cached_tokens": 80000},
+        },
+    }
+
+
+def _sse(payload: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}"
+
+
+def openai_stream_lines(reasoning: int = 1500, content: int = 2000, tool_args: int = 1500) -> List[str]:
+    """构造一次完整的 OpenAI 流式响应（reasoning -> 正文 -> 工具调用参数）"""
+    lines: List[str] = []
+    base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "glm-4.7"}
+
+    for n in range(reasoning):
+        lines.append(_sse({**base, "choices": [{"index": 0, "delta": {"reasoning_content": f"思考{n} "}, "finish_reason": None}]}))
+    for n in range(content):
+        lines.append(_sse({**base, "choices": [{"index": 0, "delta": {"content": f"token{n} "}, "finish_reason": None}]}))
+
+    lines.append(_sse({**base, "choices": [{"index": 0, "delta": {"tool_calls": [
+        {"index": 0, "id": "call_0", "type": "function", "function": {"name": "write_file", "arguments": ""}}
+    ]}, "finish_reason": None}]}))
+    for n in range(tool_args):
+        fragment = '{"content": "' if n == 0 else f"line {n}\\n"
+        lines.append(_sse({**base, "choices": [{"index": 0, "delta": {"tool_calls": [
+            {"index": 0, "function": {"arguments": fragment}}
+        ]}, "finish_reason": None}]}))
+    lines.append(_sse({**base, "choices": [{"index": 0, "delta": {"tool_calls": [
+        {"index": 0, "function": {"arguments": '"}'}}
+    ]}, "finish_reason": None}]}))
+
+    lines.append(_sse({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "tool_calls"}]}))
+    lines.append(_sse({**base, "choices": [], "usage": {
+        "prompt_tokens": 120000,
+        "completion_tokens": reasoning + content + tool_args,
+        "total_tokens": 120000 + reasoning + content + tool_args,
+        "prompt_tokens_details": {"cached_tokens": 80000},
+    }}))
+    lines.append("data: [DONE]")
+    return lines
+
+
+def openai_chat_request(model: str = "glm-4.7(high)", turns: int = 200) -> Dict[str, Any]:
+    """构造带思考后缀与多轮历史的 OpenAI 请求"""
+    messages: List[Dict[str, Any]] = [{"role": "system", "content": "You are a helpful assistant. " * 100}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"问题 {turn}：这段代码有什么问题？"})
+        messages.append({
+            "role": "assistant",
+            "content": f"回答 {turn}：需要检查边界条件。",
+            "reasoning_content": f"推理 {turn}：先看输入，再看输出。",
+        })
+    messages.append({"role": "user", "content": "总结一下。"})
+    return {
+        "model": model,
+        "messages": messages,
+        "max_tokens": 4096,
+        "reasoning_effort": "high",
+        "stream": True,
+    }
@@ -0,0 +1,122 @@
+"""入口模块的导入耗时预算
+
+每个用例在新的解释器中以 ``python -X importtime`` 重复导入，取多次运行中的最小累计
+耗时（微秒级输出，换算为毫秒）与预算比较，并检查导入期间不应加载的模块：例如
+``iflow_agent.py status`` / ``stop`` 不需要 Web 框架，GUI 包在访问界面前不加载 PyQt5。
+解释器自身启动时（site 等）导入的模块不计入。
+"""
+
+import os
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_RUNS = 5
+
+WEB_STACK = ("fastapi", "starlette", "pydantic", "uvicorn", "httpx", "converters", "app.server", "proxy.proxy")
+
+
+@dataclass(frozen=True)
+class ImportCase:
+    module: str
+    budget_ms: float
+    forbidden: Tuple[str, ...] = ()
+
+
+CASES: Dict[str, ImportCase] = {
+    # iflow_agent.py：status / stop / restart 只需要 pid 文件与 psutil
+    "agent": ImportCase("agent.cli", 60, WEB_STACK),
+    # main.py：解析参数后才导入 uvicorn 与 app.server
+    "main": ImportCase("main", 40, WEB_STACK),
+    # gui_pyqt.py：gui 包在访问 run_gui 时才导入界面模块
+    "gui": ImportCase("gui", 20, ("PyQt5",) + WEB_STACK),
+    # 配置模块导入时不读取文件
+    "config": ImportCase("core.config", 20, ("asyncio",) + WEB_STACK),
+    # 完整服务端：管理页与 OAuth 登录相关模块按需导入
+    "server": ImportCase("app.server", 400, ("psutil", "http.server", "auth.oauth", "PyQt5")),
+}
+
+
+def _importtime(statement: str) -> List[Tuple[str, int]]:
+    """在新解释器中执行 statement，返回 [(模块名, 累计微秒)]，按导入顺序"""
+    env = dict(os.environ)
+    env.pop("PYTHONIMPORTTIME", None)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{statement!r} failed:\n{proc.stderr[-2000:]}")
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        try:
+            modules.append((name.strip(), int(cumulative)))
+        except ValueError:
+            continue  # 表头
+    return modules
+
+
+def measure(case: ImportCase, runs: int = DEFAULT_RUNS, startup: Optional[Set[str]] = None) -> Dict[str, object]:
+    if startup is None:
+        startup = {name for name, _ in _importtime("pass")}
+    best_us: Optional[int] = None
+    loaded: Set[str] = set()
+    for _ in range(runs):
+        modules = _importtime(f"import {case.module}")
+        loaded.update(name for name, _ in modules)
+        total = max((cumulative for name, cumulative in modules if name == case.module), default=0)
+        if best_us is None or total < best_us:
+            best_us = total
+    loaded -= startup
+    forbidden = sorted(
+        name for name in loaded
+        if any(name == prefix or name.startswith(prefix + ".") for prefix in case.forbidden)
+    )
+    # 只列出被禁止的顶层包（子模块不重复列出）
+    roots = sorted({name for name in forbidden if not any(name.startswith(other + ".") for other in forbidden)})
+    import_ms = (best_us or 0) / 1000
+    return {
+        "import_ms": round(import_ms, 1),
+        "budget_ms": case.budget_ms,
+        "modules": len(loaded),
+        "forbidden": roots,
+    }
+
+
+def run(names: Optional[Iterable[str]] = None, runs: int = DEFAULT_RUNS) -> Dict[str, Dict[str, object]]:
+    selected = list(names) if names else list(CASES)
+    unknown = [name for name in selected if name not in CASES]
+    if unknown:
+        raise SystemExit(f"Unknown cases: {', '.join(unknown)} (available: {', '.join(CASES)})")
+    startup = {name for name, _ in _importtime("pass")}
+    return {name: measure(CASES[name], runs=runs, startup=startup) for name in selected}
+
+
+def find_violations(results: Dict[str, Dict[str, object]], scale: float = 1.0) -> List[str]:
+    violations = []
+    for name, result in results.items():
+        if result["import_ms"] > result["budget_ms"] * scale:
+            violations.append(f"{name}: {result['import_ms']}ms > {result['budget_ms'] * scale:g}ms")
+        if result["forbidden"]:
+            violations.append(f"{name}: imports {', '.join(result['forbidden'])}")
+    return violations
+
+
+def format_results(results: Dict[str, Dict[str, object]]) -> str:
+    header = f"{'case':<10}{'module':<16}{'import_ms':>12}{'budget_ms':>12}{'modules':>10}  forbidden"
+    lines = [header]
+    for name, result in results.items():
+        lines.append(
+            f"{name:<10}{CASES[name].module:<16}{result['import_ms']:>12.1f}{result['budget_ms']:>12g}"
+            f"{result['modules']:>10}  {', '.join(result['forbidden']) or '-'}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,212 @@
+"""代理在流式路径上额外引入的 TTFT 与逐 token 延迟
+
+上游由 ReplayTransport 按录制时序回放，客户端直接驱动 ASGI 应用并记录每个
+响应分块的到达时间，两者相减即为代理自身引入的延迟。
+"""
+
+import asyncio
+import json
+import statistics
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from bench.sse_replay import Recording, ReplayTransport, record_stream, synthesize_recording
+
+PATHS = ("openai", "anthropic", "anthropic_tools", "continuation")
+
+
+def _request_for(path: str, model: str) -> tuple:
+    body = {
+        "model": model,
+        "max_tokens": 1024,
+        "stream": True,
+        "messages": [{"role": "user", "content": "hello"}],
+    }
+    if path.startswith("anthropic"):
+        return "/v1/messages", body
+    return "/v1/chat/completions", body
+
+
+async def _drive(app, url: str, body: Dict[str, Any]) -> tuple:
+    """直接调用 ASGI 应用，返回 (请求开始时间, [各响应分块到达时间])"""
+    payload = json.dumps(body).encode("utf-8")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": url,
+        "raw_path": url.encode("ascii"),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"bench.local"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode("ascii")),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench.local", 80),
+    }
+    body_sent = False
+    disconnect = asyncio.Event()
+    arrivals: List[float] = []
+    status = {"code": 0}
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+        elif message["type"] == "http.response.body":
+            if message.get("body"):
+                arrivals.append(time.perf_counter())
+            if not message.get("more_body", False):
+                disconnect.set()
+
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    if status["code"] != 200:
+        raise RuntimeError(f"{url} 返回 HTTP {status['code']}")
+    return started, arrivals
+
+
+def _event_delays(emissions: List[float], arrivals: List[float]) -> List[float]:
+    """每个上游分块发出后，到客户端收到下一个分块之间的时间"""
+    delays = []
+    index = 0
+    for emitted in emissions:
+        while index < len(arrivals) and arrivals[index] < emitted:
+            index += 1
+        if index >= len(arrivals):
+            break
+        delays.append(arrivals[index] - emitted)
+    return delays
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[position]
+
+
+def _install_replay_proxy(transport: ReplayTransport):
+    import proxy.proxy as proxy_module
+    from proxy.proxy import ReverseProxy
+
+    replay_proxy = ReverseProxy("http://replay.local/v1", "bench-key")
+    replay_proxy._client = httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(300.0, connect=10.0))
+    previous = proxy_module._proxy
+    proxy_module._proxy = replay_proxy
+    return proxy_module, previous
+
+
+async def measure_path(
+    path: str,
+    *,
+    recordings: Optional[List[Recording]] = None,
+    iterations: int = 5,
+    model: str = "kimi-k2.5",
+) -> Dict[str, float]:
+    """测量单条路径的额外 TTFT 与逐分块延迟（单位 ms）"""
+    from app.server import app
+
+    if recordings is None:
+        if path == "continuation":
+            recordings = [synthesize_recording(finish_reason="length"), synthesize_recording()]
+        elif path == "anthropic_tools":
+            recordings = [synthesize_recording(tokens=20, tool_arg_chunks=200, finish_reason="tool_calls")]
+        else:
+            recordings = [synthesize_recording()]
+
+    transport = ReplayTransport(recordings)
+    proxy_module, previous = _install_replay_proxy(transport)
+    url, body = _request_for(path, model)
+
+    extra_ttft: List[float] = []
+    delays: List[float] = []
+    client_itl: List[float] = []
+    upstream_itl: List[float] = []
+    try:
+        for _ in range(iterations):
+            transport.reset()
+            started, arrivals = await _drive(app, url, json.loads(json.dumps(body)))
+            emissions = [t for request_emissions in transport.emissions for t in request_emissions]
+            if not arrivals or not emissions:
+                continue
+            extra_ttft.append(arrivals[0] - emissions[0])
+            delays.extend(_event_delays(emissions, arrivals))
+            client_itl.extend(b - a for a, b in zip(arrivals, arrivals[1:]))
+            upstream_itl.extend(b - a for a, b in zip(emissions, emissions[1:]))
+    finally:
+        await proxy_module._proxy.close()
+        proxy_module._proxy = previous
+
+    def ms(value: float) -> float:
+        return round(value * 1000, 3)
+
+    return {
+        "extra_ttft_ms": ms(statistics.mean(extra_ttft)) if extra_ttft else 0.0,
+        "event_delay_p50_ms": ms(_percentile(delays, 50)),
+        "event_delay_p95_ms": ms(_percentile(delays, 95)),
+        "event_delay_max_ms": ms(max(delays)) if delays else 0.0,
+        "client_itl_ms": ms(statistics.mean(client_itl)) if client_itl else 0.0,
+        "upstream_itl_ms": ms(statistics.mean(upstream_itl)) if upstream_itl else 0.0,
+    }
+
+
+def run(
+    paths: Optional[List[str]] = None,
+    *,
+    recording_files: Optional[List[str]] = None,
+    iterations: int = 5,
+) -> Dict[str, Dict[str, float]]:
+    recordings = [Recording.load(path) for path in recording_files] if recording_files else None
+    results = {}
+    for path in paths or PATHS:
+        if path not in PATHS:
+            raise KeyError(f"未知路径: {path}")
+        results[path] = asyncio.run(measure_path(path, recordings=recordings, iterations=iterations))
+    return results
+
+
+def format_results(results: Dict[str, Dict[str, float]]) -> str:
+    columns = ["extra_ttft_ms", "event_delay_p50_ms", "event_delay_p95_ms", "event_delay_max_ms", "client_itl_ms", "upstream_itl_ms"]
+    lines = ["path          " + "  ".join(f"{column:>18}" for column in columns)]
+    for path, result in results.items():
+        lines.append(f"{path:<14}" + "  ".join(f"{result[column]:>18.3f}" for column in columns))
+    return "\n".join(lines)
+
+
+async def record_to_file(out_path: str, *, model: str, prompt: str) -> Recording:
+    """经由当前配置的上游录制一次真实流式响应"""
+    from proxy.proxy import get_proxy
+
+    proxy = get_proxy()
+    await proxy.initialize()
+    body = {
+        "model": model,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+        "max_tokens": 1024,
+        "messages": [{"role": "user", "content": prompt}],
+    }
+    processed = proxy._modify_request_body(body, model)
+    headers = proxy._apply_iflow_security_headers(proxy._director({}))
+    client = await proxy._get_client()
+    try:
+        recording = await record_stream(client, f"{proxy.upstream_url}/chat/completions", headers=headers, body=processed)
+    finally:
+        await proxy.close()
+    recording.save(out_path)
+    return recording
@@ -0,0 +1,279 @@
+"""转换器与 thinking 处理的微基准"""
+
+import json
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from app.request_log import CONTENT_LIMIT, CaptureBuffer, RequestLogRecord, json_preview
+from bench import fixtures
+from converters import StreamConverter, anthropic_to_openai, openai_to_anthropic_nonstream
+from core import json_codec
+from core.thinking import apply_thinking
+from core.tokens import TokenCounter
+from proxy.rewrite import rewrite_request
+from proxy.transfer import SSESplitter
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+DEFAULT_MIN_TIME = 0.5  # 每个用例至少运行的秒数
+DEFAULT_TOLERANCE = 0.25  # 允许的 ops/sec 下降比例
+
+# name -> setup()，setup 返回被测的无参可调用对象
+CASES: Dict[str, Callable[[], Callable[[], Any]]] = {}
+
+
+def bench_case(name: str):
+    """注册基准用例"""
+    def decorator(setup: Callable[[], Callable[[], Any]]):
+        CASES[name] = setup
+        return setup
+    return decorator
+
+
+@bench_case("anthropic_to_openai/agent_transcript")
+def _anthropic_to_openai():
+    request = fixtures.anthropic_agent_transcript()
+    return lambda: anthropic_to_openai(request)
+
+
+@bench_case("openai_to_anthropic_nonstream/tool_calls")
+def _openai_to_anthropic_nonstream():
+    response = fixtures.openai_nonstream_response()
+    return lambda: openai_to_anthropic_nonstream(response)
+
+
+@bench_case("stream_converter/full_stream")
+def _stream_converter():
+    lines = fixtures.openai_stream_lines()
+
+    def run():
+        converter = StreamConverter("glm-4.7", "msg_bench", estimated_input_tokens=1000)
+        for line in lines:
+            converter.convert_chunk(line)
+
+    return run
+
+
+@bench_case("stream_converter/text_delta")
+def _stream_converter_text_delta():
+    lines = fixtures.openai_stream_lines(reasoning=0, content=2, tool_args=0)
+    converter = StreamConverter("glm-4.7", "msg_bench")
+    converter.convert_chunk(lines[0])
+    data = json_codec.loads(lines[1][5:].strip())
+    return lambda: converter.convert_data(data)
+
+
+@bench_case("apply_thinking/glm_suffix")
+def _apply_thinking_glm():
+    body = fixtures.openai_chat_request("glm-4.7(high)")
+    return lambda: apply_thinking(dict(body), "glm-4.7(high)")
+
+
+@bench_case("apply_thinking/minimax_effort")
+def _apply_thinking_minimax():
+    body = fixtures.openai_chat_request("minimax-m2.5")
+    return lambda: apply_thinking(dict(body), "minimax-m2.5")
+
+
+@bench_case("apply_thinking/other_model")
+def _apply_thinking_other():
+    body = fixtures.openai_chat_request("kimi-k2.5")
+    return lambda: apply_thinking(dict(body), "kimi-k2.5")
+
+
+@bench_case("rewrite/agent_transcript")
+def _rewrite_agent_transcript():
+    body = anthropic_to_openai(fixtures.anthropic_agent_transcript())
+    return lambda: rewrite_request(body, "glm-4.7(high)")
+
+
+@bench_case("upstream/sse_split")
+def _upstream_sse_split():
+    # 上游 SSE 按网络分块到达：每块 48 字节，事件跨块
+    data = "".join(line + "\n\n" for line in fixtures.openai_stream_lines()).encode()
+    chunks = [data[i:i + 48] for i in range(0, len(data), 48)]
+
+    def run():
+        splitter = SSESplitter()
+        for chunk in chunks:
+            splitter.feed(chunk)
+        splitter.remainder()
+
+    return run
+
+
+@bench_case("request_log/record")
+def _request_log_record():
+    body = fixtures.anthropic_agent_transcript()
+    headers = [(b"host", b"127.0.0.1:8000"), (b"authorization", b"Bearer sk-bench"), (b"content-type", b"application/json")]
+    reasoning = ["思考片段 "] * 1500
+    content = ["token "] * 2000
+
+    def run():
+        RequestLogRecord(
+            method="POST",
+            path="/v1/messages",
+            status=200,
+            model="glm-4.7",
+            request_id="req_bench",
+            latency_ms=1200,
+            headers=headers,
+            body=json_preview(body),
+            reasoning=reasoning,
+            content=content,
+            effective_model="glm-4.7",
+        )
+
+    return run
+
+
+@bench_case("request_log/capture_stream")
+def _request_log_capture_stream():
+    tokens = ["token "] * 2000
+
+    def run():
+        capture = CaptureBuffer(CONTENT_LIMIT)
+        for token in tokens:
+            capture.append(token)
+        return capture.preview()
+
+    return run
+
+
+@bench_case("tokens/count_anthropic_input")
+def _tokens_count_anthropic_input():
+    body = fixtures.anthropic_agent_transcript()
+    counter = TokenCounter()
+
+    def run():
+        return counter.count_anthropic_input(body)
+
+    return run
+
+
+@bench_case("json/stdlib/loads_request")
+def _json_stdlib_loads():
+    payload = json.dumps(fixtures.anthropic_agent_transcript(), ensure_ascii=False).encode("utf-8")
+    return lambda: json.loads(payload.decode("utf-8"))
+
+
+@bench_case("json/codec/loads_request")
+def _json_codec_loads():
+    payload = json.dumps(fixtures.anthropic_agent_transcript(), ensure_ascii=False).encode("utf-8")
+    return lambda: json_codec.loads(payload)
+
+
+@bench_case("json/stdlib/dumps_request")
+def _json_stdlib_dumps():
+    request = anthropic_to_openai(fixtures.anthropic_agent_transcript())
+    return lambda: json.dumps(request).encode("utf-8")
+
+
+@bench_case("json/codec/dumps_request")
+def _json_codec_dumps():
+    request = anthropic_to_openai(fixtures.anthropic_agent_transcript())
+    return lambda: json_codec.dumps(request)
+
+
+@bench_case("json/stdlib/loads_sse_chunk")
+def _json_stdlib_loads_chunk():
+    chunk = fixtures.openai_stream_lines(reasoning=0, content=1, tool_args=0)[0].encode("utf-8") + b"\n\n"
+    return lambda: json.loads(chunk.decode("utf-8")[6:])
+
+
+@bench_case("json/codec/loads_sse_chunk")
+def _json_codec_loads_chunk():
+    chunk = fixtures.openai_stream_lines(reasoning=0, content=1, tool_args=0)[0].encode("utf-8") + b"\n\n"
+    return lambda: json_codec.loads(chunk[5:].strip())
+
+
+def measure(fn: Callable[[], Any], min_time: float = DEFAULT_MIN_TIME) -> Dict[str, float]:
+    """测量吞吐（ops/sec）与单次调用的峰值内存分配"""
+    fn()  # 预热
+
+    # 先单独测分配，避免 tracemalloc 拖慢吞吐测量
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline_size, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    alloc_kb = max(0, peak - baseline_size) / 1024
+
+    ops = 0
+    batch = 1
+    started = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        for _ in range(batch):
+            fn()
+        ops += batch
+        elapsed = time.perf_counter() - started
+        batch = min(batch * 2, 1024)
+
+    return {
+        "ops_per_sec": round(ops / elapsed, 2),
+        "us_per_op": round(elapsed / ops * 1_000_000, 2),
+        "alloc_kb": round(alloc_kb, 1),
+    }
+
+
+def run(names: Optional[Iterable[str]] = None, min_time: float = DEFAULT_MIN_TIME) -> Dict[str, Dict[str, float]]:
+    """运行指定（默认全部）用例"""
+    selected = list(names) if names else list(CASES)
+    unknown = [name for name in selected if name not in CASES]
+    if unknown:
+        raise KeyError(f"未知用例: {', '.join(unknown)}")
+
+    results: Dict[str, Dict[str, float]] = {}
+    for name in selected:
+        results[name] = measure(CASES[name](), min_time=min_time)
+    return results
+
+
+def load_baseline(path: Path = BASELINE_PATH) -> Dict[str, Dict[str, float]]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_baseline(results: Dict[str, Dict[str, float]], path: Path = BASELINE_PATH) -> None:
+    merged = load_baseline(path)
+    merged.update(results)
+    path.write_text(json.dumps(merged, indent=2, ensure_ascii=False, sort_keys=True) + "\n", encoding="utf-8")
+
+
+def find_regressions(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> List[str]:
+    """返回吞吐低于基线 (1 - tolerance) 的用例"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous or not previous.get("ops_per_sec"):
+            continue
+        if result["ops_per_sec"] < previous["ops_per_sec"] * (1 - tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def format_results(
+    results: Dict[str, Dict[str, float]],
+    baseline: Optional[Dict[str, Dict[str, float]]] = None,
+) -> str:
+    baseline = baseline or {}
+    width = max((len(name) for name in results), default=10)
+    lines = [f"{'case':<{width}}  {'ops/sec':>12}  {'us/op':>12}  {'alloc KiB':>10}  {'vs base':>8}"]
+    for name, result in results.items():
+        previous = baseline.get(name, {}).get("ops_per_sec")
+        ratio = f"{result['ops_per_sec'] / previous:.2f}x" if previous else "-"
+        lines.append(
+            f"{name:<{width}}  {result['ops_per_sec']:>12.2f}  {result['us_per_op']:>12.2f}  "
+            f"{result['alloc_kb']:>10.1f}  {ratio:>8}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,157 @@
+"""上游 SSE 流的录制与按原时序回放
+
+录制文件为 JSONL：首行是响应头信息，之后每行是一个分块
+``{"t": 相对请求开始的秒数, "b64": 分块内容}``。
+"""
+
+import asyncio
+import base64
+import json
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+RECORDING_VERSION = 1
+
+
+class Recording:
+    """一次上游 SSE 响应的录制结果"""
+
+    def __init__(self, chunks: List[tuple], status: int = 200, headers: Optional[Dict[str, str]] = None):
+        self.chunks = chunks  # [(offset_seconds, bytes)]
+        self.status = status
+        self.headers = headers or {"content-type": "text/event-stream"}
+
+    @property
+    def ttft(self) -> float:
+        return self.chunks[0][0] if self.chunks else 0.0
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            header = {"version": RECORDING_VERSION, "status": self.status, "headers": self.headers}
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            for offset, chunk in self.chunks:
+                f.write(json.dumps({"t": round(offset, 6), "b64": base64.b64encode(chunk).decode("ascii")}) + "\n")
+
+    @classmethod
+    def load(cls, path: str) -> "Recording":
+        lines = Path(path).read_text(encoding="utf-8").splitlines()
+        if not lines:
+            raise ValueError(f"空的录制文件: {path}")
+        header = json.loads(lines[0])
+        chunks = []
+        for line in lines[1:]:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            chunks.append((float(item["t"]), base64.b64decode(item["b64"])))
+        return cls(chunks, status=header.get("status", 200), headers=header.get("headers"))
+
+
+def synthesize_recording(
+    *,
+    tokens: int = 200,
+    reasoning_tokens: int = 0,
+    tool_arg_chunks: int = 0,
+    ttft: float = 0.05,
+    itl: float = 0.005,
+    finish_reason: str = "stop",
+    model: str = "glm-4.7",
+) -> Recording:
+    """按给定 TTFT / 间隔生成一段合成的 OpenAI 流（无真实录制时使用）"""
+    base = {"id": "chatcmpl-replay", "object": "chat.completion.chunk", "created": 0, "model": model}
+    events: List[Dict[str, Any]] = []
+    for n in range(reasoning_tokens):
+        events.append({**base, "choices": [{"index": 0, "delta": {"reasoning_content": f"思考{n} "}, "finish_reason": None}]})
+    for n in range(tokens):
+        events.append({**base, "choices": [{"index": 0, "delta": {"content": f"tok{n} "}, "finish_reason": None}]})
+    if tool_arg_chunks:
+        events.append({**base, "choices": [{"index": 0, "delta": {"tool_calls": [
+            {"index": 0, "id": "call_replay", "type": "function", "function": {"name": "write_file", "arguments": ""}}
+        ]}, "finish_reason": None}]})
+        for n in range(tool_arg_chunks):
+            fragment = '{"content": "' if n == 0 else ('"}' if n == tool_arg_chunks - 1 else f"line {n}\\n")
+            events.append({**base, "choices": [{"index": 0, "delta": {"tool_calls": [
+                {"index": 0, "function": {"arguments": fragment}}
+            ]}, "finish_reason": None}]})
+    events.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]})
+    completion_tokens = tokens + reasoning_tokens + tool_arg_chunks
+    events.append({**base, "choices": [], "usage": {
+        "prompt_tokens": 100,
+        "completion_tokens": completion_tokens,
+        "total_tokens": 100 + completion_tokens,
+    }})
+
+    chunks = []
+    offset = ttft
+    for event in events:
+        chunks.append((offset, f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8")))
+        offset += itl
+    chunks.append((offset, b"data: [DONE]\n\n"))
+    return Recording(chunks)
+
+
+async def record_stream(
+    client: httpx.AsyncClient,
+    url: str,
+    *,
+    headers: Dict[str, str],
+    body: Dict[str, Any],
+) -> Recording:
+    """请求上游并按到达时间录制每个分块"""
+    started = time.perf_counter()
+    chunks = []
+    async with client.stream("POST", url, headers=headers, json=body) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            chunks.append((time.perf_counter() - started, chunk))
+        response_headers = {"content-type": response.headers.get("content-type", "text/event-stream")}
+        return Recording(chunks, status=response.status_code, headers=response_headers)
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+
+    def __init__(self, recording: Recording, started: float, emitted: List[float]):
+        self.recording = recording
+        self.started = started
+        self.emitted = emitted
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for offset, chunk in self.recording.chunks:
+            delay = self.started + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.emitted.append(time.perf_counter())
+            yield chunk
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """按录制时序回放的上游（依次使用 recordings，循环）
+
+    每次请求的分块发出时间记录在 ``emissions`` 中，供基准计算代理额外延迟。
+    """
+
+    def __init__(self, recordings: List[Recording]):
+        if not recordings:
+            raise ValueError("recordings 不能为空")
+        self.recordings = recordings
+        self.requests = 0
+        self.emissions: List[List[float]] = []
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        recording = self.recordings[self.requests % len(self.recordings)]
+        self.requests += 1
+        emitted: List[float] = []
+        self.emissions.append(emitted)
+        return httpx.Response(
+            recording.status,
+            headers=recording.headers,
+            stream=_ReplayStream(recording, time.perf_counter(), emitted),
+            request=request,
+        )
+
+    def reset(self) -> None:
+        self.requests = 0
+        self.emissions = []
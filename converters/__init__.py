@@ -1,7 +1,13 @@
 
-import json
+import logging
 import uuid
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Union
+
+from core import json_codec
+from core.tokens import text_weight, weight_to_tokens
+from converters import events as sse_events
+
+logger = logging.getLogger(__name__)
 
 
 def _normalize_base64_data(data: str) -> str:
@@ -114,7 +120,7 @@ def anthropic_to_openai(req: dict) -> dict:
                             "type": "function",
                             "function": {
                                 "name": block.get("name", ""),
-                                "arguments": json.dumps(block.get("input", {}))
+                                "arguments": json_codec.dumps_str(block.get("input", {}))
                             }
                         })
 
@@ -257,14 +263,14 @@ def _convert_tool_result_content(content) -> str:
                 if item.get("type") == "text" and "text" in item:
                     parts.append(item["text"])
                 else:
-                    parts.append(json.dumps(item))
+                    parts.append(json_codec.dumps_str(item))
         joined = "\n\n".join(parts)
-        return joined if joined.strip() else json.dumps(content)
+        return joined if joined.strip() else json_codec.dumps_str(content)
 
     if isinstance(content, dict):
         if "text" in content:
             return content["text"]
-        return json.dumps(content)
+        return json_codec.dumps_str(content)
 
     return str(content)
 
@@ -325,7 +331,7 @@ def openai_to_anthropic_nonstream(resp: dict) -> dict:
                                 func = tc.get("function", {})
                                 args_str = func.get("arguments", "{}")
                                 try:
-                                    input_data = json.loads(args_str) if args_str else {}
+                                    input_data = json_codec.loads(args_str) if args_str else {}
                                 except:
                                     input_data = {}
 
@@ -367,7 +373,7 @@ def openai_to_anthropic_nonstream(resp: dict) -> dict:
                     func = tc.get("function", {})
                     args_str = func.get("arguments", "{}")
                     try:
-                        input_data = json.loads(args_str) if args_str else {}
+                        input_data = json_codec.loads(args_str) if args_str else {}
                     except:
                         input_data = {}
 
@@ -443,11 +449,12 @@ class StreamConverter:
         self.text_content_block_started = False
         self.thinking_content_block_started = False
         self.finish_reason = ""
-        self.content_blocks_stopped = False
         self.message_delta_sent = False
         self.message_started = False
         self.message_stop_sent = False
         self.tool_call_block_indexes: Dict[int, int] = {}
+        # 当前打开的 tool_use block 对应的 tool call index；同一时刻只有一个 block 打开
+        self.open_tool_call: Optional[int] = None
         self.text_content_block_index = -1
         self.thinking_content_block_index = -1
         self.next_content_block_index = 0
@@ -455,39 +462,49 @@ class StreamConverter:
         self.output_tokens = 0
         self.cached_tokens = 0
         self.estimated_input_tokens = max(0, int(estimated_input_tokens or 0))
-        self.generated_text_chars = 0
-        self.generated_reasoning_chars = 0
-        self.generated_tool_args_chars = 0
+        # 上游未返回 usage 时用于估算输出 token（启发式权重，最后取整）
+        self.generated_token_weight = 0.0
 
-    def convert_chunk(self, line: str) -> List[str]:
+    def convert_chunk(self, line: Union[str, bytes]) -> List[bytes]:
         """转换单个 chunk"""
-        if not line.startswith("data:"):
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+        if not line.startswith(b"data:"):
             return []
 
         # 兼容 "data:" 和 "data: " 两种格式
-        data_str = line[5:].lstrip().strip()
+        data_bytes = line[5:].strip()
 
         # [DONE]
-        if data_str == "[DONE]":
+        if data_bytes == b"[DONE]":
             return self._handle_done()
 
         try:
-            data = json.loads(data_str)
+            data = json_codec.loads(data_bytes)
         except:
             return []
 
+        return self.convert_data(data)
+
+    def convert_done(self) -> List[bytes]:
+        """处理已识别的 [DONE] 事件"""
+        return self._handle_done()
+
+    def convert_data(self, data: Dict[str, Any]) -> List[bytes]:
+        """转换已解析的 chunk（调用方已解析 JSON 时避免重复解析）"""
+        if not isinstance(data, dict):
+            return []
+
         events = []
 
         # message_start
         if not self.message_started:
-            events.append(f'event: message_start\ndata: {json.dumps({"type": "message_start", "message": {"id": self.message_id, "type": "message", "role": "assistant", "model": self.model, "content": [], "stop_reason": None, "stop_sequence": None, "usage": {"input_tokens": 0, "output_tokens": 0}}})}\n\n')
+            events.append(sse_events.message_start(self.message_id, self.model))
             self.message_started = True
 
-        choices = data.get("choices", [])
-        if not choices:
-            return events
-
-        delta = choices[0].get("delta", {})
+        choices = data.get("choices") or [{}]
+        # include_usage 的最后一个 chunk 没有 choices，只携带 usage
+        delta = choices[0].get("delta") or {}
 
         # reasoning_content
         if "reasoning_content" in delta:
@@ -495,28 +512,29 @@ class StreamConverter:
             for text in reasoning_texts:
                 if not text:
                     continue
-                self.generated_reasoning_chars += len(text)
+                self.generated_token_weight += text_weight(text)
                 self._stop_text_content_block(events)
+                self._stop_tool_call_block(events)
                 if not self.thinking_content_block_started:
-                    if self.thinking_content_block_index == -1:
-                        self.thinking_content_block_index = self.next_content_block_index
-                        self.next_content_block_index += 1
-                    events.append(f'event: content_block_start\ndata: {json.dumps({"type": "content_block_start", "index": self.thinking_content_block_index, "content_block": {"type": "thinking", "thinking": ""}})}\n\n')
+                    # 已关闭的 block 不能重新打开（例如续写的下一轮又输出思考内容），每次都使用新的 index
+                    self.thinking_content_block_index = self.next_content_block_index
+                    self.next_content_block_index += 1
+                    events.append(sse_events.content_block_start(self.thinking_content_block_index, {"type": "thinking", "thinking": ""}))
                     self.thinking_content_block_started = True
-                events.append(f'event: content_block_delta\ndata: {json.dumps({"type": "content_block_delta", "index": self.thinking_content_block_index, "delta": {"type": "thinking_delta", "thinking": text}})}\n\n')
+                events.append(sse_events.content_block_delta("thinking", self.thinking_content_block_index, text))
 
         # content
         if "content" in delta and delta["content"]:
             text = delta["content"]
-            self.generated_text_chars += len(text)
+            self.generated_token_weight += text_weight(text)
             if not self.text_content_block_started:
                 self._stop_thinking_content_block(events)
-                if self.text_content_block_index == -1:
-                    self.text_content_block_index = self.next_content_block_index
-                    self.next_content_block_index += 1
-                events.append(f'event: content_block_start\ndata: {json.dumps({"type": "content_block_start", "index": self.text_content_block_index, "content_block": {"type": "text", "text": ""}})}\n\n')
+                self._stop_tool_call_block(events)
+                self.text_content_block_index = self.next_content_block_index
+                self.next_content_block_index += 1
+                events.append(sse_events.content_block_start(self.text_content_block_index, {"type": "text", "text": ""}))
                 self.text_content_block_started = True
-            events.append(f'event: content_block_delta\ndata: {json.dumps({"type": "content_block_delta", "index": self.text_content_block_index, "delta": {"type": "text_delta", "text": text}})}\n\n')
+            events.append(sse_events.content_block_delta("text", self.text_content_block_index, text))
 
         # tool_calls
         if "tool_calls" in delta:
@@ -525,30 +543,36 @@ class StreamConverter:
                 tc_id = tc.get("id")
                 func = tc.get("function", {})
 
-                if tc_id:
+                # 部分上游在每个 chunk 上重复 id：只有新的 tool call 才开始新的 block
+                known = self.tool_calls_accumulator.get(tc_index)
+                if tc_id and not self.finish_reason and (known is None or known["id"] != tc_id):
                     self._stop_thinking_content_block(events)
                     self._stop_text_content_block(events)
+                    # block 依次进行：开始下一个 tool call 前关闭当前的
+                    self._stop_tool_call_block(events)
 
-                    if tc_index not in self.tool_call_block_indexes:
-                        self.tool_call_block_indexes[tc_index] = self.next_content_block_index
-                        self.next_content_block_index += 1
-
-                    block_index = self.tool_call_block_indexes[tc_index]
+                    block_index = self.next_content_block_index
+                    self.next_content_block_index += 1
+                    self.tool_call_block_indexes[tc_index] = block_index
+                    # 只保留簿记信息，参数片段到达即转发，不在内存中累积
                     self.tool_calls_accumulator[tc_index] = {
                         "id": tc_id,
                         "name": func.get("name", ""),
-                        "arguments": ""
                     }
+                    self.open_tool_call = tc_index
 
-                    events.append(f'event: content_block_start\ndata: {json.dumps({"type": "content_block_start", "index": block_index, "content_block": {"type": "tool_use", "id": tc_id, "name": func.get("name", ""), "input": {}}})}\n\n')
+                    events.append(sse_events.content_block_start(block_index, {"type": "tool_use", "id": tc_id, "name": func.get("name", ""), "input": {}}))
 
-                # 累积参数
-                if tc_index in self.tool_calls_accumulator and "arguments" in func:
-                    args_delta = func["arguments"]
-                    if args_delta:
-                        self.generated_tool_args_chars += len(args_delta)
-                        block_index = self.tool_call_block_indexes[tc_index]
-                        self.tool_calls_accumulator[tc_index]["arguments"] += args_delta
+                # 增量转发参数片段（只转发给当前打开的 block）
+                args_delta = func.get("arguments")
+                if not args_delta or tc_index not in self.tool_calls_accumulator:
+                    continue
+                if tc_index != self.open_tool_call:
+                    # OpenAI 流式协议中 tool call 依次输出；已关闭的 block 不能再追加内容
+                    logger.warning(f"丢弃已结束的 tool call #{tc_index} 的参数片段 ({len(args_delta)} 字符)")
+                    continue
+                self.generated_token_weight += text_weight(args_delta)
+                events.append(sse_events.content_block_delta("input_json", self.tool_call_block_indexes[tc_index], args_delta))
 
         # finish_reason
         if "finish_reason" in choices[0] and choices[0]["finish_reason"]:
@@ -556,23 +580,12 @@ class StreamConverter:
 
             # 停止所有 content blocks
             if self.thinking_content_block_started:
-                events.append(f'event: content_block_stop\ndata: {json.dumps({"type": "content_block_stop", "index": self.thinking_content_block_index})}\n\n')
+                events.append(sse_events.content_block_stop(self.thinking_content_block_index))
                 self.thinking_content_block_started = False
 
             self._stop_text_content_block(events)
 
-            if not self.content_blocks_stopped:
-                for tc_index in self.tool_calls_accumulator:
-                    block_index = self.tool_call_block_indexes[tc_index]
-                    acc = self.tool_calls_accumulator[tc_index]
-
-                    # 发送完整的 arguments
-                    if acc["arguments"]:
-                        events.append(f'event: content_block_delta\ndata: {json.dumps({"type": "content_block_delta", "index": block_index, "delta": {"type": "input_json_delta", "partial_json": acc["arguments"]}})}\n\n')
-
-                    events.append(f'event: content_block_stop\ndata: {json.dumps({"type": "content_block_stop", "index": block_index})}\n\n')
-
-                self.content_blocks_stopped = True
+            self._stop_tool_call_block(events)
 
         # usage
         if self.finish_reason and "usage" in data:
@@ -596,35 +609,25 @@ class StreamConverter:
             if self.cached_tokens > 0:
                 msg_delta["usage"]["cache_read_input_tokens"] = self.cached_tokens
 
-            events.append(f'event: message_delta\ndata: {json.dumps(msg_delta)}\n\n')
+            events.append(sse_events.message_delta(msg_delta))
             self.message_delta_sent = True
 
             self._emit_message_stop_if_needed(events)
 
         return events
 
-    def _handle_done(self) -> List[str]:
+    def _handle_done(self) -> List[bytes]:
         """处理 [DONE]"""
         events = []
 
         # 停止所有 content blocks
         if self.thinking_content_block_started:
-            events.append(f'event: content_block_stop\ndata: {json.dumps({"type": "content_block_stop", "index": self.thinking_content_block_index})}\n\n')
+            events.append(sse_events.content_block_stop(self.thinking_content_block_index))
             self.thinking_content_block_started = False
 
         self._stop_text_content_block(events)
 
-        if not self.content_blocks_stopped:
-            for tc_index in self.tool_calls_accumulator:
-                block_index = self.tool_call_block_indexes[tc_index]
-                acc = self.tool_calls_accumulator[tc_index]
-
-                if acc["arguments"]:
-                    events.append(f'event: content_block_delta\ndata: {json.dumps({"type": "content_block_delta", "index": block_index, "delta": {"type": "input_json_delta", "partial_json": acc["arguments"]}})}\n\n')
-
-                events.append(f'event: content_block_stop\ndata: {json.dumps({"type": "content_block_stop", "index": block_index})}\n\n')
-
-            self.content_blocks_stopped = True
+        self._stop_tool_call_block(events)
 
         # message_delta
         if self.finish_reason and not self.message_delta_sent:
@@ -640,7 +643,7 @@ class StreamConverter:
             }
             if self.cached_tokens > 0:
                 message_delta["usage"]["cache_read_input_tokens"] = self.cached_tokens
-            events.append(f'event: message_delta\ndata: {json.dumps(message_delta)}\n\n')
+            events.append(sse_events.message_delta(message_delta))
             self.message_delta_sent = True
 
         self._emit_message_stop_if_needed(events)
@@ -648,28 +651,32 @@ class StreamConverter:
         return events
 
     def _estimate_output_tokens(self) -> int:
-        total_chars = self.generated_text_chars + self.generated_reasoning_chars + self.generated_tool_args_chars
-        if total_chars <= 0:
-            return 0
-        return max(1, (total_chars + 3) // 4)
+        return weight_to_tokens(self.generated_token_weight)
 
-    def _stop_thinking_content_block(self, events: List[str]):
+    def _stop_thinking_content_block(self, events: List[bytes]):
         """停止 thinking content block"""
         if not self.thinking_content_block_started:
             return
-        events.append(f'event: content_block_stop\ndata: {json.dumps({"type": "content_block_stop", "index": self.thinking_content_block_index})}\n\n')
+        events.append(sse_events.content_block_stop(self.thinking_content_block_index))
         self.thinking_content_block_started = False
 
-    def _stop_text_content_block(self, events: List[str]):
+    def _stop_text_content_block(self, events: List[bytes]):
         """停止 text content block"""
         if not self.text_content_block_started:
             return
-        events.append(f'event: content_block_stop\ndata: {json.dumps({"type": "content_block_stop", "index": self.text_content_block_index})}\n\n')
+        events.append(sse_events.content_block_stop(self.text_content_block_index))
         self.text_content_block_started = False
 
-    def _emit_message_stop_if_needed(self, events: List[str]):
+    def _stop_tool_call_block(self, events: List[bytes]):
+        """停止当前打开的 tool_use content block（参数已增量发送）"""
+        if self.open_tool_call is None:
+            return
+        events.append(sse_events.content_block_stop(self.tool_call_block_indexes[self.open_tool_call]))
+        self.open_tool_call = None
+
+    def _emit_message_stop_if_needed(self, events: List[bytes]):
         """发送 message_stop"""
         if self.message_stop_sent:
             return
-        events.append(f'event: message_stop\ndata: {json.dumps({"type": "message_stop"})}\n\n')
+        events.append(sse_events.MESSAGE_STOP)
         self.message_stop_sent = True
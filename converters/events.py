@@ -0,0 +1,82 @@
+"""Anthropic SSE 事件的字节编码
+
+高频事件（content_block_delta / content_block_stop）使用预先序列化的字节模板，
+每个 token 只需对可变文本做一次 JSON 转义并拼接，不再构造嵌套 dict 整体序列化。
+低频事件（message_start / message_delta 等）仍走 json_codec。
+"""
+
+from typing import Any, Dict, Tuple
+
+from core import json_codec
+
+_DELTA_HEAD = b'event: content_block_delta\ndata: {"type":"content_block_delta","index":'
+_DELTA_KINDS = {
+    "text": b',"delta":{"type":"text_delta","text":',
+    "thinking": b',"delta":{"type":"thinking_delta","thinking":',
+    "input_json": b',"delta":{"type":"input_json_delta","partial_json":',
+}
+_DELTA_TAIL = b"}}\n\n"
+
+MESSAGE_STOP = b'event: message_stop\ndata: {"type":"message_stop"}\n\n'
+
+# (kind, index) -> 已拼好的前缀；index 超过上限时不缓存
+_delta_prefixes: Dict[Tuple[str, int], bytes] = {}
+_stop_events: Dict[int, bytes] = {}
+_MAX_CACHED_INDEX = 256
+
+
+def _delta_prefix(kind: str, index: int) -> bytes:
+    key = (kind, index)
+    prefix = _delta_prefixes.get(key)
+    if prefix is None:
+        prefix = _DELTA_HEAD + str(index).encode("ascii") + _DELTA_KINDS[kind]
+        if index < _MAX_CACHED_INDEX:
+            _delta_prefixes[key] = prefix
+    return prefix
+
+
+def encode_event(event_type: str, payload: Dict[str, Any]) -> bytes:
+    """通用编码：event 行 + data 行"""
+    return b"event: " + event_type.encode("ascii") + b"\ndata: " + json_codec.dumps(payload) + b"\n\n"
+
+
+def content_block_delta(kind: str, index: int, text: str) -> bytes:
+    """kind 为 text / thinking / input_json"""
+    return _delta_prefix(kind, index) + json_codec.dumps(text) + _DELTA_TAIL
+
+
+def content_block_stop(index: int) -> bytes:
+    event = _stop_events.get(index)
+    if event is None:
+        event = (
+            b'event: content_block_stop\ndata: {"type":"content_block_stop","index":'
+            + str(index).encode("ascii")
+            + b"}\n\n"
+        )
+        if index < _MAX_CACHED_INDEX:
+            _stop_events[index] = event
+    return event
+
+
+def content_block_start(index: int, content_block: Dict[str, Any]) -> bytes:
+    return encode_event("content_block_start", {"type": "content_block_start", "index": index, "content_block": content_block})
+
+
+def message_start(message_id: str, model: str) -> bytes:
+    return encode_event("message_start", {
+        "type": "message_start",
+        "message": {
+            "id": message_id,
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": [],
+            "stop_reason": None,
+            "stop_sequence": None,
+            "usage": {"input_tokens": 0, "output_tokens": 0},
+        },
+    })
+
+
+def message_delta(payload: Dict[str, Any]) -> bytes:
+    return encode_event("message_delta", payload)
@@ -1,4 +1,15 @@
-from .config import CONFIG, load_config, load_iflow_config, check_iflow_login
-from .thinking import apply_thinking
+"""核心模块；名称在首次访问时才导入对应子模块"""
 
-__all__ = ["CONFIG", "load_config", "load_iflow_config", "check_iflow_login", "apply_thinking"]
+__all__ = ["CONFIG", "config_store", "current_config", "load_config", "load_iflow_config", "check_iflow_login", "apply_thinking"]
+
+
+def __getattr__(name):
+    if name == "apply_thinking":
+        from core.thinking import apply_thinking
+
+        return apply_thinking
+    if name in __all__:
+        from core import config
+
+        return getattr(config, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
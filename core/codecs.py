@@ -0,0 +1,112 @@
+"""HTTP 内容编码（gzip / deflate / zstd）
+
+客户端传输（app.compression）与上游传输（proxy.transfer）共用的压缩与流式解压。
+zstd 需要可选依赖 ``zstandard``，未安装时只使用 gzip / deflate。
+"""
+
+import zlib
+from typing import Iterator, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 取决于运行环境
+    zstandard = None
+
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+# 解压时单次输出的上限
+DECODE_PIECE_BYTES = 256 * 1024
+# zstd 解压没有输出上限参数，按小片输入控制单次展开的大小
+ZSTD_INPUT_SLICE = 512
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def available_encodings() -> Tuple[str, ...]:
+    """可用于压缩的编码，按优先级排列"""
+    return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+def decodable_encodings() -> Tuple[str, ...]:
+    return ("zstd", "gzip", "deflate") if zstandard is not None else ("gzip", "deflate")
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+class Encoder:
+    """流式压缩：每次 compress 的输出都已刷新，可以立即发出"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "zstd":
+            return self._obj.compress(data) + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "zstd":
+            return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+        return self._obj.flush(zlib.Z_FINISH)
+
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return obj.compress(data) + obj.flush()
+
+
+class Decoder:
+    """流式解压；feed 产出的每段不超过 DECODE_PIECE_BYTES（zstd 为近似值）"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdDecompressor().decompressobj()
+        elif encoding == "deflate":
+            self._obj = zlib.decompressobj(zlib.MAX_WBITS)
+        else:
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        if self.encoding == "zstd":
+            for start in range(0, len(data), ZSTD_INPUT_SLICE):
+                piece = self._obj.decompress(data[start:start + ZSTD_INPUT_SLICE])
+                if piece:
+                    yield piece
+            return
+        while data and not self._obj.eof:
+            piece = self._obj.decompress(data, DECODE_PIECE_BYTES)
+            data = self._obj.unconsumed_tail
+            if piece:
+                yield piece
+
+    def finish(self) -> None:
+        """输入结束；数据被截断时抛出 zlib.error / ValueError"""
+        if self.encoding == "zstd":
+            if not self._obj.eof:
+                raise ValueError("truncated zstd stream")
+            return
+        if not self._obj.eof:
+            raise zlib.error("truncated compressed stream")
+
+
+def parse_content_encoding(content_encoding: Optional[str]) -> Optional[str]:
+    """Content-Encoding -> 可解码的编码名；未压缩时返回 None，无法解码时抛出 UnsupportedEncoding"""
+    encodings = [item.strip().lower() for item in (content_encoding or "").split(",") if item.strip()]
+    encodings = [item for item in encodings if item != "identity"]
+    if not encodings:
+        return None
+    if len(encodings) > 1:
+        raise UnsupportedEncoding(f"Unsupported Content-Encoding: {content_encoding}")
+    encoding = "gzip" if encodings[0] == "x-gzip" else encodings[0]
+    if encoding in decodable_encodings():
+        return encoding
+    raise UnsupportedEncoding(f"Unsupported Content-Encoding: {content_encoding}")
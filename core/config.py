@@ -1,10 +1,31 @@
+"""iFlow 配置
+
+首次读取时从 ``~/.iflow/oauth_creds.json``（优先）或 ``~/.iflow/settings.json`` 加载（导入
+本模块不读取文件）。运行中
+这两个文件变化时由 ``config_store.watch()``（在 app.server 的 lifespan 中启动）重新加载：
+新配置校验通过后整体替换为新的只读快照并递增版本号，文件无效（例如正在写入）或缺少
+API Key 时保留当前配置。``CONFIG`` 始终读取当前快照；需要多个字段保持一致时用
+``current_config()`` 取一次快照。
+"""
+
 import json
+import logging
+import threading
+import time
 from pathlib import Path
-from typing import Optional
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_VISION_MODEL = "qwen3-vl-plus"
 DEFAULT_AUTO_VISION_MODEL = True
 
+OAUTH_CREDS_PATH = Path.home() / ".iflow" / "oauth_creds.json"
+SETTINGS_PATH = Path.home() / ".iflow" / "settings.json"
+# 检查配置文件是否修改的间隔（秒）
+RELOAD_CHECK_INTERVAL = 2.0
+
 
 class IFlowConfig:
     """iFlow 配置类"""
@@ -18,6 +39,8 @@ class IFlowConfig:
         vision_model: str = "",
         auto_vision_model: bool = False,
         allow_local_file_images: bool = False,
+        session_affinity: bool = False,
+        upstream_compression: str = "",
     ):
         self.api_key = api_key
         self.base_url = base_url
@@ -26,12 +49,14 @@ class IFlowConfig:
         self.vision_model = vision_model
         self.auto_vision_model = auto_vision_model
         self.allow_local_file_images = allow_local_file_images
+        self.session_affinity = session_affinity
+        self.upstream_compression = upstream_compression
 
 
 def load_iflow_config() -> IFlowConfig:
     """加载 iFlow 配置 - 支持 OAuth 和传统 API Key"""
     # 优先尝试加载 OAuth 凭证
-    oauth_path = Path.home() / ".iflow" / "oauth_creds.json"
+    oauth_path = OAUTH_CREDS_PATH
     if oauth_path.exists():
         try:
             data = json.loads(oauth_path.read_text(encoding="utf-8"))
@@ -47,6 +72,12 @@ def load_iflow_config() -> IFlowConfig:
             allow_local_file_images = data.get("allowLocalFileImages")
             if allow_local_file_images is None:
                 allow_local_file_images = data.get("allow_local_file_images")
+            session_affinity = data.get("sessionAffinity")
+            if session_affinity is None:
+                session_affinity = data.get("session_affinity")
+            upstream_compression = data.get("upstreamCompression")
+            if upstream_compression is None:
+                upstream_compression = data.get("upstream_compression")
             if api_key:
                 print(f"[Config] Loaded OAuth credentials from {oauth_path}")
                 return IFlowConfig(
@@ -56,12 +87,14 @@ def load_iflow_config() -> IFlowConfig:
                     vision_model=vision_model,
                     auto_vision_model=bool(auto_vision_model),
                     allow_local_file_images=bool(allow_local_file_images),
+                    session_affinity=bool(session_affinity),
+                    upstream_compression=upstream_compression or "",
                 )
         except Exception as e:
             print(f"[Config] Failed to load OAuth credentials: {e}")
 
     # 回退到传统配置文件
-    settings_path = Path.home() / ".iflow" / "settings.json"
+    settings_path = SETTINGS_PATH
     try:
         with open(settings_path, encoding="utf-8") as f:
             data = json.load(f)
@@ -79,6 +112,12 @@ def load_iflow_config() -> IFlowConfig:
         allow_local_file_images = data.get("allowLocalFileImages")
         if allow_local_file_images is None:
             allow_local_file_images = data.get("allow_local_file_images")
+        session_affinity = data.get("sessionAffinity")
+        if session_affinity is None:
+            session_affinity = data.get("session_affinity")
+        upstream_compression = data.get("upstreamCompression")
+        if upstream_compression is None:
+            upstream_compression = data.get("upstream_compression")
 
         if not api_key:
             raise ValueError("API Key 未配置")
@@ -90,6 +129,8 @@ def load_iflow_config() -> IFlowConfig:
             vision_model=vision_model,
             auto_vision_model=bool(auto_vision_model),
             allow_local_file_images=bool(allow_local_file_images),
+            session_affinity=bool(session_affinity),
+            upstream_compression=upstream_compression or "",
         )
     except FileNotFoundError:
         raise FileNotFoundError("iFlow 配置文件不存在，请先运行 OAuth 认证或配置 API Key")
@@ -116,6 +157,8 @@ def load_config():
             "vision_model": config.vision_model,
             "auto_vision_model": config.auto_vision_model,
             "allow_local_file_images": config.allow_local_file_images,
+            "session_affinity": config.session_affinity,
+            "upstream_compression": config.upstream_compression,
         }
     except (FileNotFoundError, ValueError):
         return {
@@ -125,8 +168,152 @@ def load_config():
             "token_file_path": None,
             "vision_model": DEFAULT_VISION_MODEL,
             "auto_vision_model": DEFAULT_AUTO_VISION_MODEL,
-            "allow_local_file_images": False
+            "allow_local_file_images": False,
+            "session_affinity": False,
+            "upstream_compression": "",
+        }
+
+
+def _load_validated() -> Dict[str, Any]:
+    """重新加载时使用：配置文件存在但无法解析、或没有 API Key 时抛出异常（启动时则回退）"""
+    for path in (OAUTH_CREDS_PATH, SETTINGS_PATH):
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            continue
+        if not isinstance(data, dict):
+            raise ValueError(f"{path.name}: 根节点必须是对象")
+    config = load_config()
+    if not config["api_key"]:
+        raise ValueError("API Key 未配置")
+    return config
+
+
+def _sources_state() -> Tuple[Optional[Tuple[int, int]], ...]:
+    state = []
+    for path in (OAUTH_CREDS_PATH, SETTINGS_PATH):
+        try:
+            stat = path.stat()
+            state.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            state.append(None)
+    return tuple(state)
+
+
+ConfigListener = Callable[[Mapping[str, Any], Mapping[str, Any]], None]
+
+
+class ConfigStore:
+    """当前配置的只读快照；配置文件变化时校验后整体替换"""
+
+    def __init__(self):
+        self._current: Optional[Mapping[str, Any]] = None
+        self._file_state: Tuple[Optional[Tuple[int, int]], ...] = ()
+        self.version = 1
+        self.loaded_at = 0.0
+        self.reloads = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._listeners: List[ConfigListener] = []
+
+    @property
+    def current(self) -> Mapping[str, Any]:
+        current = self._current
+        if current is None:
+            with self._lock:
+                if self._current is None:
+                    self._file_state = _sources_state()
+                    self._current = MappingProxyType(load_config())
+                    self.loaded_at = time.time()
+                current = self._current
+        return current
+
+    def reload(self) -> bool:
+        """重新加载；配置无效时保留当前快照并返回 False，内容未变化时也返回 False"""
+        previous = self.current
+        with self._lock:
+            # 先记录文件状态：加载期间文件再次变化时，下次检查会再加载一次
+            self._file_state = _sources_state()
+            try:
+                config = _load_validated()
+            except Exception as e:
+                self.rejected += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.warning(f"重新加载配置失败，继续使用当前配置 (version {self.version}): {e}")
+                return False
+            self.last_error = None
+            if config == dict(previous):
+                return False
+            self._current = MappingProxyType(config)
+            self.version += 1
+            self.reloads += 1
+            self.loaded_at = time.time()
+            current = self._current
+        changed = [key for key in current if current[key] != previous.get(key)]
+        logger.info(f"配置已重新加载 (version {self.version})，变化: {', '.join(changed)}")
+        for listener in list(self._listeners):
+            try:
+                listener(previous, current)
+            except Exception as e:
+                logger.warning(f"配置监听器出错: {e}")
+        return True
+
+    def maybe_reload(self) -> bool:
+        # 尚未加载时无需检查：首次读取会加载最新的文件
+        if self._current is None or _sources_state() == self._file_state:
+            return False
+        return self.reload()
+
+    async def watch(self, interval: float = RELOAD_CHECK_INTERVAL) -> None:
+        """按修改时间轮询配置文件（每次只 stat 两个文件）"""
+        import asyncio
+
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.maybe_reload()
+            except Exception as e:
+                logger.warning(f"检查配置文件失败: {e}")
+
+    def add_listener(self, callback: ConfigListener) -> None:
+        """注册配置替换后的回调：callback(旧快照, 新快照)"""
+        self._listeners.append(callback)
+
+    def info(self) -> Dict[str, Any]:
+        current = self.current
+        return {
+            "version": self.version,
+            "loaded_at": int(self.loaded_at),
+            "source": current.get("token_file_path") or str(SETTINGS_PATH),
+            "reloads": self.reloads,
+            "rejected": self.rejected,
+            "last_error": self.last_error,
         }
 
 
-CONFIG = load_config()
+config_store = ConfigStore()
+
+
+def current_config() -> Mapping[str, Any]:
+    """当前配置快照（只读，之后的重新加载不会改变它）"""
+    return config_store.current
+
+
+class _CurrentConfig(Mapping):
+    """每次读取都取当前快照的只读映射"""
+
+    def __getitem__(self, key: str) -> Any:
+        return config_store.current[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(config_store.current)
+
+    def __len__(self) -> int:
+        return len(config_store.current)
+
+    def __repr__(self) -> str:
+        return f"CONFIG({dict(config_store.current)!r})"
+
+
+CONFIG: Mapping[str, Any] = _CurrentConfig()
@@ -0,0 +1,85 @@
+"""统一的 JSON 编解码层
+
+优先使用 orjson，其次 msgspec，均不可用时回退到标准库 json。
+所有接口直接处理 bytes，避免先 decode 成 str 再解析的中间拷贝。
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于运行环境
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - 取决于运行环境
+    msgspec = None
+
+JSONDecodeError = json.JSONDecodeError
+Buffer = Union[bytes, bytearray, memoryview, str]
+
+if orjson is not None:
+    BACKEND = "orjson"
+elif msgspec is not None:
+    BACKEND = "msgspec"
+else:
+    BACKEND = "json"
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    try:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    except UnicodeEncodeError:
+        # 含孤立代理项的字符串无法编码为 UTF-8，改用 ASCII 转义
+        return json.dumps(obj, separators=(",", ":")).encode("ascii")
+
+
+def _stdlib_loads(data: Buffer) -> Any:
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+if BACKEND == "orjson":
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any) -> bytes:
+        """序列化为紧凑的 UTF-8 JSON bytes"""
+        try:
+            return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # 超出 64 位的整数、孤立代理项等 orjson 不支持的输入
+            return _stdlib_dumps(obj)
+
+    def loads(data: Buffer) -> Any:
+        """从 bytes / str 解析 JSON，失败时抛出 json.JSONDecodeError"""
+        return orjson.loads(data)
+
+elif BACKEND == "msgspec":
+    _encoder = msgspec.json.Encoder()
+    _decoder = msgspec.json.Decoder()
+
+    def dumps(obj: Any) -> bytes:
+        """序列化为紧凑的 UTF-8 JSON bytes"""
+        try:
+            return _encoder.encode(obj)
+        except (TypeError, OverflowError, UnicodeEncodeError):
+            return _stdlib_dumps(obj)
+
+    def loads(data: Buffer) -> Any:
+        """从 bytes / str 解析 JSON，失败时抛出 json.JSONDecodeError"""
+        try:
+            return _decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise JSONDecodeError(str(e), "", 0) from e
+
+else:
+    dumps = _stdlib_dumps
+    loads = _stdlib_loads
+
+
+def dumps_str(obj: Any) -> str:
+    """序列化为 str（用于日志、SSE 文本拼接等需要 str 的场景）"""
+    return dumps(obj).decode("utf-8")
@@ -0,0 +1,296 @@
+"""模型能力注册表
+
+记录每个模型的能力与路由信息：是否支持图片、思考参数格式、最大输出 token、回退模型、
+别名，以及是否出现在 /v1/models 中。内置默认值之外，可在
+``~/.iflow2api/models.json`` 中增加或覆盖条目，例如::
+
+    {
+      "visionModel": "qwen3-vl-plus",
+      "models": {
+        "glm*": {"maxOutputTokens": 131072},
+        "my-model-vl": {"vision": true, "listed": true, "aliases": ["mvl"]},
+        "kimi-k2.5": {"fallbacks": ["qwen3-vl-plus"]}
+      }
+    }
+
+键可以是模型名或通配模式（``*``），按出现顺序合并（内置在前），精确匹配的条目最后
+合并。字段：``vision``、``thinking``（"glm" / "minimax" / "none"）、``maxOutputTokens``、
+``fallbacks``（图片需要视觉模型时优先使用其中支持图片的模型）、``aliases``、
+``twoStageVision``（有图片时先由视觉模型解析再交给本模型）、``listed``。
+
+加载时编译为精确匹配字典与模式列表，每个模型名的解析结果缓存，请求路径上是 O(1)
+查找。文件修改后自动重新加载，无需重启；iFlow 配置中的 ``visionModel`` 变化时同样
+重新加载。
+"""
+
+import fnmatch
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core import json_codec
+from core.config import CONFIG, DEFAULT_VISION_MODEL, config_store
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_PATH = Path.home() / ".iflow2api" / "models.json"
+# 检查注册表文件是否修改的最短间隔（秒）
+RELOAD_CHECK_INTERVAL = 2.0
+# 解析结果缓存的条目上限，超出后整体清空
+RESOLVED_CACHE_SIZE = 4096
+
+THINKING_FORMATS = ("glm", "minimax")
+
+DEFAULT_MODELS: Dict[str, Dict[str, Any]] = {
+    # 系列默认值
+    "glm*": {"thinking": "glm", "twoStageVision": True},
+    "minimax*": {"thinking": "minimax", "twoStageVision": True},
+    # 名称中带视觉标记的模型视为支持图片
+    "*vl*": {"vision": True},
+    "*vision*": {"vision": True},
+    "*4v*": {"vision": True},
+    "*multimodal*": {"vision": True},
+    # 具体模型
+    "qwen3-vl-plus": {"vision": True},
+    "tstars2.0": {"vision": True},
+    # 上游 /v1/models 未返回时也列出的模型
+    "glm-4.7": {"listed": True},
+    "glm-5": {"listed": True},
+    "minimax-m2.1": {"listed": True},
+    "minimax-m2.5": {"listed": True},
+    "kimi-k2.5": {"listed": True},
+    "iflow-rome-30ba3b": {"listed": True},
+}
+
+
+@dataclass(frozen=True)
+class ModelCapabilities:
+    model: str
+    vision: bool = False
+    # "glm" / "minimax"；空字符串表示不支持思考参数
+    thinking: str = ""
+    max_output_tokens: Optional[int] = None
+    fallbacks: Tuple[str, ...] = ()
+    two_stage_vision: bool = False
+    listed: bool = False
+
+
+def _get(entry: Dict[str, Any], camel: str, snake: str) -> Any:
+    value = entry.get(camel)
+    return entry.get(snake) if value is None else value
+
+
+def _normalize_entry(entry: Any) -> Dict[str, Any]:
+    """配置条目 -> 内部字段（只保留出现的字段，便于逐层合并）"""
+    if not isinstance(entry, dict):
+        return {}
+    fields: Dict[str, Any] = {}
+    if "vision" in entry:
+        fields["vision"] = bool(entry["vision"])
+    if "thinking" in entry:
+        thinking = str(entry["thinking"] or "").lower()
+        fields["thinking"] = thinking if thinking in THINKING_FORMATS else ""
+    max_output = _get(entry, "maxOutputTokens", "max_output_tokens")
+    if max_output is not None:
+        try:
+            fields["max_output_tokens"] = int(max_output) if int(max_output) > 0 else None
+        except (TypeError, ValueError):
+            logger.warning(f"模型注册表: 无效的 maxOutputTokens {max_output!r}")
+    fallbacks = entry.get("fallbacks")
+    if isinstance(fallbacks, list):
+        fields["fallbacks"] = tuple(str(item) for item in fallbacks if item)
+    two_stage = _get(entry, "twoStageVision", "two_stage_vision")
+    if two_stage is not None:
+        fields["two_stage_vision"] = bool(two_stage)
+    if "listed" in entry:
+        fields["listed"] = bool(entry["listed"])
+    return fields
+
+
+class _CompiledRegistry:
+    """一次加载的编译结果；重新加载时整体替换"""
+
+    def __init__(self, entries: Dict[str, Dict[str, Any]], vision_model: str):
+        self.vision_model = vision_model
+        self.exact: Dict[str, Dict[str, Any]] = {}
+        self.patterns: List[Tuple[re.Pattern, Dict[str, Any]]] = []
+        self.aliases: Dict[str, str] = {}
+        listed: List[str] = []
+        for key, entry in entries.items():
+            name = key.strip()
+            if not name:
+                continue
+            fields = _normalize_entry(entry)
+            if "*" in name or "?" in name:
+                self.patterns.append((re.compile(fnmatch.translate(name.lower())), fields))
+                continue
+            merged = self.exact.setdefault(name.lower(), {})
+            merged.update(fields)
+            aliases = entry.get("aliases") if isinstance(entry, dict) else None
+            if isinstance(aliases, list):
+                for alias in aliases:
+                    if alias:
+                        self.aliases[str(alias).lower()] = name
+            if fields.get("listed") and name not in listed:
+                listed.append(name)
+        self.listed = tuple(name for name in listed if self.exact[name.lower()].get("listed"))
+        self.resolved: Dict[str, ModelCapabilities] = {}
+
+    def resolve(self, model: str) -> ModelCapabilities:
+        key = model.lower()
+        caps = self.resolved.get(key)
+        if caps is not None:
+            return caps
+        fields: Dict[str, Any] = {}
+        for pattern, pattern_fields in self.patterns:
+            if pattern.match(key):
+                fields.update(pattern_fields)
+        fields.update(self.exact.get(key, {}))
+        caps = ModelCapabilities(model=model, **fields)
+        if len(self.resolved) >= RESOLVED_CACHE_SIZE:
+            self.resolved.clear()
+        self.resolved[key] = caps
+        return caps
+
+
+class ModelRegistry:
+
+    def __init__(self, path: Path = REGISTRY_PATH):
+        self.path = path
+        self.version = 0
+        self.last_error: Optional[str] = None
+        self._file_state: Optional[Tuple[float, int]] = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[], None]] = []
+        try:
+            self._compiled = self._load()
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.warning(f"加载模型注册表失败 {self.path}，仅使用内置默认值: {e}")
+            self._compiled = self._load({})
+
+    # ---- 加载 ----
+
+    def _read_file(self) -> Dict[str, Any]:
+        try:
+            stat = self.path.stat()
+        except OSError:
+            self._file_state = None
+            return {}
+        self._file_state = (stat.st_mtime, stat.st_size)
+        data = json_codec.loads(self.path.read_bytes())
+        if not isinstance(data, dict):
+            raise ValueError("根节点必须是对象")
+        return data
+
+    def _load(self, data: Optional[Dict[str, Any]] = None) -> _CompiledRegistry:
+        """读取注册表文件并编译；文件无效时抛出异常（data 给定时不读文件）"""
+        if data is None:
+            data = self._read_file()
+        entries = {key: dict(value) for key, value in DEFAULT_MODELS.items()}
+        user_models = data.get("models")
+        if isinstance(user_models, dict):
+            for key, value in user_models.items():
+                if isinstance(value, dict):
+                    # 同名条目在内置值之上合并，新条目追加在最后
+                    entries.setdefault(key, {}).update(value)
+        vision_model = data.get("visionModel") or data.get("vision_model") or CONFIG.get("vision_model") or DEFAULT_VISION_MODEL
+        return _CompiledRegistry(entries, str(vision_model))
+
+    def reload(self) -> bool:
+        """重新加载；文件无效时保留当前注册表并返回 False"""
+        with self._lock:
+            try:
+                compiled = self._load()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.warning(f"重新加载模型注册表失败 {self.path}，继续使用当前注册表: {e}")
+                return False
+            self.last_error = None
+            self._compiled = compiled
+            self.version += 1
+        logger.info(f"模型注册表已重新加载 (version {self.version})")
+        for listener in list(self._listeners):
+            try:
+                listener()
+            except Exception as e:
+                logger.warning(f"模型注册表监听器出错: {e}")
+        return True
+
+    def maybe_reload(self) -> None:
+        """注册表文件变化时重新加载（最多每 RELOAD_CHECK_INTERVAL 秒检查一次）"""
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            stat = self.path.stat()
+            state: Optional[Tuple[float, int]] = (stat.st_mtime, stat.st_size)
+        except OSError:
+            state = None
+        if state != self._file_state:
+            self.reload()
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        """注册重新加载后的回调"""
+        self._listeners.append(callback)
+
+    # ---- 查询 ----
+
+    def canonical(self, model: str) -> str:
+        """别名 -> 注册表中的模型名；不是别名时原样返回"""
+        return self._compiled.aliases.get(model.lower(), model)
+
+    def lookup(self, model: str) -> ModelCapabilities:
+        compiled = self._compiled
+        return compiled.resolve(compiled.aliases.get(model.lower(), model))
+
+    @property
+    def vision_model(self) -> str:
+        """默认的视觉模型（两段式解析与图片回退使用）"""
+        return self._compiled.vision_model
+
+    def vision_fallback(self, model: str) -> str:
+        """模型需要视觉模型代劳时使用的模型：回退列表中第一个支持图片的模型，否则默认视觉模型"""
+        for fallback in self.lookup(model).fallbacks:
+            if self.lookup(fallback).vision:
+                return self.canonical(fallback)
+        return self.vision_model
+
+    def listed_models(self) -> Tuple[str, ...]:
+        return self._compiled.listed
+
+    def info(self) -> Dict[str, Any]:
+        compiled = self._compiled
+        return {
+            "path": str(self.path),
+            "loaded_from_file": self._file_state is not None,
+            "version": self.version,
+            "models": len(compiled.exact),
+            "patterns": len(compiled.patterns),
+            "aliases": len(compiled.aliases),
+            "vision_model": compiled.vision_model,
+            "last_error": self.last_error,
+        }
+
+
+_registry: Optional[ModelRegistry] = None
+
+
+def _on_config_change(previous, current) -> None:
+    # 默认视觉模型可以来自 iFlow 配置：重新编译注册表（请求计划缓存随版本号失效）
+    if _registry is not None and previous.get("vision_model") != current.get("vision_model"):
+        _registry.reload()
+
+
+def get_model_registry() -> ModelRegistry:
+    global _registry
+    if _registry is None:
+        _registry = ModelRegistry()
+        config_store.add_listener(_on_config_change)
+    return _registry
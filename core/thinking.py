@@ -2,9 +2,14 @@
 
 import re
 from enum import Enum
+from functools import lru_cache
 from typing import Optional, Dict, Any
 from dataclasses import dataclass
 
+from core.models import get_model_registry
+
+_SUFFIX_RE = re.compile(r'^(.+)\(([^)]+)\)$')
+
 
 class ThinkingMode(Enum):
     """Thinking configuration mode."""
@@ -33,7 +38,7 @@ class ThinkingConfig:
     level: Optional[ThinkingLevel] = None
 
 
-@dataclass
+@dataclass(frozen=True)
 class SuffixResult:
     """Result of parsing model name suffix."""
     model_name: str
@@ -41,15 +46,16 @@ class SuffixResult:
     raw_suffix: str = ""
 
 
+@lru_cache(maxsize=1024)
 def parse_suffix(model: str) -> SuffixResult:
-    """Extract thinking suffix from model name.
+    """Extract thinking suffix from model name (memoised per model string).
 
     Examples:
         "glm-4.7(8192)" -> model_name="glm-4.7", raw_suffix="8192"
         "glm-4.7(high)" -> model_name="glm-4.7", raw_suffix="high"
         "glm-4.7" -> model_name="glm-4.7", has_suffix=False
     """
-    match = re.match(r'^(.+)\(([^)]+)\)$', model)
+    match = _SUFFIX_RE.match(model)
     if match:
         return SuffixResult(
             model_name=match.group(1),
@@ -177,13 +183,12 @@ def apply_thinking_to_glm(body: Dict[str, Any], config: ThinkingConfig) -> Dict[
     """
     enable_thinking = config_to_boolean(config)
 
-    if "chat_template_kwargs" not in body:
-        body["chat_template_kwargs"] = {}
-
-    body["chat_template_kwargs"]["enable_thinking"] = enable_thinking
-
+    # 复制后再修改：body 通常是调用方请求体的浅拷贝
+    kwargs = dict(body.get("chat_template_kwargs") or {})
+    kwargs["enable_thinking"] = enable_thinking
     if enable_thinking:
-        body["chat_template_kwargs"]["clear_thinking"] = False
+        kwargs["clear_thinking"] = False
+    body["chat_template_kwargs"] = kwargs
 
     return body
 
@@ -216,6 +221,14 @@ def is_minimax_model(model_id: str) -> bool:
     return model_id.lower().startswith("minimax")
 
 
+def thinking_format(model_id: str) -> str:
+    """Thinking parameter format used by the model: "glm", "minimax" or "" (unsupported).
+
+    Looked up in the model registry (core.models) rather than by name prefix.
+    """
+    return get_model_registry().lookup(model_id).thinking
+
+
 def preserve_reasoning_content(body: Dict[str, Any], model: str) -> Dict[str, Any]:
     """Preserve reasoning_content in messages for GLM/MiniMax models.
 
@@ -263,9 +276,12 @@ def strip_thinking_config(body: Dict[str, Any]) -> Dict[str, Any]:
     """
     # iFlow format fields
     if "chat_template_kwargs" in body:
-        body["chat_template_kwargs"].pop("enable_thinking", None)
-        body["chat_template_kwargs"].pop("clear_thinking", None)
-        if not body["chat_template_kwargs"]:
+        kwargs = dict(body["chat_template_kwargs"] or {})
+        kwargs.pop("enable_thinking", None)
+        kwargs.pop("clear_thinking", None)
+        if kwargs:
+            body["chat_template_kwargs"] = kwargs
+        else:
             body.pop("chat_template_kwargs")
 
     body.pop("reasoning_split", None)
@@ -275,6 +291,40 @@ def strip_thinking_config(body: Dict[str, Any]) -> Dict[str, Any]:
     return body
 
 
+def apply_thinking_config(
+    body: Dict[str, Any],
+    base_model: str,
+    suffix_config: Optional[ThinkingConfig],
+    fmt: str,
+) -> Dict[str, Any]:
+    """Apply thinking configuration with the model-dependent parts already resolved.
+
+    ``suffix_config`` / ``fmt`` come from the model name only (see proxy.rewrite, which
+    caches them per model string); only the body-dependent lookup happens per request.
+    """
+    body["model"] = base_model
+
+    # Get config: suffix priority over body, iFlow format priority over OpenAI
+    config = suffix_config
+    if config is None:
+        config = extract_iflow_config(body)
+    if config is None:
+        config = extract_openai_config(body)
+    if config is None:
+        return body
+
+    # Remove OpenAI format fields (will be replaced with iFlow format)
+    body.pop("reasoning_effort", None)
+    body.pop("thinking", None)
+
+    if fmt == "glm":
+        return apply_thinking_to_glm(body, config)
+    if fmt == "minimax":
+        return apply_thinking_to_minimax(body, config)
+    # For other models, strip thinking config
+    return strip_thinking_config(body)
+
+
 def apply_thinking(body: Dict[str, Any], model: str) -> Dict[str, Any]:
     """Apply thinking configuration to request body.
 
@@ -283,7 +333,6 @@ def apply_thinking(body: Dict[str, Any], model: str) -> Dict[str, Any]:
         2. Config extraction from request body (iFlow format priority)
         3. Suffix priority over body config
         4. Provider-specific application
-        5. Reasoning content preservation for multi-turn conversations
 
     Args:
         body: Request body dict
@@ -292,44 +341,7 @@ def apply_thinking(body: Dict[str, Any], model: str) -> Dict[str, Any]:
     Returns:
         Modified request body with thinking config applied
     """
-    # Parse suffix
     suffix_result = parse_suffix(model)
+    suffix_config = parse_suffix_to_config(suffix_result.raw_suffix) if suffix_result.has_suffix else None
     base_model = suffix_result.model_name
-
-    # Update model field to base model (without suffix)
-    body["model"] = base_model
-
-    # Get config: suffix priority over body, iFlow format priority over OpenAI
-    config = None
-    if suffix_result.has_suffix:
-        config = parse_suffix_to_config(suffix_result.raw_suffix)
-
-    if config is None:
-        # Try iFlow format first
-        config = extract_iflow_config(body)
-
-    if config is None:
-        # Fall back to OpenAI format
-        config = extract_openai_config(body)
-
-    if config is None:
-        # No thinking config found, just preserve reasoning content if needed
-        return preserve_reasoning_content(body, base_model)
-
-    # Remove OpenAI format fields (will be replaced with iFlow format)
-    body.pop("reasoning_effort", None)
-    body.pop("thinking", None)
-
-    # Apply based on model type
-    if is_glm_model(base_model):
-        body = apply_thinking_to_glm(body, config)
-    elif is_minimax_model(base_model):
-        body = apply_thinking_to_minimax(body, config)
-    else:
-        # For other models, strip thinking config
-        body = strip_thinking_config(body)
-
-    # Preserve reasoning content for multi-turn conversations
-    body = preserve_reasoning_content(body, base_model)
-
-    return body
+    return apply_thinking_config(body, base_model, suffix_config, thinking_format(base_model))
@@ -0,0 +1,271 @@
+"""Token 计数
+
+按模型系列使用本地分词器计数：``~/.iflow2api/tokenizers/<系列>/tokenizer.json``
+（HuggingFace tokenizers 格式，需要安装可选依赖 ``tokenizers``），首次用到某个系列时
+才加载。没有分词器时使用启发式估算：ASCII 约 4 字符 1 token，中日韩文字约 1 字 0.7
+token，而不是统一按 4 字符计，否则中文会被严重低估。
+
+系统提示词、工具定义这类在多次请求间重复出现的长文本按内容缓存计数结果。
+"""
+
+import logging
+import math
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from core import json_codec
+
+try:
+    import tokenizers
+except ImportError:  # pragma: no cover - 取决于运行环境
+    tokenizers = None
+
+logger = logging.getLogger(__name__)
+
+TOKENIZER_DIR = Path.home() / ".iflow2api" / "tokenizers"
+
+# 模型名前缀 -> 分词器系列（即 TOKENIZER_DIR 下的目录名）
+MODEL_FAMILIES = (
+    ("glm", "glm"),
+    ("qwen", "qwen"),
+    ("deepseek", "deepseek"),
+    ("kimi", "kimi"),
+    ("minimax", "minimax"),
+    ("iflow-rome", "qwen"),
+)
+
+# 启发式估算的权重
+ASCII_CHARS_PER_TOKEN = 4
+CJK_TOKENS_PER_CHAR = 0.7
+OTHER_TOKENS_PER_CHAR = 0.5
+
+# 每条消息的格式开销（角色标记等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 不短于此长度的文本才进入缓存，短文本直接计数更快
+CACHE_MIN_CHARS = 256
+CACHE_SIZE = 2048
+
+_CJK_RE = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+
+def text_weight(text: str) -> float:
+    """启发式 token 数（未取整，便于对流式增量累加）"""
+    if not text:
+        return 0.0
+    if text.isascii():
+        return len(text) / ASCII_CHARS_PER_TOKEN
+    cjk = len(_CJK_RE.findall(text))
+    ascii_count = len(text.encode("ascii", "ignore"))
+    other = len(text) - cjk - ascii_count
+    return ascii_count / ASCII_CHARS_PER_TOKEN + cjk * CJK_TOKENS_PER_CHAR + other * OTHER_TOKENS_PER_CHAR
+
+
+def weight_to_tokens(weight: float) -> int:
+    if weight <= 0:
+        return 0
+    return max(1, math.ceil(weight))
+
+
+def estimate_text_tokens(text: str) -> int:
+    return weight_to_tokens(text_weight(text))
+
+
+def model_family(model: str) -> str:
+    name = (model or "").lower()
+    for prefix, family in MODEL_FAMILIES:
+        if name.startswith(prefix):
+            return family
+    return ""
+
+
+class TokenCounter:
+    """按模型系列计数，带分词器懒加载与长文本计数缓存"""
+
+    def __init__(self, tokenizer_dir: Path = TOKENIZER_DIR, cache_size: int = CACHE_SIZE):
+        self.tokenizer_dir = tokenizer_dir
+        self.cache_size = cache_size
+        self._tokenizers: Dict[str, Any] = {}
+        self._cache: "OrderedDict[Tuple[str, int, int], int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _tokenizer(self, family: str) -> Any:
+        """加载系列对应的分词器；不可用时返回 None（结果同样缓存）"""
+        if not family or tokenizers is None:
+            return None
+        if family in self._tokenizers:
+            return self._tokenizers[family]
+        with self._lock:
+            if family in self._tokenizers:
+                return self._tokenizers[family]
+            tokenizer = None
+            path = self.tokenizer_dir / family / "tokenizer.json"
+            if path.is_file():
+                try:
+                    tokenizer = tokenizers.Tokenizer.from_file(str(path))
+                    logger.info(f"已加载分词器: {family} ({path})")
+                except Exception as e:
+                    logger.warning(f"加载分词器失败 {path}: {e}")
+            self._tokenizers[family] = tokenizer
+            return tokenizer
+
+    def preload(self) -> int:
+        """加载所有已安装的分词器（启动预热时在线程中调用）；返回可用的数量"""
+        families = dict.fromkeys(family for _, family in MODEL_FAMILIES)
+        return sum(1 for family in families if self._tokenizer(family) is not None)
+
+    def count_text(self, text: Any, model: str = "") -> int:
+        if not text:
+            return 0
+        if not isinstance(text, str):
+            text = str(text)
+        family = model_family(model)
+        tokenizer = self._tokenizer(family)
+        if len(text) < CACHE_MIN_CHARS:
+            return self._count(tokenizer, text)
+
+        # 键里用 str 的哈希而非文本本身，缓存不持有长文本
+        key = (family if tokenizer is not None else "", len(text), hash(text))
+        cached = self._cache.get(key)
+        if cached is not None:
+            self.cache_hits += 1
+            with self._lock:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+            return cached
+        self.cache_misses += 1
+        count = self._count(tokenizer, text)
+        with self._lock:
+            self._cache[key] = count
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return count
+
+    @staticmethod
+    def _count(tokenizer: Any, text: str) -> int:
+        if tokenizer is not None:
+            try:
+                return len(tokenizer.encode(text, add_special_tokens=False).ids)
+            except Exception:
+                pass
+        return estimate_text_tokens(text)
+
+    def count_json(self, value: Any, model: str = "") -> int:
+        if value in (None, "", {}, []):
+            return 0
+        try:
+            return self.count_text(json_codec.dumps_str(value), model)
+        except Exception:
+            return 0
+
+    def count_content(self, content: Any, model: str = "") -> int:
+        """OpenAI / Anthropic 消息内容（字符串或内容块列表）"""
+        if isinstance(content, str):
+            return self.count_text(content, model)
+        if not isinstance(content, list):
+            return 0
+        total = 0
+        for item in content:
+            if isinstance(item, str):
+                total += self.count_text(item, model)
+                continue
+            if not isinstance(item, dict):
+                continue
+            item_type = item.get("type")
+            if item_type in ("text", "input_text", "output_text", "reasoning"):
+                total += self.count_text(item.get("text", ""), model)
+            elif item_type == "thinking":
+                total += self.count_text(item.get("thinking", ""), model)
+            elif item_type == "tool_use":
+                total += self.count_json(item.get("input", {}), model)
+            elif item_type == "tool_result":
+                total += self.count_content(item.get("content", ""), model)
+            elif item_type == "tool_calls":
+                total += self._count_tool_calls(item.get("tool_calls"), model)
+        return total
+
+    def _count_tool_calls(self, tool_calls: Any, model: str) -> int:
+        if not isinstance(tool_calls, list):
+            return 0
+        total = 0
+        for tool_call in tool_calls:
+            function = tool_call.get("function") if isinstance(tool_call, dict) else None
+            if isinstance(function, dict):
+                total += self.count_text(function.get("name", ""), model)
+                total += self.count_text(function.get("arguments", ""), model)
+        return total
+
+    def _count_tools(self, tools: Any, model: str) -> int:
+        if not isinstance(tools, list):
+            return 0
+        # 每个工具定义单独计数，便于命中缓存（工具集常在请求间部分变化）
+        return sum(self.count_json(tool, model) for tool in tools)
+
+    def _count_messages(self, messages: Iterable[Any], model: str) -> int:
+        total = 0
+        for msg in messages:
+            if not isinstance(msg, dict):
+                continue
+            total += MESSAGE_OVERHEAD_TOKENS
+            total += self.count_content(msg.get("content", ""), model)
+            if msg.get("reasoning_content"):
+                total += self.count_content(msg["reasoning_content"], model)
+            if msg.get("tool_calls"):
+                total += self._count_tool_calls(msg["tool_calls"], model)
+        return total
+
+    def count_openai_prompt(self, body: Dict[str, Any]) -> int:
+        model = body.get("model", "")
+        messages = body.get("messages", [])
+        if not isinstance(messages, list):
+            return 0
+        return self._count_messages(messages, model) + self._count_tools(body.get("tools"), model)
+
+    def count_openai_completion(self, response_data: Dict[str, Any], model: str = "") -> int:
+        choices = response_data.get("choices")
+        if not isinstance(choices, list) or not choices or not isinstance(choices[0], dict):
+            return 0
+        model = model or response_data.get("model", "")
+        total = 0
+        for key in ("message", "delta"):
+            message = choices[0].get(key)
+            if not isinstance(message, dict):
+                continue
+            total += self.count_content(message.get("content", ""), model)
+            if message.get("reasoning_content"):
+                total += self.count_content(message["reasoning_content"], model)
+            if message.get("tool_calls"):
+                total += self._count_tool_calls(message["tool_calls"], model)
+        return total
+
+    def count_anthropic_input(self, body: Dict[str, Any]) -> int:
+        model = body.get("model", "")
+        total = self.count_content(body.get("system"), model)
+        messages = body.get("messages", [])
+        if isinstance(messages, list):
+            total += self._count_messages(messages, model)
+        return total + self._count_tools(body.get("tools"), model)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "backend": "tokenizers" if tokenizers is not None else "heuristic",
+            "loaded": sorted(family for family, tokenizer in self._tokenizers.items() if tokenizer is not None),
+            "cache_entries": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+        }
+
+
+_counter: Optional[TokenCounter] = None
+
+
+def get_token_counter() -> TokenCounter:
+    global _counter
+    if _counter is None:
+        _counter = TokenCounter()
+    return _counter
@@ -1,3 +1,10 @@
-from .app import run_gui, MainWindow
-
 __all__ = ["run_gui", "MainWindow"]
+
+
+def __getattr__(name):
+    # 访问时才导入 PyQt5 与界面模块
+    if name in __all__:
+        from gui import app
+
+        return getattr(app, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,7 +2,7 @@ from typing import Optional, Dict, List
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QLabel, QPushButton, QLineEdit, QFrame, QGridLayout,
-    QProgressBar, QSizePolicy, QScrollArea, QTextEdit,
+    QProgressBar, QSizePolicy, QScrollArea, QTextEdit, QPlainTextEdit,
     QGraphicsDropShadowEffect, QDialog, QCheckBox, QMessageBox,
     QSystemTrayIcon, QMenu, QAction
 )
@@ -13,18 +13,18 @@ from PyQt5.QtGui import QFont, QColor, QPainter, QIntValidator, QCursor, QIcon
 import sys
 import threading
 import asyncio
-import uvicorn
 import webbrowser
 import platform
-import psutil
 import os
 import time
 from pathlib import Path
 from datetime import datetime
 from collections import deque
 import html
-from app.server import app, request_logs, stats, CONFIG
-from proxy.proxy import get_proxy
+from app import drain
+from app.event_bus import get_event_bus
+from app.log_store import get_log_store
+from app.request_log import request_logs, stats
 
 start_time = time.time()
 
@@ -33,7 +33,6 @@ start_time = time.time()
 # ==============================
 APP_TITLE = "iFlow2API Console"
 WINDOW_SIZE = (540, 470)  # 大号窗口，提升可读性
-REFRESH_INTERVAL = 500  # 定时器刷新间隔(ms)
 PORT_MIN = 1024
 PORT_MAX = 65535
 DEFAULT_PORT = 8000
@@ -42,6 +41,14 @@ APP_ID = "iFlow2API"
 SETTINGS_AUTOSTART = "autostart_enabled"
 STARTUP_BAT_NAME = "iFlow2API_Autostart.bat"
 GUI_LOCK_FILE = Path.home() / ".iflow2api" / "iflow2api-gui.lock"
+LOG_MAX_LINES = 200  # 日志区最多保留的行数
+LOG_FLUSH_INTERVAL = 100  # 日志批量刷新间隔(ms)
+LOG_LEVEL_COLORS = {
+    "info": "#ff9966",
+    "success": "#34d399",
+    "warning": "#f59e0b",
+    "error": "#ff6b6b",
+}
 
 
 def resource_path(*parts: str) -> str:
@@ -212,7 +219,7 @@ class Styles:
         border-top: 1px solid #331100;
     }
 
-    QTextEdit.LogText {
+    QPlainTextEdit.LogText {
         background-color: #000000;
         color: #ff9966;
         font-size: 12px;
@@ -305,7 +312,7 @@ class ServerWorker(QThread):
     def __init__(self, port: int):
         super().__init__()
         self.port = port
-        self.server: Optional[uvicorn.Server] = None
+        self.server = None  # uvicorn.Server
         self._is_running = False
 
     def run(self):
@@ -321,7 +328,13 @@ class ServerWorker(QThread):
 
         self._is_running = True
         try:
-            config = uvicorn.Config(app, host="0.0.0.0", port=self.port, log_config=None)
+            # Web 框架在服务线程中导入，不拖慢窗口显示
+            import uvicorn
+            from app.server import app
+
+            config = uvicorn.Config(
+                app, host="0.0.0.0", port=self.port, log_config=None, timeout_graceful_shutdown=drain.DRAIN_TIMEOUT
+            )
             self.server = uvicorn.Server(config)
 
             # 标记服务器已启动
@@ -338,6 +351,7 @@ class ServerWorker(QThread):
     def stop(self):
         """停止服务器"""
         if self.server and self._is_running:
+            drain.state.begin("gui stop")
             self.server.should_exit = True
             self._is_running = False
 
@@ -386,23 +400,24 @@ class ServerManager:
 # ==============================
 class MainWindow(QMainWindow):
     log_signal = pyqtSignal(str)
+    bus_event_signal = pyqtSignal(str, object)
 
     def __init__(self):
         super().__init__()
         self.server_manager = ServerManager()
-        self.log_entries = deque(maxlen=200)
-        self.seen_request_keys = set()
+        self.pending_log_lines = deque(maxlen=LOG_MAX_LINES)
         self.current_port = DEFAULT_PORT
         self.settings = QSettings(APP_ID, "Console")
         self.tray_icon = None
         self._allow_close = False
         self.log_signal.connect(self.update_log)
+        self.bus_event_signal.connect(self.on_bus_event)
         self.init_ui()
         self.update_log("系统就绪 / Waiting for commands...", level="info")
         self.init_tray()
         self.load_settings()
-        self.init_timer()
         self.connect_server_signals()
+        self.subscribe_events()
 
     def init_ui(self):
         """初始化UI"""
@@ -497,7 +512,7 @@ class MainWindow(QMainWindow):
     def closeEvent(self, event):
         if self._allow_close:
             self.server_manager.stop()
-            self.timer.stop()
+            self.unsubscribe_events()
             event.accept()
             return
         if self.tray_icon:
@@ -505,7 +520,7 @@ class MainWindow(QMainWindow):
             event.ignore()
             return
         self.server_manager.stop()
-        self.timer.stop()
+        self.unsubscribe_events()
         event.accept()
 
     def _hide_to_tray(self, show_notice: bool = True):
@@ -675,21 +690,44 @@ class MainWindow(QMainWindow):
         log_title_layout.addStretch()
 
         # 滚动日志区域
-        self.log_text = QTextEdit()
+        self.log_text = QPlainTextEdit()
         self.log_text.setProperty("class", "LogText")
         self.log_text.setReadOnly(True)
         self.log_text.setMinimumHeight(130)
-        self.log_text.setHtml("")
+        # 超出行数时 Qt 自动丢弃最早的行，追加代价与已有行数无关
+        self.log_text.setMaximumBlockCount(LOG_MAX_LINES)
+
+        # 同一时间片内的新日志合并为一次追加、一次重绘
+        self.log_flush_timer = QTimer(self)
+        self.log_flush_timer.setSingleShot(True)
+        self.log_flush_timer.setInterval(LOG_FLUSH_INTERVAL)
+        self.log_flush_timer.timeout.connect(self.flush_log)
 
         log_layout.addLayout(log_title_layout)
         log_layout.addWidget(self.log_text)
         parent_layout.addWidget(log_frame)
 
-    def init_timer(self):
-        """初始化定时器"""
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_stats)
-        self.timer.start(REFRESH_INTERVAL)
+    def subscribe_events(self):
+        """订阅服务端事件总线（回调在服务线程执行，经信号转到 UI 线程）"""
+        get_event_bus().add_listener(self._emit_bus_event)
+
+    def unsubscribe_events(self):
+        get_event_bus().remove_listener(self._emit_bus_event)
+
+    def _emit_bus_event(self, event: str, data: object):
+        self.bus_event_signal.emit(event, data)
+
+    @pyqtSlot(str, object)
+    def on_bus_event(self, event: str, data: object):
+        """处理推送的日志 / 统计事件"""
+        if event == "stats":
+            self.update_stats()
+        elif event == "log":
+            self.append_request_log(data)
+        elif event == "clear":
+            self.pending_log_lines.clear()
+            self.log_text.clear()
+            self.update_stats()
 
     def connect_server_signals(self):
         """连接服务器信号"""
@@ -866,35 +904,17 @@ class MainWindow(QMainWindow):
                 self.prog_bar.setValue(0)
                 self.rate_val.setText("0.0%")
 
-        # 更新请求日志（按 request_id 去重，按状态着色）
-        if request_logs:
-            for entry in reversed(list(request_logs)):
-                log_key = self._build_request_log_key(entry)
-                if log_key in self.seen_request_keys:
-                    continue
-                self.seen_request_keys.add(log_key)
-                level = self._status_to_level(entry.get("status", 0))
-                model = entry.get("effective_model") or entry.get("model", "")
-                latency = entry.get("latency_ms")
-                latency_text = f" {latency}ms" if isinstance(latency, (int, float)) else ""
-                msg = (
-                    f"{entry.get('time', '')} {entry.get('method', '')} {entry.get('path', '')} "
-                    f"[{entry.get('status', '')}] {model}{latency_text}"
-                ).strip()
-                self.update_log(msg, level=level)
-
-            # 防止去重集合无限增长
-            if len(self.seen_request_keys) > 1000:
-                self.seen_request_keys = {self._build_request_log_key(item) for item in request_logs}
-
-    def _build_request_log_key(self, entry: Dict[str, object]) -> str:
-        request_id = str(entry.get("request_id", "") or "").strip()
-        if request_id:
-            return request_id
-        return (
-            f"{entry.get('time', '')}|{entry.get('method', '')}|{entry.get('path', '')}|"
-            f"{entry.get('status', '')}|{entry.get('model', '')}|{entry.get('latency_ms', '')}"
-        )
+    def append_request_log(self, entry: Dict[str, object]):
+        """追加一条推送来的请求日志（按状态着色）"""
+        level = self._status_to_level(entry.get("status", 0))
+        model = entry.get("effective_model") or entry.get("model", "")
+        latency = entry.get("latency_ms")
+        latency_text = f" {latency}ms" if isinstance(latency, (int, float)) else ""
+        msg = (
+            f"{entry.get('time', '')} {entry.get('method', '')} {entry.get('path', '')} "
+            f"[{entry.get('status', '')}] {model}{latency_text}"
+        ).strip()
+        self.update_log(msg, level=level)
 
     def _status_to_level(self, status: object) -> str:
         try:
@@ -908,35 +928,44 @@ class MainWindow(QMainWindow):
         return "success"
 
     def update_log(self, msg: str, level: str = "info"):
-        """更新日志（最多保留 200 条，按级别着色）"""
-        level_colors = {
-            "info": "#ff9966",
-            "success": "#34d399",
-            "warning": "#f59e0b",
-            "error": "#ff6b6b",
-        }
-        level_key = level if level in level_colors else "info"
+        """追加日志（按级别着色，在下一个刷新时间片统一写入）"""
+        color = LOG_LEVEL_COLORS.get(level, LOG_LEVEL_COLORS["info"])
         ts = datetime.now().strftime('%H:%M:%S')
-        self.log_entries.append((ts, msg, level_key))
+        self.pending_log_lines.append(f"<span style='color:{color}'>[{ts}] {html.escape(str(msg))}</span>")
+        if not self.log_flush_timer.isActive():
+            self.log_flush_timer.start()
 
-        html_lines = []
-        for line_ts, line_msg, line_level in self.log_entries:
-            color = level_colors.get(line_level, level_colors["info"])
-            html_lines.append(f"<span style='color:{color}'>[{line_ts}] {html.escape(str(line_msg))}</span>")
-
-        self.log_text.setHtml("<br>".join(html_lines))
-        self.log_text.moveCursor(self.log_text.textCursor().End)
+    @pyqtSlot()
+    def flush_log(self):
+        """把积压的日志行一次性追加到日志区"""
+        if not self.pending_log_lines:
+            return
+        scrollbar = self.log_text.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum() - 4
+        self.log_text.setUpdatesEnabled(False)
+        try:
+            for line in self.pending_log_lines:
+                self.log_text.appendHtml(line)
+        finally:
+            self.pending_log_lines.clear()
+            self.log_text.setUpdatesEnabled(True)
+        # 用户向上翻看历史时不强制跳到底部
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
 
     @pyqtSlot()
     def clear_logs(self):
         """清空日志"""
         request_logs.clear()
+        store = get_log_store()
+        if store is not None:
+            threading.Thread(target=store.clear, daemon=True).start()
         stats['total'] = 0
         stats['success'] = 0
         stats['error'] = 0
+        get_event_bus().publish("stats", dict(stats))
         self.update_stats()
-        self.log_entries.clear()
-        self.seen_request_keys.clear()
+        self.pending_log_lines.clear()
         self.log_text.clear()
         self.update_log("日志已清空 / Logs cleared", level="info")
 
@@ -1004,11 +1033,13 @@ class MainWindow(QMainWindow):
                 response.raise_for_status()
                 payload = response.json()
             else:
+                from proxy.proxy import get_proxy
+
                 proxy = get_proxy()
                 loop = asyncio.new_event_loop()
                 try:
                     asyncio.set_event_loop(loop)
-                    payload = loop.run_until_complete(proxy.get_models())
+                    payload = loop.run_until_complete(proxy.get_models(background=False))
                 finally:
                     loop.close()
                     asyncio.set_event_loop(None)
@@ -1,5 +1,9 @@
+import multiprocessing
+
 from agent.cli import main
 
 
 if __name__ == "__main__":
+    # 打包后的可执行文件以 --workers 启动子进程时需要
+    multiprocessing.freeze_support()
     raise SystemExit(main())
@@ -0,0 +1,126 @@
+"""/v1/models 模型列表缓存
+
+- TTL 内直接返回缓存；过期但未超过 stale 上限时先返回旧列表，后台刷新
+  （stale-while-revalidate）；没有缓存或过旧时前台刷新。
+- 并发的刷新共用同一个请求。
+- 上游返回 ETag 时下次带 If-None-Match，304 只更新时间戳。
+- 上游不可用时继续返回最近一次成功的列表；从未成功过时只返回模型注册表中
+  标记为 listed 的模型。
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from core import json_codec
+
+logger = logging.getLogger(__name__)
+
+MODELS_TTL = 300
+MODELS_STALE_TTL = 24 * 3600
+# 刷新失败后的这段时间内不再前台等待上游，直接返回旧列表
+FAILURE_BACKOFF = 60
+
+# fetch(etag) -> (payload, etag)；payload 为 None 表示上游返回 304
+Fetcher = Callable[[Optional[str]], Awaitable[Tuple[Optional[Dict[str, Any]], Optional[str]]]]
+
+
+class ModelListCache:
+
+    def __init__(
+        self,
+        fetch: Fetcher,
+        fallback: Callable[[], Dict[str, Any]],
+        ttl: float = MODELS_TTL,
+        stale_ttl: float = MODELS_STALE_TTL,
+    ):
+        self._fetch = fetch
+        self._fallback = fallback
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.payload: Optional[Dict[str, Any]] = None
+        # 返回给客户端的 ETag（按合并后的列表计算）
+        self.etag: Optional[str] = None
+        self._upstream_etag: Optional[str] = None
+        self.fetched_at = 0.0
+        self.last_error: Optional[str] = None
+        self._failed_at = float("-inf")
+        self._inflight: Optional[asyncio.Task] = None
+
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at if self.payload is not None else float("inf")
+
+    async def get(self, background: bool = True) -> Dict[str, Any]:
+        """返回模型列表；background=False 时过期即前台刷新（调用方的事件循环不长期存在时使用）"""
+        age = self.age()
+        if age < self.ttl:
+            return self.payload
+        recently_failed = time.monotonic() - self._failed_at < FAILURE_BACKOFF
+        if background and (age < self.stale_ttl or (recently_failed and self.payload is not None)):
+            self._start_refresh()
+            return self.payload
+        task = self._start_refresh()
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            # 刷新被取消（配置重新加载后上游变化）：不影响等待它的请求
+            return self.payload if self.payload is not None else self._fallback()
+        except Exception:
+            # 失败原因已由 _refresh_done 记录
+            return self.payload if self.payload is not None else self._fallback()
+        return self.payload
+
+    def invalidate(self) -> None:
+        """标记为过期：仍返回当前列表，同时在后台刷新"""
+        if self.payload is not None:
+            self.fetched_at = min(self.fetched_at, time.monotonic() - self.ttl)
+
+    def rebind(self, fetch: Fetcher) -> None:
+        """之后的刷新改用 fetch（代理按新配置重建、上游不变时沿用缓存）"""
+        self._fetch = fetch
+
+    def cancel(self) -> None:
+        """取消进行中的后台刷新（关闭或代理重建时调用）"""
+        if self._inflight is not None and not self._inflight.done():
+            self._inflight.cancel()
+
+    def _start_refresh(self) -> asyncio.Task:
+        task = self._inflight
+        if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+            return task
+        task = asyncio.get_running_loop().create_task(self._refresh())
+        task.add_done_callback(self._refresh_done)
+        self._inflight = task
+        return task
+
+    def _refresh_done(self, task: asyncio.Task) -> None:
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.last_error = f"{type(error).__name__}: {error}"
+            self._failed_at = time.monotonic()
+            logger.warning(f"刷新模型列表失败{'，继续使用缓存' if self.payload is not None else ''}: {error}")
+
+    async def _refresh(self) -> None:
+        payload, upstream_etag = await self._fetch(self._upstream_etag if self.payload is not None else None)
+        self.fetched_at = time.monotonic()
+        self.last_error = None
+        if payload is None:
+            # 304：列表未变化
+            return
+        self.payload = payload
+        self._upstream_etag = upstream_etag
+        self.etag = '"' + hashlib.sha256(json_codec.dumps(payload)).hexdigest()[:32] + '"'
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "cached": self.payload is not None,
+            "age_seconds": None if self.payload is None else int(self.age()),
+            "upstream_etag": self._upstream_etag,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,166 @@
+"""上游连接池预热与保活
+
+- 启动时（app.resources）提前创建 HTTP 客户端，并发打开
+  IFLOW2API_PREWARM_CONNECTIONS 个（默认 2，0 表示不预热）到上游的连接，首个请求不必
+  再等待 DNS、TCP 与 TLS 建立。
+- 连接空闲保留 KEEPALIVE_EXPIRY 秒（httpx 默认只有 5 秒）；上游在
+  IFLOW2API_KEEPALIVE_INTERVAL 秒（默认 20，0 表示不保活）内没有请求时，对同样数量的
+  连接发送一次不带凭证的 HEAD 请求，防止空闲连接被两端关闭而变冷。
+- 每个上游请求通过 httpcore 的 trace 扩展判断复用了已有连接（warm）还是新建连接
+  （cold），新建连接的耗时一并记录，见 /admin/sysinfo 的 ``upstream_pool``。
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+PREWARM_CONNECTIONS_ENV = "IFLOW2API_PREWARM_CONNECTIONS"
+KEEPALIVE_INTERVAL_ENV = "IFLOW2API_KEEPALIVE_INTERVAL"
+DEFAULT_PREWARM_CONNECTIONS = 2
+DEFAULT_KEEPALIVE_INTERVAL = 20
+# 客户端保留空闲连接的时间（秒），需大于保活间隔
+KEEPALIVE_EXPIRY = 90.0
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+# 启动时等待预热完成的上限（秒）
+WARMUP_TIMEOUT = 3.0
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+PREWARM_CONNECTIONS = min(_env_int(PREWARM_CONNECTIONS_ENV, DEFAULT_PREWARM_CONNECTIONS), MAX_KEEPALIVE_CONNECTIONS)
+KEEPALIVE_INTERVAL = _env_int(KEEPALIVE_INTERVAL_ENV, DEFAULT_KEEPALIVE_INTERVAL)
+
+
+def client_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+class PoolTotals:
+    """进程内累计，供 /admin/sysinfo 展示"""
+
+    def __init__(self):
+        self.warm = 0
+        self.cold = 0
+        self.connect_seconds = 0.0
+        self.warmup_connections = 0
+        self.warmup_seconds: Optional[float] = None
+        self.pings = 0
+        self.ping_errors = 0
+        # 最近一次上游请求（含保活）的时间，保活任务据此判断是否空闲
+        self.last_used = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        requests = self.warm + self.cold
+        return {
+            "prewarm_connections": PREWARM_CONNECTIONS,
+            "keepalive_interval_seconds": KEEPALIVE_INTERVAL,
+            "keepalive_expiry_seconds": KEEPALIVE_EXPIRY,
+            "warm_requests": self.warm,
+            "cold_requests": self.cold,
+            "warm_ratio": round(self.warm / requests, 3) if requests else None,
+            "avg_connect_ms": round(self.connect_seconds / self.cold * 1000, 1) if self.cold else None,
+            "warmup_connections": self.warmup_connections,
+            "warmup_ms": None if self.warmup_seconds is None else round(self.warmup_seconds * 1000, 1),
+            "keepalive_pings": self.pings,
+            "keepalive_ping_errors": self.ping_errors,
+        }
+
+
+totals = PoolTotals()
+
+
+class ConnectionTrace:
+    """httpcore trace 回调：记录请求使用的连接是否新建及建立耗时"""
+
+    __slots__ = ("counted", "connect_started", "connect_seconds", "cold")
+
+    def __init__(self, counted: bool = True):
+        # 预热与保活请求不计入 warm / cold
+        self.counted = counted
+        self.connect_started: Optional[float] = None
+        self.connect_seconds = 0.0
+        self.cold = False
+
+    async def __call__(self, event: str, info: Dict[str, Any]) -> None:
+        if event == "connection.connect_tcp.started":
+            self.connect_started = time.perf_counter()
+            self.cold = True
+        elif event.endswith(".send_request_headers.started"):
+            # 已取得连接，开始发送请求（重试时只记录第一次）
+            if self.connect_started is not None:
+                self.connect_seconds = time.perf_counter() - self.connect_started
+            totals.last_used = time.monotonic()
+            if self.counted:
+                self.counted = False
+                if self.cold:
+                    totals.cold += 1
+                    totals.connect_seconds += self.connect_seconds
+                else:
+                    totals.warm += 1
+
+
+def trace_extensions() -> Dict[str, Any]:
+    """上游请求的 extensions 参数"""
+    return {"trace": ConnectionTrace()}
+
+
+async def _touch(client: httpx.AsyncClient, url: str) -> ConnectionTrace:
+    trace = ConnectionTrace(counted=False)
+    request = client.build_request("HEAD", url, extensions={"trace": trace})
+    response = await client.send(request)
+    await response.aclose()
+    return trace
+
+
+async def touch_connections(client: httpx.AsyncClient, url: str, count: int) -> int:
+    """并发发送 count 个 HEAD 请求，使池中至少有 count 个连接；返回新建的连接数"""
+    results = await asyncio.gather(*(_touch(client, url) for _ in range(count)), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        raise errors[0]
+    return sum(1 for result in results if result.cold)
+
+
+async def prewarm(proxy) -> int:
+    """启动时预热；最多等待 WARMUP_TIMEOUT 秒，返回新建的连接数"""
+    if not PREWARM_CONNECTIONS:
+        return 0
+    started = time.perf_counter()
+    opened = await asyncio.wait_for(proxy.touch_connections(PREWARM_CONNECTIONS), WARMUP_TIMEOUT)
+    totals.warmup_connections += opened
+    totals.warmup_seconds = time.perf_counter() - started
+    logger.info(f"已预热 {opened} 个上游连接 ({totals.warmup_seconds * 1000:.0f}ms)")
+    return opened
+
+
+async def keep_alive(get_proxy: Callable[[], Any]) -> None:
+    """上游空闲超过保活间隔时访问一次（每次取当前代理：配置重新加载后上游可能变化）"""
+    if not KEEPALIVE_INTERVAL or not PREWARM_CONNECTIONS:
+        return
+    while True:
+        await asyncio.sleep(KEEPALIVE_INTERVAL)
+        if time.monotonic() - totals.last_used < KEEPALIVE_INTERVAL:
+            continue
+        proxy = get_proxy()
+        totals.pings += 1
+        try:
+            await proxy.touch_connections(PREWARM_CONNECTIONS)
+        except Exception as e:
+            totals.ping_errors += 1
+            logger.debug(f"上游保活请求失败 {proxy.upstream_url}: {e}")
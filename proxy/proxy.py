@@ -1,130 +1,97 @@
 
 import httpx
-import gzip
-import json
 import io
 import logging
 import asyncio
-import base64
 import hashlib
 import hmac
-import mimetypes
-import os
-import re
 import time
 import uuid
 import copy
-from urllib.parse import unquote
 from typing import AsyncIterator, Optional, Dict, Any, List
 
 # 重试配置
 MAX_RETRIES = 3
 RETRY_DELAY = 1.0  # 秒
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
-from core.config import CONFIG
-from auth.token import IFlowTokenStorage, load_token_from_file, save_token_to_file, refresh_oauth_tokens
-from core.thinking import apply_thinking
+from core import json_codec
+from core.config import config_store, current_config
+from auth.token import IFlowTokenStorage, load_token_from_file, save_token_to_file, refresh_oauth_tokens, token_refresh_lock
+from core.tokens import get_token_counter
+from proxy import pool, transfer
+from proxy.model_cache import ModelListCache
+from core.models import get_model_registry
+from proxy.rewrite import (
+    _is_image_part,
+    apply_plan,
+    get_plan,
+    rewrite_request,
+)
 
 IFLOW_CLI_USER_AGENT = "iFlow-Cli"
 logger = logging.getLogger(__name__)
-MAX_LOCAL_IMAGE_BYTES = 10 * 1024 * 1024
-FORCED_VISION_MODEL = "qwen3-vl-plus"
-KNOWN_MULTIMODAL_MODELS = {
-    "qwen3-vl-plus",
-    "tstars2.0",
-}
-# 对 GLM / MiniMax 系列启用两段式视觉处理
-FORCE_VISION_MODEL_SERIES_PREFIXES = ("glm", "minimax")
-EXTRA_MODELS = [
-    "glm-4.7",
-    "glm-5",
-    "minimax-m2.1",
-    "minimax-m2.5",
-    "kimi-k2.5",
-    "iflow-rome-30ba3b",
-]
-
-
-def _estimate_text_tokens(text: str) -> int:
-    if not text:
-        return 0
-    return max(1, (len(text) + 3) // 4)
-
 
-def _estimate_content_tokens(content: Any) -> int:
-    if isinstance(content, str):
-        return _estimate_text_tokens(content)
-    if isinstance(content, list):
-        total = 0
-        for item in content:
-            if isinstance(item, str):
-                total += _estimate_text_tokens(item)
-                continue
-            if not isinstance(item, dict):
-                continue
-            item_type = item.get("type")
-            if item_type == "text":
-                total += _estimate_text_tokens(str(item.get("text", "")))
-            elif item_type == "reasoning":
-                total += _estimate_text_tokens(str(item.get("text", "")))
-            elif item_type == "tool_calls":
-                tool_calls = item.get("tool_calls", [])
-                if isinstance(tool_calls, list):
-                    for tc in tool_calls:
-                        if not isinstance(tc, dict):
-                            continue
-                        func = tc.get("function", {})
-                        if isinstance(func, dict):
-                            total += _estimate_text_tokens(str(func.get("arguments", "")))
-            elif item_type == "tool_use":
-                try:
-                    total += _estimate_text_tokens(json.dumps(item.get("input", {}), ensure_ascii=False))
-                except Exception:
-                    pass
-            elif item_type == "tool_result":
-                total += _estimate_content_tokens(item.get("content", ""))
-        return total
-    return 0
-
-
-def _estimate_openai_prompt_tokens(body: Dict[str, Any]) -> int:
-    total = 0
-    messages = body.get("messages", [])
-    if not isinstance(messages, list):
-        return 0
-
-    for msg in messages:
-        if not isinstance(msg, dict):
-            continue
-        total += _estimate_content_tokens(msg.get("content", ""))
-        if "reasoning_content" in msg:
-            total += _estimate_content_tokens(msg.get("reasoning_content"))
-    return total
 
+def _conversation_session_id(body: Dict[str, Any]) -> str:
+    """由会话前缀（模型、开头的 system 消息、工具定义、首条 user 消息）派生稳定的 session id
 
-def _estimate_openai_completion_tokens(response_data: Dict[str, Any]) -> int:
-    choices = response_data.get("choices", [])
-    if not isinstance(choices, list) or not choices:
-        return 0
+    同一会话的后续轮次、续写与重试得到相同的 id，上游可据此复用前缀缓存。
+    """
+    system_contents = []
+    first_user = None
+    messages = body.get("messages")
+    if isinstance(messages, list):
+        for msg in messages:
+            if not isinstance(msg, dict):
+                continue
+            role = msg.get("role")
+            if role == "system":
+                system_contents.append(msg.get("content"))
+            elif role == "user":
+                first_user = msg.get("content")
+                break
+    digest = hashlib.sha256(str(body.get("model", "")).encode("utf-8"))
+    for part in (system_contents, body.get("tools"), first_user):
+        digest.update(b"\x00")
+        digest.update(json_codec.dumps(part))
+    return f"session-{uuid.UUID(bytes=digest.digest()[:16])}"
 
-    choice = choices[0]
-    if not isinstance(choice, dict):
-        return 0
 
-    total = 0
-    message = choice.get("message", {})
-    if isinstance(message, dict):
-        total += _estimate_content_tokens(message.get("content", ""))
-        if "reasoning_content" in message:
-            total += _estimate_content_tokens(message.get("reasoning_content"))
+class PromptCacheStats:
+    """上游 usage 中 prompt_tokens_details.cached_tokens 的累计（前缀缓存命中率）"""
 
-    delta = choice.get("delta", {})
-    if isinstance(delta, dict):
-        total += _estimate_content_tokens(delta.get("content", ""))
-        if "reasoning_content" in delta:
-            total += _estimate_content_tokens(delta.get("reasoning_content"))
+    def __init__(self):
+        self.calls = 0
+        self.hit_calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
 
-    return total
+    def record(self, usage: Any) -> None:
+        if not isinstance(usage, dict):
+            return
+        try:
+            prompt_tokens = int(usage.get("prompt_tokens") or 0)
+            details = usage.get("prompt_tokens_details")
+            cached_tokens = int(details.get("cached_tokens") or 0) if isinstance(details, dict) else 0
+        except (TypeError, ValueError):
+            return
+        if prompt_tokens <= 0:
+            return
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        if cached_tokens > 0:
+            self.hit_calls += 1
+            self.cached_tokens += cached_tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "hit_calls": self.hit_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "call_hit_rate": round(self.hit_calls / self.calls, 4) if self.calls else 0.0,
+            "token_hit_rate": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+        }
 
 
 def _create_iflow_signature(user_agent: str, session_id: str, timestamp_ms: int, api_key: str) -> str:
@@ -183,190 +150,6 @@ def is_streaming_response(content_type: str) -> bool:
     return "text/event-stream" in content_type
 
 
-def _normalize_base64_data(data: str) -> str:
-    if not data:
-        return ""
-    return "".join(data.split())
-
-
-def _build_data_url(media_type: str, data: str) -> str:
-    if not data:
-        return ""
-    if data.startswith("data:"):
-        return data
-    media_type = media_type or "image/png"
-    data = _normalize_base64_data(data)
-    if not data:
-        return ""
-    return f"data:{media_type};base64,{data}"
-
-
-def _to_local_path(url: str) -> str:
-    if not url:
-        return ""
-    value = url.strip()
-    if value.startswith("file://"):
-        path = unquote(value[7:])
-        if path.startswith("/"):
-            path = path.lstrip("/")
-        path = path.replace("/", os.sep)
-        # UNC path support (file://server/share)
-        if not re.match(r"^[A-Za-z]:\\", path) and path.startswith("\\") is False and value.startswith("file://"):
-            if "\\" not in path and "/" not in path:
-                return path
-            return "\\\\" + path.lstrip("\\")
-        return path
-    if re.match(r"^[A-Za-z]:\\", value) or re.match(r"^[A-Za-z]:/", value):
-        return unquote(value).replace("/", os.sep)
-    return ""
-
-
-def _load_local_image_as_data_url(url: str) -> str:
-    path = _to_local_path(url)
-    if not path:
-        return ""
-    if not os.path.exists(path):
-        logger.warning(f"[iFlow] 本地图片路径不存在: {path}")
-        return ""
-    try:
-        size = os.path.getsize(path)
-        if size > MAX_LOCAL_IMAGE_BYTES:
-            logger.warning(f"[iFlow] 本地图片过大，已跳过: {path} ({size} bytes)")
-            return ""
-        with open(path, "rb") as f:
-            data = f.read()
-        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
-        encoded = base64.b64encode(data).decode("ascii")
-        return f"data:{media_type};base64,{encoded}"
-    except Exception as e:
-        logger.warning(f"[iFlow] 读取本地图片失败: {path} ({e})")
-        return ""
-
-
-def _normalize_image_url(url: str) -> str:
-    if not url:
-        return ""
-    value = url.strip()
-    if value.startswith("data:") or value.startswith("http://") or value.startswith("https://"):
-        return value
-    if CONFIG.get("allow_local_file_images"):
-        local_data = _load_local_image_as_data_url(value)
-        if local_data:
-            return local_data
-    return value
-
-
-def _extract_image_url_from_part(part: Dict[str, Any]) -> str:
-    if not isinstance(part, dict):
-        return ""
-
-    image_url_field = part.get("image_url")
-    if isinstance(image_url_field, dict):
-        url = image_url_field.get("url", "")
-        if url:
-            return _normalize_image_url(url)
-    elif isinstance(image_url_field, str):
-        return _normalize_image_url(image_url_field)
-
-    url_field = part.get("url")
-    if isinstance(url_field, str) and url_field:
-        return _normalize_image_url(url_field)
-
-    source = part.get("source")
-    if isinstance(source, dict):
-        source_type = source.get("type", "")
-        if source_type == "url":
-            return _normalize_image_url(source.get("url", ""))
-        if source_type == "base64":
-            media_type = source.get("media_type") or part.get("media_type") or "image/png"
-            return _build_data_url(media_type, source.get("data", ""))
-
-    return ""
-
-
-def _build_image_url_part(part: Dict[str, Any], url: str) -> Dict[str, Any]:
-    image_url = {"url": url}
-    detail = None
-    image_url_field = part.get("image_url")
-    if isinstance(image_url_field, dict):
-        detail = image_url_field.get("detail")
-    if detail is None:
-        detail = part.get("detail")
-    if detail:
-        image_url["detail"] = detail
-    return {"type": "image_url", "image_url": image_url}
-
-
-def _normalize_openai_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Normalize image content blocks to OpenAI image_url format."""
-    for msg in messages:
-        content = msg.get("content")
-        if not isinstance(content, list):
-            continue
-
-        normalized = []
-        changed = False
-
-        for part in content:
-            if isinstance(part, dict):
-                part_type = part.get("type", "")
-                if part_type == "input_text" and "text" in part:
-                    normalized.append({"type": "text", "text": part.get("text", "")})
-                    changed = True
-                    continue
-                is_image_like = part_type in ("image", "image_url", "input_image") or "image_url" in part or "source" in part
-                if is_image_like:
-                    url = _extract_image_url_from_part(part)
-                    if url:
-                        normalized.append(_build_image_url_part(part, url))
-                        changed = True
-                        continue
-
-            normalized.append(part)
-
-        if changed:
-            msg["content"] = normalized
-
-    return messages
-
-
-def _message_has_image(message: Dict[str, Any]) -> bool:
-    content = message.get("content")
-    if not isinstance(content, list):
-        return False
-    for part in content:
-        if not isinstance(part, dict):
-            continue
-        part_type = part.get("type", "")
-        if part_type in ("image", "image_url", "input_image"):
-            return True
-        if "image_url" in part:
-            return True
-        source = part.get("source")
-        if isinstance(source, dict) and source.get("type") in ("base64", "url"):
-            return True
-    return False
-
-
-def _request_has_images(body: Dict[str, Any]) -> bool:
-    messages = body.get("messages", [])
-    if not isinstance(messages, list):
-        return False
-    return any(_message_has_image(msg) for msg in messages)
-
-
-def _is_image_part(part: Dict[str, Any]) -> bool:
-    if not isinstance(part, dict):
-        return False
-    part_type = part.get("type", "")
-    if part_type in ("image", "image_url", "input_image"):
-        return True
-    if "image_url" in part:
-        return True
-    source = part.get("source")
-    return isinstance(source, dict) and source.get("type") in ("base64", "url")
-
-
 def _strip_images_from_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     sanitized: List[Dict[str, Any]] = []
     for message in messages:
@@ -391,30 +174,6 @@ def _strip_images_from_messages(messages: List[Dict[str, Any]]) -> List[Dict[str
     return sanitized
 
 
-def _is_vision_model(model: str) -> bool:
-    if not model:
-        return False
-    model_lower = model.lower()
-    return (
-        model_lower in KNOWN_MULTIMODAL_MODELS
-        or "vl" in model_lower
-        or "vision" in model_lower
-        or "4v" in model_lower
-        or "multimodal" in model_lower
-    )
-
-
-def _forced_model_is_multimodal() -> bool:
-    return _is_vision_model(FORCED_VISION_MODEL)
-
-
-def _should_force_vision_for_series(model: str) -> bool:
-    if not model:
-        return False
-    model_lower = model.lower()
-    return any(model_lower.startswith(prefix) for prefix in FORCE_VISION_MODEL_SERIES_PREFIXES)
-
-
 def _extract_error_text(exc: Exception) -> str:
     if not isinstance(exc, httpx.HTTPStatusError):
         return ""
@@ -460,20 +219,18 @@ def _looks_like_image_capability_error(exc: Exception) -> bool:
     return any(token in text for token in image_tokens) and any(token in text for token in unsupported_tokens)
 
 
-def _should_fallback_to_forced_vision(exc: Exception, *, model: str, has_images: bool) -> bool:
-    if not has_images:
-        return False
-    if not model:
-        return False
-    if not _should_force_vision_for_series(model):
-        return False
-    if model.lower() == FORCED_VISION_MODEL.lower():
-        return False
-    if _is_vision_model(model):
-        return False
-    if not _forced_model_is_multimodal():
-        return False
-    return _looks_like_image_capability_error(exc)
+def _vision_fallback_for_error(exc: Exception, *, model: str, has_images: bool) -> Optional[str]:
+    """上游因图片输入报错时可回退的视觉模型；不应回退时返回 None"""
+    if not has_images or not model:
+        return None
+    plan = get_plan(model)
+    if not plan.two_stage_vision or plan.vision:
+        return None
+    if plan.base_model.lower() == plan.vision_fallback.lower():
+        return None
+    if not _looks_like_image_capability_error(exc):
+        return None
+    return plan.vision_fallback
 
 
 def _extract_text_from_result(result: Dict[str, Any]) -> str:
@@ -521,7 +278,7 @@ def _append_extra_models(payload: Any) -> Dict[str, Any]:
             if isinstance(model_id, str) and model_id:
                 existing_ids.add(model_id)
 
-    for model_id in EXTRA_MODELS:
+    for model_id in get_model_registry().listed_models():
         if model_id in existing_ids:
             continue
         models.append(
@@ -538,35 +295,21 @@ def _append_extra_models(payload: Any) -> Dict[str, Any]:
     return payload
 
 
-def get_default_system_prompt() -> str:
-    """生成默认系统提示词"""
-    return """--- SYSTEM PROMPT BEGIN ---
-## Tool Usage Strategy
-- 严禁猜测代码位置。必须使用工具获取确切的符号关系和定义。
-- 优先使用工具解决问题，避免盲目猜测和假设。
-- 在进行代码阅读和修改前，务必先通过工具确认符号关系和定义，避免误操作。
-- 在进行代码修改时，务必先通过工具分析影响范围，避免破坏现有功能。
-## Tool Call Format (MANDATORY)
-- 工具调用必须严格遵守规范格式，所有必需参数必须提供，禁止省略。
-- 禁止发送空参数或缺少参数的工具调用，这会导致系统错误。
-- 调用工具前必须确认所有 required 参数都已正确填写。
-- 工具调用错误通常是路径或操作系统问题，请检查路径格式参数等是否正确。
-- 如果在 plan 模式下工具调用失败可能导致循环调用，遇到错误时应停止重试并分析原因。
-## Code Modification Rules
-- 修改代码前必须分析可能的副作用，包括对其他模块、函数、测试的影响。
-- 修改公共接口或共享代码时，必须检查所有调用方。
-## File Reading Rules (CRITICAL)
-- 禁止一次性读取超大文件（>10kb），必须使用 offset 和 limit 参数分段读取。
-- 读取大文件前先评估文件大小，优先使用 Grep 搜索定位关键内容。
---- SYSTEM PROMPT END ---"""
-
-
 class ReverseProxy:
 
-    def __init__(self, upstream_url: str, api_key: str, token_file_path: Optional[str] = None):
+    def __init__(
+        self,
+        upstream_url: str,
+        api_key: str,
+        token_file_path: Optional[str] = None,
+        session_affinity: bool = False,
+    ):
         self.upstream_url = upstream_url.rstrip("/")
         self.api_key = api_key
         self.token_file_path = token_file_path
+        self.session_affinity = session_affinity
+        self.cache_stats = PromptCacheStats()
+        self.models_cache = ModelListCache(self._fetch_models, lambda: _append_extra_models([]))
         self.token_storage: Optional[IFlowTokenStorage] = None
         self._client: Optional[httpx.AsyncClient] = None
 
@@ -576,29 +319,51 @@ class ReverseProxy:
             self.token_storage = await load_token_from_file(self.token_file_path)
             if self.token_storage:
                 if self.token_storage.is_expired() and self.token_storage.refresh_token:
-                    logger.info("[iFlow] Token expired or near expiry, refreshing...")
                     try:
-                        refreshed = await refresh_oauth_tokens(self.token_storage.refresh_token)
-                        self.token_storage = IFlowTokenStorage(refreshed)
-                        await save_token_to_file(self.token_file_path, self.token_storage)
-                        logger.info("[iFlow] Token refreshed and saved")
+                        await self._refresh_token_shared()
                     except Exception as e:
                         logger.warning(f"[iFlow] Token refresh failed: {e}")
 
                 if self.token_storage.api_key:
                     self.api_key = self.token_storage.api_key
 
+    async def _refresh_token_shared(self):
+        """在跨进程锁内刷新 token；其他 worker 已刷新时直接复用文件中的新 token"""
+        async with token_refresh_lock(self.token_file_path):
+            latest = await load_token_from_file(self.token_file_path)
+            if latest and not latest.is_expired():
+                self.token_storage = latest
+                logger.info("[iFlow] Token already refreshed by another process")
+                return
+            if latest and latest.refresh_token:
+                self.token_storage = latest
+            logger.info("[iFlow] Token expired or near expiry, refreshing...")
+            refreshed = await refresh_oauth_tokens(self.token_storage.refresh_token)
+            self.token_storage = IFlowTokenStorage(refreshed)
+            await save_token_to_file(self.token_file_path, self.token_storage)
+            logger.info("[iFlow] Token refreshed and saved")
+
     async def _get_client(self) -> httpx.AsyncClient:
         """获取HTTP客户端"""
         if self._client is None or self._client.is_closed:
             self._client = httpx.AsyncClient(
                 timeout=httpx.Timeout(300.0, connect=10.0),
+                limits=pool.client_limits(),
                 follow_redirects=True,
             )
         return self._client
 
+    async def touch_connections(self, count: int) -> int:
+        """使连接池中至少有 count 个到上游的连接（预热与保活，见 proxy.pool）；返回新建的连接数"""
+        return await pool.touch_connections(await self._get_client(), self.upstream_url, count)
+
+    async def open(self) -> None:
+        """提前创建 HTTP 客户端（启动时调用，首个请求不再承担创建开销）"""
+        await self._get_client()
+
     async def close(self):
         """关闭客户端"""
+        self.models_cache.cancel()
         if self._client and not self._client.is_closed:
             await self._client.aclose()
 
@@ -617,13 +382,14 @@ class ReverseProxy:
         modified["authorization"] = f"Bearer {self.api_key}"
         modified["user-agent"] = IFLOW_CLI_USER_AGENT
         modified["content-type"] = "application/json"
+        modified["accept-encoding"] = transfer.ACCEPT_ENCODING
 
         return modified
 
-    def _apply_iflow_security_headers(self, headers: Dict[str, str]) -> Dict[str, str]:
+    def _apply_iflow_security_headers(self, headers: Dict[str, str], session_id: Optional[str] = None) -> Dict[str, str]:
 
         modified = headers.copy()
-        session_id = f"session-{uuid.uuid4()}"
+        session_id = session_id or f"session-{uuid.uuid4()}"
         timestamp_ms = int(time.time() * 1000)
 
         modified["session-id"] = session_id
@@ -638,109 +404,91 @@ class ReverseProxy:
         return modified
 
     def _modify_request_body(self, body: Dict[str, Any], model: str) -> Dict[str, Any]:
-        """修改请求体"""
-        processed = body.copy()
-        processed["model"] = model
-        processed = apply_thinking(processed, model)
-
-        # 注入默认系统提示词
-        default_prompt = get_default_system_prompt()
-        messages = processed.get("messages", [])
-        if isinstance(messages, list):
-            _normalize_openai_messages(messages)
-
-        # 查找是否已有 system 消息
-        system_msg_idx = None
-        for idx, msg in enumerate(messages):
-            if msg.get("role") == "system":
-                system_msg_idx = idx
-                break
-
-        if system_msg_idx is not None:
-            # 追加到现有 system 消息
-            existing_content = messages[system_msg_idx].get("content", "")
-            if isinstance(existing_content, str):
-                messages[system_msg_idx]["content"] = f"{default_prompt}\n\n{existing_content}"
-            elif isinstance(existing_content, list):
-                # 如果是列表格式,在开头插入文本块
-                messages[system_msg_idx]["content"] = [{"type": "text", "text": default_prompt}] + existing_content
-        else:
-            # 在开头插入新的 system 消息
-            messages.insert(0, {"role": "system", "content": default_prompt})
-
-        processed["messages"] = messages
+        """修改请求体（见 proxy.rewrite）"""
+        processed, _ = rewrite_request(body, model)
         return processed
 
-    def _modify_response(self, content: bytes, status_code: int, headers: Dict[str, str]) -> bytes:
-  
-        # 只处理成功响应
-        if status_code < 200 or status_code >= 300:
-            return content
-
-        # 跳过已标记为 gzip 的响应
-        if headers.get("content-encoding", ""):
-            return content
-
-        # 跳过流式响应（SSE）
-        content_type = headers.get("content-type", "")
-        if is_streaming_response(content_type):
-            return content
-
-        # Peek 前 2 字节检测 gzip magic bytes
-        if len(content) < 2:
-            return content
-
-        # 检查 gzip magic bytes (0x1f 0x8b)
-        if content[0] == 0x1f and content[1] == 0x8b:
+    async def _open_upstream(
+        self,
+        client: httpx.AsyncClient,
+        endpoint: str,
+        headers: Dict[str, str],
+        body: Dict[str, Any],
+        session_id: Optional[str] = None,
+    ) -> httpx.Response:
+        """发送请求并返回未读取响应体的响应（调用方负责 aclose）；错误响应读完后抛出 HTTPStatusError"""
+        request_headers = self._apply_iflow_security_headers(headers, session_id)
+        url = f"{self.upstream_url}{endpoint}"
+        payload = json_codec.dumps(body)
+        content, encoding = await transfer.uploads.encode(payload)
+        if encoding:
+            request_headers["content-encoding"] = encoding
+        response = await client.send(
+            client.build_request("POST", url, headers=request_headers, content=content, extensions=pool.trace_extensions()),
+            stream=True,
+        )
+        if response.status_code == 415 and encoding:
+            await response.aclose()
+            transfer.uploads.reject(encoding)
+            request_headers.pop("content-encoding")
+            response = await client.send(
+                client.build_request("POST", url, headers=request_headers, content=payload, extensions=pool.trace_extensions()),
+                stream=True,
+            )
+        if not response.is_success:
+            # 读取错误响应体，供视觉回退判断与日志使用
             try:
-                # 解压
-                decompressed = gzip.decompress(content)
-                logger.debug(f"amp proxy: decompressed gzip response ({len(content)} -> {len(decompressed)} bytes)")
-                return decompressed
-            except Exception as e:
-                logger.warning(f"amp proxy: gzip header detected but decompress failed: {e}")
-                return content
-
-        return content
+                await response.aread()
+            finally:
+                await response.aclose()
+            response.raise_for_status()
+        return response
 
     async def proxy_request(self, endpoint: str, body: Dict[str, Any], model: str, stream: bool = False):
         """代理请求"""
         await self.initialize()
 
+        plan = get_plan(model)
         effective_model = model
-        has_images = _request_has_images(body)
-        working_body = body
+        # 消息只遍历一次：图片检测与改写同时完成
+        processed_body, facts = rewrite_request(body, model)
+        has_images = facts.has_images
 
         headers = self._director({})
         client = await self._get_client()
 
-        if has_images:
-            if _should_force_vision_for_series(model):
-                if _forced_model_is_multimodal():
-                    logger.info(f"[iFlow] 检测到图片输入，模型属于两段式处理系列: {model} -> {FORCED_VISION_MODEL} -> {model}")
-                    try:
-                        vision_summary = await self._generate_vision_summary(client, headers, endpoint, body, model)
-                        if vision_summary:
-                            logger.info(f"[iFlow] 视觉解析完成，摘要长度: {len(vision_summary)}")
-                            working_body = self._build_two_stage_main_body(body, vision_summary)
-                            has_images = _request_has_images(working_body)
-                            effective_model = model
-                        else:
-                            logger.warning(f"[iFlow] 视觉解析结果为空，回退为直接视觉模型输出: {FORCED_VISION_MODEL}")
-                            effective_model = FORCED_VISION_MODEL
-                    except Exception as e:
-                        logger.warning(f"[iFlow] 两段式视觉解析失败，回退为直接视觉模型输出: {e}")
-                        effective_model = FORCED_VISION_MODEL
-                else:
-                    logger.warning(f"[iFlow] 强制模型不支持多模态，跳过切换: {FORCED_VISION_MODEL}")
-
-        # 修改请求体
-        processed_body = self._modify_request_body(working_body, effective_model)
+        if has_images and plan.force_vision_series:
+            if plan.two_stage_vision:
+                vision_model = plan.vision_fallback
+                logger.info(f"[iFlow] 检测到图片输入，模型属于两段式处理系列: {model} -> {vision_model} -> {model}")
+                try:
+                    vision_summary = await self._generate_vision_summary(client, headers, endpoint, body, model, vision_model)
+                    if vision_summary:
+                        logger.info(f"[iFlow] 视觉解析完成，摘要长度: {len(vision_summary)}")
+                        processed_body, facts = rewrite_request(self._build_two_stage_main_body(body, vision_summary), model)
+                        has_images = facts.has_images
+                    else:
+                        logger.warning(f"[iFlow] 视觉解析结果为空，回退为直接视觉模型输出: {vision_model}")
+                        effective_model = vision_model
+                except Exception as e:
+                    logger.warning(f"[iFlow] 两段式视觉解析失败，回退为直接视觉模型输出: {e}")
+                    effective_model = vision_model
+                if effective_model != model:
+                    # 消息改写与模型无关，只需按视觉模型重新处理顶层字段
+                    processed_body = apply_plan(body, get_plan(effective_model), processed_body["messages"])
+            else:
+                logger.warning(f"[iFlow] 强制模型不支持多模态，跳过切换: {plan.vision_fallback}")
+
+        session_id = _conversation_session_id(processed_body) if self.session_affinity else None
 
         if stream:
-            return self._proxy_stream(client, endpoint, headers, processed_body, model=effective_model, has_images=has_images)
+            return self._proxy_stream(
+                client, endpoint, headers, processed_body, model=effective_model, has_images=has_images, session_id=session_id
+            )
         else:
-            return await self._proxy_non_stream(client, endpoint, headers, processed_body, model=effective_model, has_images=has_images)
+            return await self._proxy_non_stream(
+                client, endpoint, headers, processed_body, model=effective_model, has_images=has_images, session_id=session_id
+            )
 
     async def _generate_vision_summary(
         self,
@@ -749,6 +497,7 @@ class ReverseProxy:
         endpoint: str,
         body: Dict[str, Any],
         model: str,
+        vision_model: str,
     ) -> str:
         vision_body = copy.deepcopy(body)
         vision_body["stream"] = False
@@ -769,14 +518,14 @@ class ReverseProxy:
             "不要说看不到图片，不要输出多余客套。"
         )
         vision_body["messages"] = [{"role": "system", "content": instruction}] + messages
-        processed_vision_body = self._modify_request_body(vision_body, FORCED_VISION_MODEL)
+        processed_vision_body = self._modify_request_body(vision_body, vision_model)
 
         result = await self._proxy_non_stream(
             client,
             endpoint,
             headers,
             processed_vision_body,
-            model=FORCED_VISION_MODEL,
+            model=vision_model,
             has_images=True,
             allow_vision_fallback=False,
         )
@@ -810,27 +559,25 @@ class ReverseProxy:
         model: str,
         has_images: bool,
         allow_vision_fallback: bool = True,
+        session_id: Optional[str] = None,
     ):
-        """非流式代理 - 带重试"""
+        """非流式代理 - 带重试（session_id 为空时每次尝试使用随机 id）"""
         last_error = None
         for attempt in range(MAX_RETRIES):
             try:
-                request_headers = self._apply_iflow_security_headers(headers)
-                response = await client.post(
-                    f"{self.upstream_url}{endpoint}",
-                    headers=request_headers,
-                    json=body,
-                )
-                response.raise_for_status()
-
-                # 修改响应
-                response_headers = dict(response.headers)
-                content = self._modify_response(response.content, response.status_code, response_headers)
-                result = json.loads(content)
-
-                if "usage" not in result or not isinstance(result.get("usage"), dict):
-                    prompt_tokens = _estimate_openai_prompt_tokens(body)
-                    completion_tokens = _estimate_openai_completion_tokens(result)
+                response = await self._open_upstream(client, endpoint, headers, body, session_id)
+                try:
+                    content = await transfer.read_decoded(response)
+                finally:
+                    await response.aclose()
+                result = json_codec.loads(content)
+
+                if isinstance(result.get("usage"), dict):
+                    self.cache_stats.record(result["usage"])
+                else:
+                    counter = get_token_counter()
+                    prompt_tokens = counter.count_openai_prompt(body)
+                    completion_tokens = counter.count_openai_completion(result, model)
                     result["usage"] = {
                         "prompt_tokens": prompt_tokens,
                         "completion_tokens": completion_tokens,
@@ -839,18 +586,20 @@ class ReverseProxy:
 
                 return result
             except httpx.HTTPStatusError as e:
-                if allow_vision_fallback and _should_fallback_to_forced_vision(e, model=model, has_images=has_images):
-                    logger.info(f"[iFlow] 原模型不支持图片输入，回退视觉模型: {model} -> {FORCED_VISION_MODEL}")
+                vision_model = _vision_fallback_for_error(e, model=model, has_images=has_images) if allow_vision_fallback else None
+                if vision_model:
+                    logger.info(f"[iFlow] 原模型不支持图片输入，回退视觉模型: {model} -> {vision_model}")
                     fallback_body = body.copy()
-                    fallback_body["model"] = FORCED_VISION_MODEL
+                    fallback_body["model"] = vision_model
                     return await self._proxy_non_stream(
                         client,
                         endpoint,
                         headers,
                         fallback_body,
-                        model=FORCED_VISION_MODEL,
+                        model=vision_model,
                         has_images=has_images,
                         allow_vision_fallback=False,
+                        session_id=session_id,
                     )
                 last_error = e
                 status_code = e.response.status_code
@@ -880,46 +629,41 @@ class ReverseProxy:
         model: str,
         has_images: bool,
         allow_vision_fallback: bool = True,
+        session_id: Optional[str] = None,
     ) -> AsyncIterator[bytes]:
 
         try:
-            request_headers = self._apply_iflow_security_headers(headers)
-            async with client.stream(
-                "POST",
-                f"{self.upstream_url}{endpoint}",
-                headers=request_headers,
-                json=body,
-            ) as response:
-                response.raise_for_status()
-
-                # 使用缓冲区按 SSE 事件边界分割
-                # SSE 事件以 \n\n 分隔
-                buffer = b""
-                async for chunk in response.aiter_bytes():
-                    buffer += chunk
-
-                    # 查找完整的 SSE 事件（以 \n\n 结尾）
-                    while b"\n\n" in buffer:
-                        event, buffer = buffer.split(b"\n\n", 1)
-                        # 发送完整的 SSE 事件（包含 \n\n）
-                        yield event + b"\n\n"
+            response = await self._open_upstream(client, endpoint, headers, body, session_id)
+            try:
+                # 按 SSE 事件边界（\n\n）分割，逐个发送完整事件
+                splitter = transfer.SSESplitter()
+                async for chunk in transfer.iter_decoded(response):
+                    for event in splitter.feed(chunk):
+                        if b'"prompt_tokens"' in event:
+                            self._record_stream_usage(event)
+                        yield event
 
                 # 处理剩余数据（如果有）
-                if buffer:
-                    yield buffer
+                remainder = splitter.remainder()
+                if remainder:
+                    yield remainder
+            finally:
+                await response.aclose()
         except httpx.HTTPStatusError as e:
-            if allow_vision_fallback and _should_fallback_to_forced_vision(e, model=model, has_images=has_images):
-                logger.info(f"[iFlow] 原模型不支持图片输入，流式回退视觉模型: {model} -> {FORCED_VISION_MODEL}")
+            vision_model = _vision_fallback_for_error(e, model=model, has_images=has_images) if allow_vision_fallback else None
+            if vision_model:
+                logger.info(f"[iFlow] 原模型不支持图片输入，流式回退视觉模型: {model} -> {vision_model}")
                 fallback_body = body.copy()
-                fallback_body["model"] = FORCED_VISION_MODEL
+                fallback_body["model"] = vision_model
                 async for chunk in self._proxy_stream(
                     client,
                     endpoint,
                     headers,
                     fallback_body,
-                    model=FORCED_VISION_MODEL,
+                    model=vision_model,
                     has_images=has_images,
                     allow_vision_fallback=False,
+                    session_id=session_id,
                 ):
                     yield chunk
                 return
@@ -929,8 +673,21 @@ class ReverseProxy:
             logger.error(f"amp upstream proxy error for POST {endpoint}: {e}")
             raise
 
-    async def get_models(self) -> Dict[str, Any]:
-        """获取模型列表"""
+    def _record_stream_usage(self, event: bytes) -> None:
+        if not event.startswith(b"data:"):
+            return
+        try:
+            data = json_codec.loads(event[5:].strip())
+        except Exception:
+            return
+        if isinstance(data, dict):
+            self.cache_stats.record(data.get("usage"))
+
+    async def get_models(self, background: bool = True) -> Dict[str, Any]:
+        """获取模型列表（带缓存，见 proxy.model_cache）"""
+        return await self.models_cache.get(background=background)
+
+    async def _fetch_models(self, etag: Optional[str]):
         await self.initialize()
 
         headers = self._director({})
@@ -938,15 +695,24 @@ class ReverseProxy:
 
         try:
             request_headers = self._apply_iflow_security_headers(headers)
-            response = await client.get(
-                f"{self.upstream_url}/models",
-                headers=request_headers
+            if etag:
+                request_headers["if-none-match"] = etag
+            response = await client.send(
+                client.build_request(
+                    "GET", f"{self.upstream_url}/models", headers=request_headers, extensions=pool.trace_extensions()
+                ),
+                stream=True,
             )
-            response.raise_for_status()
-
-            response_headers = dict(response.headers)
-            content = self._modify_response(response.content, response.status_code, response_headers)
-            return _append_extra_models(json.loads(content))
+            try:
+                if response.status_code == 304:
+                    return None, etag
+                if not response.is_success:
+                    await response.aread()
+                    response.raise_for_status()
+                content = await transfer.read_decoded(response)
+            finally:
+                await response.aclose()
+            return _append_extra_models(json_codec.loads(content)), response.headers.get("etag")
         except Exception as e:
             logger.error(f"amp upstream proxy error for GET /models: {e}")
             raise
@@ -954,12 +720,54 @@ class ReverseProxy:
 
 # 全局实例
 _proxy: Optional[ReverseProxy] = None
+# 配置变化时需要重建代理的字段
+PROXY_CONFIG_KEYS = ("base_url", "api_key", "token_file_path", "session_affinity")
+# 这些配置不变时模型列表仍然有效，重建代理后沿用缓存
+UPSTREAM_CONFIG_KEYS = ("base_url", "api_key", "token_file_path")
+
+
+def _build_proxy(config) -> ReverseProxy:
+    return ReverseProxy(
+        config["base_url"],
+        config["api_key"],
+        config.get("token_file_path"),
+        session_affinity=bool(config.get("session_affinity")),
+    )
+
+
+def _invalidate_models() -> None:
+    # 注册表变化可能改变列出的模型：下次请求时后台刷新模型列表
+    if _proxy is not None:
+        _proxy.models_cache.invalidate()
+
+
+def _on_config_change(previous, current) -> None:
+    """配置重新加载后以新配置重建代理
+
+    进行中的请求继续使用它们已取得的旧实例；新旧实例共用同一个 HTTP 客户端（连接池
+    按上游地址区分），旧实例无需关闭，上游连接也不会因重载而变冷。旧实例的模型列表
+    后台刷新被取消；上游地址与凭证不变时新实例沿用其缓存，/v1/models 不必等待上游。
+    """
+    global _proxy
+    old = _proxy
+    if old is None or all(previous.get(key) == current.get(key) for key in PROXY_CONFIG_KEYS):
+        return
+    proxy = _build_proxy(current)
+    proxy._client = old._client
+    proxy.cache_stats = old.cache_stats
+    old.models_cache.cancel()
+    if all(previous.get(key) == current.get(key) for key in UPSTREAM_CONFIG_KEYS):
+        old.models_cache.rebind(proxy._fetch_models)
+        proxy.models_cache = old.models_cache
+    _proxy = proxy
+    logger.info(f"已按新配置重建代理: {proxy.upstream_url}")
 
 
 def get_proxy() -> ReverseProxy:
     """获取代理实例"""
     global _proxy
     if _proxy is None:
-        token_file = CONFIG.get("token_file_path")
-        _proxy = ReverseProxy(CONFIG["base_url"], CONFIG["api_key"], token_file)
+        _proxy = _build_proxy(current_config())
+        get_model_registry().add_listener(_invalidate_models)
+        config_store.add_listener(_on_config_change)
     return _proxy
@@ -0,0 +1,323 @@
+"""请求体改写
+
+ReverseProxy 发往上游前对请求体的全部改写集中在这里：
+
+- 只取决于模型名的决策（去掉思考后缀并解析别名后的模型名、后缀中的思考配置，以及
+  模型注册表 core.models 中的能力：思考参数格式、是否视觉模型、两段式视觉处理与回退
+  模型、最大输出 token）按模型名字符串计算一次并缓存为 ``RequestPlan``；注册表重新
+  加载后缓存随之失效。
+- 消息列表只遍历一次：规范化图片内容块、定位 system 消息并注入默认系统提示词，同时
+  记录是否含图片（``MessageFacts``），之后不再为判断图片重新扫描消息。
+
+改写结果是调用方请求体的浅拷贝，调用方的请求体与其中的消息不会被修改（续写、重试
+会复用同一请求体）。
+"""
+
+import base64
+import logging
+import mimetypes
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+from core.config import CONFIG
+from core.models import get_model_registry
+from core.thinking import ThinkingConfig, apply_thinking_config, parse_suffix, parse_suffix_to_config
+
+logger = logging.getLogger(__name__)
+
+MAX_LOCAL_IMAGE_BYTES = 10 * 1024 * 1024
+PLAN_CACHE_SIZE = 512
+
+
+def _normalize_base64_data(data: str) -> str:
+    if not data:
+        return ""
+    return "".join(data.split())
+
+
+def _build_data_url(media_type: str, data: str) -> str:
+    if not data:
+        return ""
+    if data.startswith("data:"):
+        return data
+    media_type = media_type or "image/png"
+    data = _normalize_base64_data(data)
+    if not data:
+        return ""
+    return f"data:{media_type};base64,{data}"
+
+
+def _to_local_path(url: str) -> str:
+    if not url:
+        return ""
+    value = url.strip()
+    if value.startswith("file://"):
+        path = unquote(value[7:])
+        if path.startswith("/"):
+            path = path.lstrip("/")
+        path = path.replace("/", os.sep)
+        # UNC path support (file://server/share)
+        if not re.match(r"^[A-Za-z]:\\", path) and path.startswith("\\") is False and value.startswith("file://"):
+            if "\\" not in path and "/" not in path:
+                return path
+            return "\\\\" + path.lstrip("\\")
+        return path
+    if re.match(r"^[A-Za-z]:\\", value) or re.match(r"^[A-Za-z]:/", value):
+        return unquote(value).replace("/", os.sep)
+    return ""
+
+
+def _load_local_image_as_data_url(url: str) -> str:
+    path = _to_local_path(url)
+    if not path:
+        return ""
+    if not os.path.exists(path):
+        logger.warning(f"[iFlow] 本地图片路径不存在: {path}")
+        return ""
+    try:
+        size = os.path.getsize(path)
+        if size > MAX_LOCAL_IMAGE_BYTES:
+            logger.warning(f"[iFlow] 本地图片过大，已跳过: {path} ({size} bytes)")
+            return ""
+        with open(path, "rb") as f:
+            data = f.read()
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        encoded = base64.b64encode(data).decode("ascii")
+        return f"data:{media_type};base64,{encoded}"
+    except Exception as e:
+        logger.warning(f"[iFlow] 读取本地图片失败: {path} ({e})")
+        return ""
+
+
+def _normalize_image_url(url: str) -> str:
+    if not url:
+        return ""
+    value = url.strip()
+    if value.startswith("data:") or value.startswith("http://") or value.startswith("https://"):
+        return value
+    if CONFIG.get("allow_local_file_images"):
+        local_data = _load_local_image_as_data_url(value)
+        if local_data:
+            return local_data
+    return value
+
+
+def _extract_image_url_from_part(part: Dict[str, Any]) -> str:
+    if not isinstance(part, dict):
+        return ""
+
+    image_url_field = part.get("image_url")
+    if isinstance(image_url_field, dict):
+        url = image_url_field.get("url", "")
+        if url:
+            return _normalize_image_url(url)
+    elif isinstance(image_url_field, str):
+        return _normalize_image_url(image_url_field)
+
+    url_field = part.get("url")
+    if isinstance(url_field, str) and url_field:
+        return _normalize_image_url(url_field)
+
+    source = part.get("source")
+    if isinstance(source, dict):
+        source_type = source.get("type", "")
+        if source_type == "url":
+            return _normalize_image_url(source.get("url", ""))
+        if source_type == "base64":
+            media_type = source.get("media_type") or part.get("media_type") or "image/png"
+            return _build_data_url(media_type, source.get("data", ""))
+
+    return ""
+
+
+def _build_image_url_part(part: Dict[str, Any], url: str) -> Dict[str, Any]:
+    image_url = {"url": url}
+    detail = None
+    image_url_field = part.get("image_url")
+    if isinstance(image_url_field, dict):
+        detail = image_url_field.get("detail")
+    if detail is None:
+        detail = part.get("detail")
+    if detail:
+        image_url["detail"] = detail
+    return {"type": "image_url", "image_url": image_url}
+
+
+_IMAGE_PART_TYPES = ("image", "image_url", "input_image")
+
+
+def _is_image_part(part: Dict[str, Any]) -> bool:
+    if not isinstance(part, dict):
+        return False
+    part_type = part.get("type", "")
+    if part_type in _IMAGE_PART_TYPES:
+        return True
+    if "image_url" in part:
+        return True
+    source = part.get("source")
+    return isinstance(source, dict) and source.get("type") in ("base64", "url")
+
+
+
+def get_default_system_prompt() -> str:
+    """生成默认系统提示词"""
+    return """--- SYSTEM PROMPT BEGIN ---
+## Tool Usage Strategy
+- 严禁猜测代码位置。必须使用工具获取确切的符号关系和定义。
+- 优先使用工具解决问题，避免盲目猜测和假设。
+- 在进行代码阅读和修改前，务必先通过工具确认符号关系和定义，避免误操作。
+- 在进行代码修改时，务必先通过工具分析影响范围，避免破坏现有功能。
+## Tool Call Format (MANDATORY)
+- 工具调用必须严格遵守规范格式，所有必需参数必须提供，禁止省略。
+- 禁止发送空参数或缺少参数的工具调用，这会导致系统错误。
+- 调用工具前必须确认所有 required 参数都已正确填写。
+- 工具调用错误通常是路径或操作系统问题，请检查路径格式参数等是否正确。
+- 如果在 plan 模式下工具调用失败可能导致循环调用，遇到错误时应停止重试并分析原因。
+## Code Modification Rules
+- 修改代码前必须分析可能的副作用，包括对其他模块、函数、测试的影响。
+- 修改公共接口或共享代码时，必须检查所有调用方。
+## File Reading Rules (CRITICAL)
+- 禁止一次性读取超大文件（>10kb），必须使用 offset 和 limit 参数分段读取。
+- 读取大文件前先评估文件大小，优先使用 Grep 搜索定位关键内容。
+--- SYSTEM PROMPT END ---"""
+
+
+
+@dataclass(frozen=True)
+class RequestPlan:
+    """按模型名缓存的改写方案"""
+    model: str
+    # 发往上游的模型名（去掉思考后缀、解析别名）
+    base_model: str
+    suffix_config: Optional[ThinkingConfig]
+    thinking_format: str
+    # 模型本身支持图片输入
+    vision: bool
+    # 注册表要求对图片输入做两段式处理（GLM / MiniMax 系列）
+    force_vision_series: bool
+    # 代为处理图片的视觉模型
+    vision_fallback: str
+    # 两段式处理可用：force_vision_series 且 vision_fallback 确实支持图片
+    two_stage_vision: bool
+    max_output_tokens: Optional[int]
+    system_prompt: str
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def _build_plan(model: str, registry_version: int) -> RequestPlan:
+    registry = get_model_registry()
+    suffix = parse_suffix(model)
+    base_model = registry.canonical(suffix.model_name)
+    caps = registry.lookup(base_model)
+    vision_fallback = registry.vision_fallback(base_model)
+    return RequestPlan(
+        model=model,
+        base_model=base_model,
+        suffix_config=parse_suffix_to_config(suffix.raw_suffix) if suffix.has_suffix else None,
+        thinking_format=caps.thinking,
+        vision=caps.vision,
+        force_vision_series=caps.two_stage_vision,
+        vision_fallback=vision_fallback,
+        two_stage_vision=caps.two_stage_vision and registry.lookup(vision_fallback).vision,
+        max_output_tokens=caps.max_output_tokens,
+        system_prompt=get_default_system_prompt(),
+    )
+
+
+def get_plan(model: str) -> RequestPlan:
+    registry = get_model_registry()
+    registry.maybe_reload()
+    return _build_plan(model, registry.version)
+
+
+class MessageFacts:
+    """单次遍历消息时收集的信息"""
+
+    __slots__ = ("has_images", "system_index")
+
+    def __init__(self):
+        self.has_images = False
+        # 第一条 system 消息的下标（注入前）；没有时为 None
+        self.system_index: Optional[int] = None
+
+
+def _normalize_content(content: List[Any]) -> Tuple[Optional[List[Any]], bool]:
+    """规范化内容块为 OpenAI 格式，返回 (新列表或 None 表示无变化, 是否含图片)"""
+    normalized: Optional[List[Any]] = None
+    has_images = False
+    for index, part in enumerate(content):
+        replacement = None
+        if isinstance(part, dict):
+            part_type = part.get("type", "")
+            image_like = part_type in _IMAGE_PART_TYPES or "image_url" in part or "source" in part
+            if image_like and not has_images:
+                has_images = _is_image_part(part)
+            if part_type == "input_text" and "text" in part:
+                replacement = {"type": "text", "text": part.get("text", "")}
+            elif image_like:
+                url = _extract_image_url_from_part(part)
+                if url:
+                    replacement = _build_image_url_part(part, url)
+        if replacement is not None:
+            if normalized is None:
+                normalized = list(content[:index])
+            normalized.append(replacement)
+        elif normalized is not None:
+            normalized.append(part)
+    return normalized, has_images
+
+
+def rewrite_messages(messages: Any, system_prompt: str) -> Tuple[List[Any], MessageFacts]:
+    """单次遍历：规范化图片内容块、在 system 消息开头注入系统提示词、记录是否含图片"""
+    facts = MessageFacts()
+    result: List[Any] = []
+    if isinstance(messages, list):
+        for msg in messages:
+            if isinstance(msg, dict):
+                content = msg.get("content")
+                if isinstance(content, list):
+                    normalized, has_images = _normalize_content(content)
+                    if has_images:
+                        facts.has_images = True
+                    if normalized is not None:
+                        msg = dict(msg)
+                        msg["content"] = normalized
+                if facts.system_index is None and msg.get("role") == "system":
+                    facts.system_index = len(result)
+            result.append(msg)
+
+    if facts.system_index is None:
+        result.insert(0, {"role": "system", "content": system_prompt})
+        return result, facts
+
+    system_msg = dict(result[facts.system_index])
+    existing_content = system_msg.get("content", "")
+    if isinstance(existing_content, str):
+        system_msg["content"] = f"{system_prompt}\n\n{existing_content}"
+    elif isinstance(existing_content, list):
+        system_msg["content"] = [{"type": "text", "text": system_prompt}] + existing_content
+    result[facts.system_index] = system_msg
+    return result, facts
+
+
+def apply_plan(body: Dict[str, Any], plan: RequestPlan, messages: List[Any]) -> Dict[str, Any]:
+    """按方案改写请求体顶层字段（模型名、思考参数），使用已改写的消息"""
+    processed = body.copy()
+    processed["messages"] = messages
+    limit = plan.max_output_tokens
+    if limit:
+        for key in ("max_tokens", "max_completion_tokens"):
+            value = processed.get(key)
+            if isinstance(value, int) and value > limit:
+                processed[key] = limit
+    return apply_thinking_config(processed, plan.base_model, plan.suffix_config, plan.thinking_format)
+
+
+def rewrite_request(body: Dict[str, Any], model: str) -> Tuple[Dict[str, Any], MessageFacts]:
+    plan = get_plan(model)
+    messages, facts = rewrite_messages(body.get("messages"), plan.system_prompt)
+    return apply_plan(body, plan, messages), facts
@@ -0,0 +1,270 @@
+"""上游传输编码
+
+- 请求上游时声明 ``Accept-Encoding``（zstd 需要可选依赖 ``zstandard``），响应按原始
+  字节流读取并逐块解压：非流式响应不再整体 ``gzip.decompress``，SSE 也能边收边解。
+  未标注 Content-Encoding 但以 gzip 魔数开头的响应同样按 gzip 解压。
+- 可选压缩上行请求体（配置 ``upstreamCompression``: "gzip" / "zstd" / true）。上游以
+  415 拒绝时自动关闭并以未压缩的请求体重发；配置重新加载后按新值重新启用。
+- 收发的原始与线上字节数、编解码耗时、估算节省的传输时间见 /admin/sysinfo 的
+  ``upstream_transfer``。
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+from core.codecs import (
+    GZIP_MAGIC,
+    Decoder,
+    UnsupportedEncoding,
+    available_encodings,
+    compress_bytes,
+    decodable_encodings,
+    parse_content_encoding,
+)
+from core.config import CONFIG, config_store
+
+logger = logging.getLogger(__name__)
+
+ACCEPT_ENCODING = ", ".join(decodable_encodings())
+# 小于此大小的请求体不压缩
+UPLOAD_MIN_BYTES = 16 * 1024
+# 超过此大小的请求体在线程中压缩
+UPLOAD_OFFLOAD_BYTES = 512 * 1024
+
+
+def _upload_encoding(value: Any) -> str:
+    """配置值 -> 上行压缩使用的编码；空字符串表示不压缩"""
+    if value is True:
+        return available_encodings()[0]
+    value = str(value or "").strip().lower()
+    if value in ("1", "true", "yes", "on", "auto"):
+        return available_encodings()[0]
+    if value in available_encodings():
+        return value
+    if value and value not in ("0", "false", "no", "off"):
+        logger.warning(f"上游压缩: 不支持的编码 {value!r}，不压缩请求体")
+    return ""
+
+
+class TransferTotals:
+    """进程内累计，供 /admin/sysinfo 展示"""
+
+    def __init__(self):
+        self.responses = 0
+        self.compressed_responses = 0
+        self.response_wire_bytes = 0
+        self.response_bytes = 0
+        self.decode_seconds = 0.0
+        # 非流式响应的读取耗时，用于估算下行吞吐
+        self.read_seconds = 0.0
+        self.read_wire_bytes = 0
+        self.uploads = 0
+        self.compressed_uploads = 0
+        self.upload_bytes = 0
+        self.upload_wire_bytes = 0
+        self.encode_seconds = 0.0
+        self.upload_rejected = 0
+
+    def record_response(self, stats: "ResponseStats") -> None:
+        self.responses += 1
+        if stats.encoding:
+            self.compressed_responses += 1
+        self.response_wire_bytes += stats.wire_bytes
+        self.response_bytes += stats.body_bytes
+        self.decode_seconds += stats.decode_seconds
+
+    def record_read(self, wire_bytes: int, seconds: float) -> None:
+        self.read_wire_bytes += wire_bytes
+        self.read_seconds += seconds
+
+    def record_upload(self, raw_bytes: int, wire_bytes: int, seconds: float, compressed: bool) -> None:
+        self.uploads += 1
+        self.upload_bytes += raw_bytes
+        self.upload_wire_bytes += wire_bytes
+        if compressed:
+            self.compressed_uploads += 1
+            self.encode_seconds += seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        download_saved = self.response_bytes - self.response_wire_bytes
+        upload_saved = self.upload_bytes - self.upload_wire_bytes
+        # 按非流式响应观测到的下行吞吐估算少传输的时间（上行按同样的吞吐近似）
+        throughput = self.read_wire_bytes / self.read_seconds if self.read_seconds > 0 else 0.0
+        estimated_ms = (download_saved + upload_saved) / throughput * 1000 if throughput > 0 else None
+        return {
+            "accept_encoding": ACCEPT_ENCODING,
+            "upload_encoding": uploads.encoding or None,
+            "responses": self.responses,
+            "compressed_responses": self.compressed_responses,
+            "response_wire_bytes": self.response_wire_bytes,
+            "response_bytes": self.response_bytes,
+            "download_bytes_saved": download_saved,
+            "decode_ms": round(self.decode_seconds * 1000, 1),
+            "uploads": self.uploads,
+            "compressed_uploads": self.compressed_uploads,
+            "upload_bytes": self.upload_bytes,
+            "upload_wire_bytes": self.upload_wire_bytes,
+            "upload_bytes_saved": upload_saved,
+            "encode_ms": round(self.encode_seconds * 1000, 1),
+            "upload_rejected": self.upload_rejected,
+            "estimated_transfer_ms_saved": None if estimated_ms is None else round(estimated_ms, 1),
+        }
+
+
+totals = TransferTotals()
+
+
+class UploadPolicy:
+    """上行请求体压缩；上游不支持时在本进程内关闭"""
+
+    def __init__(self, encoding: str, min_bytes: int = UPLOAD_MIN_BYTES):
+        self.encoding = encoding
+        self.min_bytes = min_bytes
+
+    async def encode(self, payload: bytes) -> Tuple[bytes, Optional[str]]:
+        """返回 (请求体, Content-Encoding)；不压缩时编码为 None"""
+        encoding = self.encoding
+        if not encoding or len(payload) < self.min_bytes:
+            totals.record_upload(len(payload), len(payload), 0.0, compressed=False)
+            return payload, None
+        started = time.perf_counter()
+        if len(payload) >= UPLOAD_OFFLOAD_BYTES:
+            content = await asyncio.to_thread(compress_bytes, payload, encoding)
+        else:
+            content = compress_bytes(payload, encoding)
+        totals.record_upload(len(payload), len(content), time.perf_counter() - started, compressed=True)
+        return content, encoding
+
+    def reject(self, encoding: str) -> None:
+        """上游以 415 拒绝了压缩的请求体"""
+        totals.upload_rejected += 1
+        if self.encoding:
+            logger.warning(f"上游不接受 Content-Encoding: {encoding}，后续请求不再压缩请求体")
+            self.encoding = ""
+
+
+uploads = UploadPolicy(_upload_encoding(CONFIG.get("upstream_compression")))
+
+
+def _on_config_change(previous, current) -> None:
+    if previous.get("upstream_compression") != current.get("upstream_compression"):
+        uploads.encoding = _upload_encoding(current.get("upstream_compression"))
+
+
+config_store.add_listener(_on_config_change)
+
+
+class ResponseStats:
+    """单个上游响应的传输统计"""
+
+    __slots__ = ("encoding", "wire_bytes", "body_bytes", "decode_seconds")
+
+    def __init__(self):
+        self.encoding = ""
+        self.wire_bytes = 0
+        self.body_bytes = 0
+        self.decode_seconds = 0.0
+
+
+async def _already_read(content: bytes) -> AsyncIterator[bytes]:
+    yield content
+
+
+async def iter_decoded(response: httpx.Response) -> AsyncIterator[bytes]:
+    """逐块读取并解压响应体；结束时记录传输统计
+
+    Content-Encoding 不在可解码范围内（上游无视 Accept-Encoding）或响应体已被读取时，
+    使用 httpx 解码后的内容。
+    """
+    stats = ResponseStats()
+    try:
+        encoding = parse_content_encoding(response.headers.get("content-encoding"))
+    except UnsupportedEncoding:
+        encoding = None
+        source = response.aiter_bytes()
+    else:
+        if response.is_stream_consumed:
+            encoding = None
+            source = _already_read(response.content)
+        else:
+            source = response.aiter_raw()
+
+    decoder: Optional[Decoder] = None
+    first = True
+    async for raw in source:
+        if not raw:
+            continue
+        stats.wire_bytes += len(raw)
+        if first:
+            first = False
+            if encoding is None and response.is_success and raw[:2] == GZIP_MAGIC:
+                # 上游未标注 Content-Encoding 的 gzip 响应
+                encoding = "gzip"
+            if encoding is not None:
+                decoder = Decoder(encoding)
+                stats.encoding = encoding
+        if decoder is None:
+            stats.body_bytes += len(raw)
+            yield raw
+            continue
+        started = time.perf_counter()
+        pieces = list(decoder.feed(raw))
+        stats.decode_seconds += time.perf_counter() - started
+        for piece in pieces:
+            stats.body_bytes += len(piece)
+            yield piece
+    if decoder is not None:
+        decoder.finish()
+    stats.wire_bytes = response.num_bytes_downloaded or stats.wire_bytes
+    totals.record_response(stats)
+
+
+async def read_decoded(response: httpx.Response) -> bytes:
+    """读取并解压整个响应体（非流式响应）"""
+    started = time.perf_counter()
+    wire_before = response.num_bytes_downloaded
+    body = bytearray()
+    async for piece in iter_decoded(response):
+        body += piece
+    totals.record_read(response.num_bytes_downloaded - wire_before, time.perf_counter() - started)
+    return bytes(body)
+
+
+class SSESplitter:
+    """按 SSE 事件边界（空行）切分字节流
+
+    不含分隔符的块只暂存，出现分隔符时才拼接一次再切分，长事件分成很多块到达时
+    不会反复拷贝与重复扫描整个缓冲区。
+    """
+
+    __slots__ = ("_pending", "_ends_with_newline")
+
+    def __init__(self):
+        self._pending: List[bytes] = []
+        self._ends_with_newline = False
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        pending = self._pending
+        # 分隔符可能跨块：暂存部分以 \n 结尾且本块以 \n 开头
+        if b"\n\n" not in chunk and not (pending and self._ends_with_newline and chunk[:1] == b"\n"):
+            if chunk:
+                pending.append(chunk)
+                self._ends_with_newline = chunk[-1:] == b"\n"
+            return []
+        data = b"".join(pending) + chunk if pending else chunk
+        pending.clear()
+        parts = data.split(b"\n\n")
+        tail = parts.pop()
+        if tail:
+            pending.append(tail)
+            self._ends_with_newline = tail[-1:] == b"\n"
+        return [part + b"\n\n" for part in parts]
+
+    def remainder(self) -> bytes:
+        data = b"".join(self._pending)
+        self._pending.clear()
+        return data
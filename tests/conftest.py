@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 直接运行 pytest 时也能导入仓库内的包
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# 配置、模型注册表与日志库的路径在导入时由主目录决定：测试使用空的临时主目录，
+# 不读取本机的 ~/.iflow 与 ~/.iflow2api
+_home = tempfile.mkdtemp(prefix="iflow2api-tests-")
+os.environ["HOME"] = _home
+os.environ["USERPROFILE"] = _home
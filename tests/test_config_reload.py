@@ -0,0 +1,86 @@
+"""配置重新加载后重建代理：模型列表缓存的沿用与后台刷新的取消"""
+
+import asyncio
+import json
+import time
+
+from core import config as core_config
+from core.config import config_store
+from proxy.proxy import get_proxy
+
+MODELS = {"object": "list", "data": [{"id": "glm-4.7", "object": "model"}]}
+
+
+def _write_settings(**settings) -> None:
+    core_config.SETTINGS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    core_config.SETTINGS_PATH.write_text(json.dumps(settings), encoding="utf-8")
+    config_store.reload()
+
+
+async def _hanging_fetch(etag):
+    await asyncio.sleep(3600)
+
+
+async def _start_background_refresh(cache) -> asyncio.Task:
+    """缓存中有过期的列表，get() 立即返回旧列表并在后台刷新"""
+    cache.rebind(_hanging_fetch)
+    cache.payload = MODELS
+    cache.fetched_at = time.monotonic() - cache.ttl - 1
+    assert await cache.get() is MODELS
+    task = cache._inflight
+    assert task is not None and not task.done()
+    return task
+
+
+def test_models_cache_carried_over_when_upstream_unchanged():
+    async def scenario():
+        _write_settings(apiKey="key-1", baseUrl="http://127.0.0.1:9/v1")
+        old = get_proxy()
+        refresh = await _start_background_refresh(old.models_cache)
+
+        _write_settings(apiKey="key-1", baseUrl="http://127.0.0.1:9/v1", sessionAffinity=True)
+        new = get_proxy()
+        await asyncio.sleep(0)
+
+        assert new is not old and new.session_affinity
+        assert refresh.cancelled()
+        # 沿用缓存，之后的刷新使用新实例
+        assert new.models_cache is old.models_cache
+        assert new.models_cache.payload is MODELS
+        assert new.models_cache._fetch == new._fetch_models
+
+    asyncio.run(scenario())
+
+
+def test_models_cache_starts_cold_when_credentials_change():
+    async def scenario():
+        _write_settings(apiKey="key-2", baseUrl="http://127.0.0.1:9/v1")
+        old = get_proxy()
+        refresh = await _start_background_refresh(old.models_cache)
+
+        _write_settings(apiKey="key-3", baseUrl="http://127.0.0.1:9/v1")
+        new = get_proxy()
+        await asyncio.sleep(0)
+
+        assert new.api_key == "key-3"
+        assert refresh.cancelled()
+        assert new.models_cache is not old.models_cache
+        assert new.models_cache.payload is None
+
+    asyncio.run(scenario())
+
+
+def test_waiting_request_gets_fallback_when_refresh_is_cancelled():
+    async def scenario():
+        cache = get_proxy().models_cache
+        cache.rebind(_hanging_fetch)
+        cache.payload = None
+        waiting = asyncio.create_task(cache.get(background=False))
+        await asyncio.sleep(0)
+
+        cache.cancel()
+        result = await waiting
+
+        assert "data" in result and not waiting.cancelled()
+
+    asyncio.run(scenario())
@@ -0,0 +1,104 @@
+"""续写轮次拼接后的 Anthropic SSE：每个 content block 只 start / stop 一次"""
+
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
+
+from app import continuation
+from converters import StreamConverter
+
+
+def _chunk(delta: Optional[Dict[str, Any]] = None, finish_reason: Optional[str] = None) -> bytes:
+    data = {"id": "chatcmpl-1", "choices": [{"index": 0, "delta": delta or {}, "finish_reason": finish_reason}]}
+    return b"data: " + json.dumps(data).encode()
+
+
+def _run(rounds: List[List[bytes]]) -> List[Dict[str, Any]]:
+    """按 app.server.anthropic_messages 的方式把续写流交给 StreamConverter，返回解析后的事件"""
+    remaining = iter(rounds)
+    bodies = []
+
+    async def open_stream(body):
+        bodies.append(body)
+        chunks = next(remaining)
+
+        async def gen():
+            for chunk in chunks:
+                yield chunk
+
+        return gen()
+
+    async def collect():
+        converter = StreamConverter("glm-4.7", "msg_1")
+        raw = []
+        body = {"model": "glm-4.7", "messages": [{"role": "user", "content": "hi"}], "max_tokens": 1024}
+        async for chunk, data in continuation.stream(open_stream, body, "glm-4.7", fallback_id="msg_1"):
+            if data is not None:
+                raw.extend(converter.convert_data(data))
+            elif chunk == continuation.DONE_CHUNK:
+                raw.extend(converter.convert_done())
+        return raw
+
+    raw = asyncio.run(collect())
+    assert len(bodies) == len(rounds)
+    events = []
+    for event in raw:
+        for line in event.decode().splitlines():
+            if line.startswith("data:"):
+                events.append(json.loads(line[5:]))
+    return events
+
+
+def _assert_blocks_well_formed(events: List[Dict[str, Any]]) -> Dict[int, str]:
+    """每个 index 恰好 start 一次、stop 一次，delta 只出现在打开期间；返回 index -> block 类型"""
+    started: Dict[int, str] = {}
+    stopped = set()
+    open_index = None
+    for event in events:
+        kind = event["type"]
+        if kind == "content_block_start":
+            index = event["index"]
+            assert index not in started, f"block {index} started twice"
+            assert open_index is None, f"block {index} started while {open_index} is open"
+            started[index] = event["content_block"]["type"]
+            open_index = index
+        elif kind == "content_block_delta":
+            assert event["index"] == open_index
+        elif kind == "content_block_stop":
+            index = event["index"]
+            assert index == open_index and index not in stopped, f"block {index} stopped twice"
+            stopped.add(index)
+            open_index = None
+    assert set(started) == stopped
+    assert sorted(started) == list(range(len(started)))
+    assert [event["type"] for event in events].count("message_stop") == 1
+    return started
+
+
+def _text(events: List[Dict[str, Any]], field: str) -> str:
+    return "".join(
+        event["delta"].get(field, "") for event in events if event["type"] == "content_block_delta"
+    )
+
+
+def test_thinking_and_text_restart_in_next_round():
+    events = _run([
+        [_chunk({"reasoning_content": "plan "}), _chunk({"content": "part one"}), _chunk(finish_reason="length")],
+        [_chunk({"reasoning_content": "more"}), _chunk({"content": ", part two"}), _chunk(finish_reason="stop")],
+    ])
+    blocks = _assert_blocks_well_formed(events)
+    assert list(blocks.values()) == ["thinking", "text", "thinking", "text"]
+    assert _text(events, "text") == "part one, part two"
+    assert _text(events, "thinking") == "plan more"
+
+
+def test_text_block_stays_open_across_rounds():
+    events = _run([
+        [_chunk({"content": "part one"}), _chunk(finish_reason="length")],
+        [_chunk({"content": ", part two"}), _chunk(finish_reason="stop")],
+    ])
+    blocks = _assert_blocks_well_formed(events)
+    assert list(blocks.values()) == ["text"]
+    assert _text(events, "text") == "part one, part two"
+    stop_reasons = [event["delta"]["stop_reason"] for event in events if event["type"] == "message_delta"]
+    assert stop_reasons == ["end_turn"]
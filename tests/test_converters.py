@@ -0,0 +1,122 @@
+"""StreamConverter：tool_use block 依次开始、增量转发参数、结束"""
+
+import json
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+from converters import StreamConverter
+
+
+def _tool_chunk(index: int, arguments: str, tool_id: Optional[str] = None, name: str = "") -> Dict[str, Any]:
+    tool_call: Dict[str, Any] = {"index": index, "function": {"arguments": arguments}}
+    if tool_id:
+        tool_call["id"] = tool_id
+        tool_call["type"] = "function"
+        tool_call["function"]["name"] = name
+    return {"choices": [{"index": 0, "delta": {"tool_calls": [tool_call]}, "finish_reason": None}]}
+
+
+def _finish(reason: str = "tool_calls") -> Dict[str, Any]:
+    return {"choices": [{"index": 0, "delta": {}, "finish_reason": reason}]}
+
+
+def _split(text: str, size: int) -> List[str]:
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+
+def _convert(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    converter = StreamConverter("glm-4.7", "msg_1")
+    raw = []
+    for chunk in chunks:
+        raw.extend(converter.convert_data(chunk))
+    raw.extend(converter.convert_done())
+    events = []
+    for event in raw:
+        for line in event.decode().splitlines():
+            if line.startswith("data:"):
+                events.append(json.loads(line[5:]))
+    return events
+
+
+def _block_events(events: List[Dict[str, Any]]) -> List[tuple]:
+    return [(event["type"], event["index"]) for event in events if event["type"].startswith("content_block")]
+
+
+def _partial_json(events: List[Dict[str, Any]]) -> Dict[int, str]:
+    joined: Dict[int, str] = {}
+    for event in events:
+        if event["type"] == "content_block_delta" and event["delta"]["type"] == "input_json_delta":
+            joined[event["index"]] = joined.get(event["index"], "") + event["delta"]["partial_json"]
+    return joined
+
+
+ARGS = [
+    json.dumps({"path": "src/main.py", "offset": 0, "limit": 200}),
+    json.dumps({"pattern": "def convert_data", "glob": "**/*.py"}),
+]
+
+
+@pytest.mark.parametrize("repeat_id", [False, True])
+def test_two_tool_calls_run_one_after_another(repeat_id):
+    chunks = []
+    for index, (tool_id, name) in enumerate([("call_a", "Read"), ("call_b", "Grep")]):
+        for position, piece in enumerate(_split(ARGS[index], 7)):
+            # 部分上游在每个 chunk 上都带 id 与 name
+            first = position == 0 or repeat_id
+            chunks.append(_tool_chunk(index, piece, tool_id if first else None, name if first else ""))
+    chunks.append(_finish())
+
+    events = _convert(chunks)
+    blocks = _block_events(events)
+
+    first_count = len(_split(ARGS[0], 7))
+    second_count = len(_split(ARGS[1], 7))
+    assert blocks == (
+        [("content_block_start", 0)]
+        + [("content_block_delta", 0)] * first_count
+        + [("content_block_stop", 0), ("content_block_start", 1)]
+        + [("content_block_delta", 1)] * second_count
+        + [("content_block_stop", 1)]
+    )
+    starts = [event["content_block"] for event in events if event["type"] == "content_block_start"]
+    assert [(block["id"], block["name"]) for block in starts] == [("call_a", "Read"), ("call_b", "Grep")]
+    assert _partial_json(events) == {0: ARGS[0], 1: ARGS[1]}
+    assert [event["type"] for event in events][-2:] == ["message_delta", "message_stop"]
+
+
+def test_text_then_tool_call_closes_text_block():
+    events = _convert([
+        {"choices": [{"index": 0, "delta": {"content": "Let me look."}, "finish_reason": None}]},
+        _tool_chunk(0, ARGS[0][:10], "call_a", "Read"),
+        _tool_chunk(0, ARGS[0][10:]),
+        _finish(),
+    ])
+    assert _block_events(events) == [
+        ("content_block_start", 0),
+        ("content_block_delta", 0),
+        ("content_block_stop", 0),
+        ("content_block_start", 1),
+        ("content_block_delta", 1),
+        ("content_block_delta", 1),
+        ("content_block_stop", 1),
+    ]
+    assert _partial_json(events) == {1: ARGS[0]}
+
+
+def test_fragment_for_closed_tool_call_is_dropped():
+    events = _convert([
+        _tool_chunk(0, '{"a": 1}', "call_a", "Read"),
+        _tool_chunk(1, '{"b": 2}', "call_b", "Read"),
+        _tool_chunk(0, "trailing"),
+        _finish(),
+    ])
+    assert _block_events(events) == [
+        ("content_block_start", 0),
+        ("content_block_delta", 0),
+        ("content_block_stop", 0),
+        ("content_block_start", 1),
+        ("content_block_delta", 1),
+        ("content_block_stop", 1),
+    ]
+    assert _partial_json(events) == {0: '{"a": 1}', 1: '{"b": 2}'}
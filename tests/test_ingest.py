@@ -0,0 +1,152 @@
+"""请求体读取：大小上限、落盘与压缩请求体的解压上限"""
+
+import asyncio
+import gzip
+import json
+from typing import Dict, List, Optional
+
+import pytest
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+from app import ingest
+from core import codecs
+
+
+def _request(chunks: List[bytes], headers: Optional[Dict[str, str]] = None) -> Request:
+    """按块送出请求体的 Request；request.received.calls 为 receive 被调用的次数"""
+    pending = list(chunks)
+
+    async def receive():
+        receive.calls += 1
+        body = pending.pop(0) if pending else b""
+        return {"type": "http.request", "body": body, "more_body": bool(pending)}
+
+    receive.calls = 0
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/v1/chat/completions",
+        "headers": [(key.lower().encode(), value.encode()) for key, value in (headers or {}).items()],
+    }
+    request = Request(scope, receive)
+    request.received = receive
+    return request
+
+
+def _read(request: Request, **kwargs):
+    return asyncio.run(ingest.read_json_body(request, **kwargs))
+
+
+def _chunked(data: bytes, size: int) -> List[bytes]:
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def test_declared_length_over_limit_is_rejected_without_reading():
+    request = _request([b"{}"], {"content-length": str(10 * 1024 * 1024)})
+    rejected = ingest.totals.rejected
+
+    with pytest.raises(ingest.BodyTooLarge) as excinfo:
+        _read(request, max_bytes=1024 * 1024)
+
+    assert excinfo.value.status == 413
+    assert excinfo.value.size == 10 * 1024 * 1024
+    assert request.received.calls == 0
+    assert ingest.totals.rejected == rejected + 1
+
+
+def test_chunked_body_over_limit_is_rejected_while_reading():
+    payload = json.dumps({"messages": [{"role": "user", "content": "x" * 4096}]}).encode()
+    request = _request(_chunked(payload, 1024))
+
+    with pytest.raises(ingest.BodyTooLarge):
+        _read(request, max_bytes=2048)
+
+    # 超限后不再继续读取
+    assert request.received.calls <= 3
+
+
+def test_count_tokens_returns_413_for_declared_length(monkeypatch):
+    from app.server import app
+
+    monkeypatch.setattr(ingest, "MAX_BODY_BYTES", 64)
+    body = json.dumps({"model": "glm-4.7", "messages": [{"role": "user", "content": "x" * 200}]})
+    response = TestClient(app).post("/v1/messages/count_tokens", content=body, headers={"content-type": "application/json"})
+
+    assert response.status_code == 413
+    assert response.json()["error"]["type"] == "request_too_large"
+
+
+def test_small_body_is_parsed_in_memory():
+    payload = {"model": "glm-4.7", "messages": [{"role": "user", "content": "hi"}]}
+    data = json.dumps(payload).encode()
+
+    body, stats = _read(_request(_chunked(data, 16)), spool_threshold=1024)
+
+    assert body == payload
+    assert not stats.spooled
+    assert stats.body_bytes == len(data)
+    assert stats.peak_buffer_bytes == len(data)
+
+
+def test_large_body_is_spooled_to_disk():
+    payload = {"model": "glm-4.7", "messages": [{"role": "user", "content": "y" * 64 * 1024}]}
+    data = json.dumps(payload).encode()
+    spooled = ingest.totals.spooled
+
+    body, stats = _read(_request(_chunked(data, 4096)), spool_threshold=8192)
+
+    assert body == payload
+    assert stats.spooled
+    assert stats.body_bytes == len(data)
+    # 落盘后内存中只缓冲单个块
+    assert stats.peak_buffer_bytes <= 8192
+    assert ingest.totals.spooled == spooled + 1
+
+
+def test_gzip_body_is_decoded_and_limited_by_decoded_size():
+    payload = {"messages": [{"role": "user", "content": "z" * 32 * 1024}]}
+    data = json.dumps(payload).encode()
+    compressed = gzip.compress(data)
+
+    body, stats = _read(
+        _request(_chunked(compressed, 512), {"content-encoding": "gzip", "content-length": str(len(compressed))}),
+        max_bytes=len(data),
+    )
+    assert body == payload
+    assert stats.encoding == "gzip"
+    assert stats.wire_bytes == len(compressed)
+    assert stats.body_bytes == len(data)
+
+    # Content-Length（压缩后）小于上限，但解压后超限
+    with pytest.raises(ingest.BodyTooLarge):
+        _read(
+            _request([compressed], {"content-encoding": "gzip", "content-length": str(len(compressed))}),
+            max_bytes=len(data) - 1,
+        )
+
+
+def test_decompression_bomb_stops_at_limit():
+    limit = 1024 * 1024
+    # 约 64 MB 的 0 压缩后只有几十 KB
+    bomb = gzip.compress(b'{"a": "' + b"0" * (64 * 1024 * 1024) + b'"}')
+    assert len(bomb) < limit
+
+    with pytest.raises(ingest.BodyTooLarge) as excinfo:
+        _read(_request(_chunked(bomb, 16 * 1024), {"content-encoding": "gzip"}), max_bytes=limit, spool_threshold=0)
+
+    # 每次解压的输出有上限，超限时展开的数据不超过上限加一段输出
+    assert excinfo.value.size <= limit + codecs.DECODE_PIECE_BYTES
+
+
+def test_unsupported_and_corrupt_encodings():
+    with pytest.raises(ingest.UnsupportedEncoding) as excinfo:
+        _read(_request([b"{}"], {"content-encoding": "br"}))
+    assert excinfo.value.status == 415
+
+    with pytest.raises(ingest.InvalidEncoding):
+        _read(_request([b"not gzip data"], {"content-encoding": "gzip"}))
+
+    truncated = gzip.compress(b'{"a": 1}')[:-6]
+    with pytest.raises(ingest.InvalidEncoding):
+        _read(_request([truncated], {"content-encoding": "gzip"}))
@@ -0,0 +1,62 @@
+"""请求日志查询：status 过滤条件"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.log_store import LogStore, _status_range, query_records
+from app.request_log import RequestLogRecord
+
+
+@pytest.mark.parametrize(
+    "status, expected",
+    [
+        (None, None),
+        ("", None),
+        ("404", (404, 404)),
+        (" 4XX ", (400, 499)),
+        ("500-504", (500, 504)),
+        (429, (429, 429)),
+    ],
+)
+def test_status_filter_forms(status, expected):
+    assert _status_range(status) == expected
+
+
+@pytest.mark.parametrize("status", ["abc", "4x", "40", "4xxx", "600", "099", "404-", "500-400", "4xx-5xx"])
+def test_invalid_status_filter_is_rejected(status):
+    with pytest.raises(ValueError, match="status must be NNN, Nxx or NNN-NNN|range start"):
+        _status_range(status)
+
+
+def _record(status: int, request_id: str) -> RequestLogRecord:
+    return RequestLogRecord(
+        method="POST", path="/v1/chat/completions", status=status, model="glm-4.7", request_id=request_id, latency_ms=1
+    )
+
+
+def test_status_range_filters_store_and_memory_records(tmp_path):
+    records = [_record(status, f"req_{status}") for status in (200, 400, 404, 429, 500, 503)]
+    store = LogStore(tmp_path / "logs.db")
+    try:
+        for record in records:
+            store.append(record)
+        store.flush()
+        from_store = store.query(status="400-429")
+    finally:
+        store.close()
+    from_memory = query_records(records, status="400-429")
+
+    expected = {"req_400", "req_404", "req_429"}
+    assert {item["request_id"] for item in from_store["items"]} == expected
+    assert {item["request_id"] for item in from_memory["items"]} == expected
+
+
+def test_admin_logs_rejects_invalid_status_with_readable_message():
+    from app.server import app
+
+    response = TestClient(app).get("/admin/logs", params={"status": "oops"})
+
+    assert response.status_code == 400
+    message = response.json()["error"]["message"]
+    assert "status must be NNN, Nxx or NNN-NNN" in message
+    assert "invalid literal" not in message
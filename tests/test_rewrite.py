@@ -0,0 +1,173 @@
+"""单次遍历的请求体改写与原先逐步原地修改的实现结果一致
+
+``_baseline_*`` 是改写集中到 proxy.rewrite 之前 ReverseProxy._modify_request_body 的
+逻辑（按模型名前缀判断思考格式、原地规范化图片、再查找 system 消息注入提示词），
+作为对照。
+"""
+
+import copy
+from typing import Any, Dict, List
+
+import pytest
+
+from core.thinking import (
+    apply_thinking_to_glm,
+    apply_thinking_to_minimax,
+    extract_iflow_config,
+    extract_openai_config,
+    is_glm_model,
+    is_minimax_model,
+    parse_suffix,
+    parse_suffix_to_config,
+    strip_thinking_config,
+)
+from proxy.rewrite import (
+    _build_image_url_part,
+    _extract_image_url_from_part,
+    _is_image_part,
+    get_default_system_prompt,
+    rewrite_request,
+)
+
+
+def _baseline_apply_thinking(body: Dict[str, Any], model: str) -> Dict[str, Any]:
+    suffix_result = parse_suffix(model)
+    base_model = suffix_result.model_name
+    body["model"] = base_model
+    config = None
+    if suffix_result.has_suffix:
+        config = parse_suffix_to_config(suffix_result.raw_suffix)
+    if config is None:
+        config = extract_iflow_config(body)
+    if config is None:
+        config = extract_openai_config(body)
+    if config is None:
+        return body
+    body.pop("reasoning_effort", None)
+    body.pop("thinking", None)
+    if is_glm_model(base_model):
+        return apply_thinking_to_glm(body, config)
+    if is_minimax_model(base_model):
+        return apply_thinking_to_minimax(body, config)
+    return strip_thinking_config(body)
+
+
+def _baseline_normalize_openai_messages(messages: List[Dict[str, Any]]) -> None:
+    for msg in messages:
+        content = msg.get("content")
+        if not isinstance(content, list):
+            continue
+        normalized = []
+        changed = False
+        for part in content:
+            if isinstance(part, dict):
+                part_type = part.get("type", "")
+                if part_type == "input_text" and "text" in part:
+                    normalized.append({"type": "text", "text": part.get("text", "")})
+                    changed = True
+                    continue
+                is_image_like = part_type in ("image", "image_url", "input_image") or "image_url" in part or "source" in part
+                if is_image_like:
+                    url = _extract_image_url_from_part(part)
+                    if url:
+                        normalized.append(_build_image_url_part(part, url))
+                        changed = True
+                        continue
+            normalized.append(part)
+        if changed:
+            msg["content"] = normalized
+
+
+def _baseline_modify_request_body(body: Dict[str, Any], model: str) -> Dict[str, Any]:
+    processed = body.copy()
+    processed["model"] = model
+    processed = _baseline_apply_thinking(processed, model)
+    default_prompt = get_default_system_prompt()
+    messages = processed.get("messages", [])
+    _baseline_normalize_openai_messages(messages)
+    system_msg_idx = None
+    for idx, msg in enumerate(messages):
+        if msg.get("role") == "system":
+            system_msg_idx = idx
+            break
+    if system_msg_idx is not None:
+        existing_content = messages[system_msg_idx].get("content", "")
+        if isinstance(existing_content, str):
+            messages[system_msg_idx]["content"] = f"{default_prompt}\n\n{existing_content}"
+        elif isinstance(existing_content, list):
+            messages[system_msg_idx]["content"] = [{"type": "text", "text": default_prompt}] + existing_content
+    else:
+        messages.insert(0, {"role": "system", "content": default_prompt})
+    processed["messages"] = messages
+    return processed
+
+
+def _baseline_has_images(body: Dict[str, Any]) -> bool:
+    return any(
+        isinstance(msg.get("content"), list) and any(_is_image_part(part) for part in msg["content"])
+        for msg in body.get("messages", [])
+    )
+
+
+USER_TEXT = [{"role": "user", "content": "hello"}]
+
+IMAGE_MESSAGES = [
+    {"role": "system", "content": [{"type": "text", "text": "be brief"}]},
+    {
+        "role": "user",
+        "content": [
+            {"type": "input_text", "text": "what is this?"},
+            {"type": "input_image", "image_url": "https://example.com/a.png", "detail": "low"},
+            {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": "aGVs\nbG8="}},
+            {"type": "image", "source": {"type": "url", "url": " https://example.com/b.png "}},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA", "detail": "high"}},
+            {"type": "image", "url": "https://example.com/c.png"},
+            {"type": "text", "text": "plain"},
+            "bare string part",
+        ],
+    },
+    {"role": "assistant", "content": "It is a cat.", "reasoning_content": "looks like a cat"},
+    {"role": "user", "content": [{"type": "text", "text": "thanks"}]},
+]
+
+CASES = {
+    "no_system_message": ("glm-4.7", {"messages": USER_TEXT}),
+    "string_system_message": (
+        "qwen3-coder-plus",
+        {"messages": [{"role": "system", "content": "you are terse"}] + USER_TEXT + [{"role": "system", "content": "second"}]},
+    ),
+    "list_system_with_images": ("qwen3-vl-plus", {"messages": IMAGE_MESSAGES, "max_tokens": 2048}),
+    "images_without_system": ("glm-4.7", {"messages": IMAGE_MESSAGES[1:], "stream": True}),
+    "glm_budget_suffix": ("glm-4.7(8192)", {"messages": USER_TEXT}),
+    "glm_level_suffix": ("glm-5(high)", {"messages": USER_TEXT, "reasoning_effort": "low"}),
+    "glm_disabled_suffix": ("glm-4.7(none)", {"messages": USER_TEXT, "chat_template_kwargs": {"foo": 1}}),
+    "minimax_suffix": ("minimax-m2.5(low)", {"messages": USER_TEXT}),
+    "unsupported_model_suffix": ("deepseek-v3.2(high)", {"messages": USER_TEXT, "chat_template_kwargs": {"enable_thinking": True}}),
+    "glm_reasoning_effort": ("glm-4.7", {"messages": USER_TEXT, "reasoning_effort": "medium"}),
+    "glm_anthropic_thinking": ("glm-4.7", {"messages": USER_TEXT, "thinking": {"type": "enabled", "budget_tokens": 2048}}),
+    "minimax_iflow_format": ("minimax-m2.5", {"messages": USER_TEXT, "reasoning_split": False}),
+    "no_thinking_config": ("kimi-k2", {"messages": USER_TEXT, "temperature": 0.2}),
+}
+
+
+@pytest.mark.parametrize("name", list(CASES))
+def test_rewrite_matches_baseline(name):
+    model, body = CASES[name]
+    original = copy.deepcopy(body)
+
+    rewritten, facts = rewrite_request(body, model)
+
+    assert rewritten == _baseline_modify_request_body(copy.deepcopy(original), model)
+    assert facts.has_images == _baseline_has_images(original)
+    # 调用方的请求体与消息不被修改（续写与重试复用同一请求体）
+    assert body == original
+
+
+def test_rewrite_is_stable_across_calls():
+    """按模型名缓存的方案不会在多次改写之间泄漏状态"""
+    model, body = CASES["glm_budget_suffix"]
+    first, _ = rewrite_request(body, model)
+    second, _ = rewrite_request(body, model)
+    assert first == second
+    assert first["messages"] is not second["messages"]
+    assert first["messages"][0]["content"] == get_default_system_prompt()
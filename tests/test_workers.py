@@ -0,0 +1,15 @@
+"""零停机重启只在验证过的 uvicorn 版本上启用"""
+
+import pytest
+
+from app import workers
+
+
+@pytest.mark.parametrize(
+    "version, expected",
+    [((0, 54), True), ((0, 53), False), ((0, 55), False), ((1, 0), False), ((), False)],
+)
+def test_handoff_requires_verified_uvicorn(monkeypatch, version, expected):
+    monkeypatch.setattr(workers, "_platform_supports_handoff", lambda: True)
+    monkeypatch.setattr(workers, "_uvicorn_version", lambda: version)
+    assert workers.supports_handoff() is expected